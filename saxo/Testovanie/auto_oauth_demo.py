@@ -27,7 +27,7 @@ import argparse
 from http.server import BaseHTTPRequestHandler, HTTPServer
 from urllib.parse import urlencode, parse_qs
 
-import requests
+from http_transport import get_session
 
 # --- Configure ---
 CLIENT_ID = os.getenv("SAXO_CLIENT_ID", "TU_DAJ_SVOJ_APPKEY")
@@ -100,7 +100,7 @@ def try_refresh(tokens):
         pass
     headers = {'Content-Type': 'application/x-www-form-urlencoded', 'Accept': 'application/json'}
     try:
-        r = requests.post(TOKEN_URL, data=data, headers=headers, timeout=30)
+        r = get_session().post(TOKEN_URL, data=data, headers=headers, timeout=30)
         if r.status_code == 200:
             new_tokens = r.json()
             new_tokens['obtained_at'] = int(time.time())
@@ -191,7 +191,7 @@ def main():
         data["code_verifier"] = verifier
 
     headers = {"Content-Type": "application/x-www-form-urlencoded", "Accept": "application/json"}
-    r = requests.post(TOKEN_URL, data=data, headers=headers, timeout=30)
+    r = get_session().post(TOKEN_URL, data=data, headers=headers, timeout=30)
     print(f"Token exchange: {r.status_code}")
     if not (200 <= r.status_code < 300):
         raise SystemExit(f"Výmena kódu zlyhala: {r.status_code} {r.text}")
@@ -0,0 +1,406 @@
+#!/usr/bin/env python3
+"""Benchmarks for positions_store.py.
+
+Default: GET /positions latency during sustained concurrent /ingest.
+
+Starts positions_store.py as a subprocess on a temporary database (one run per
+journal mode), then runs ingest writer threads that continuously POST Saxo-shaped
+position snapshots while reader threads poll GET /positions. Reports reader latency
+percentiles and ingest throughput for each mode.
+
+    python3 bench_positions_store.py                       # WAL vs DELETE, 20 s each
+    python3 bench_positions_store.py --modes WAL --duration 60 --positions 2000
+    python3 bench_positions_store.py --url http://localhost:8090   # existing server
+    python3 bench_positions_store.py --modes WAL --ingest-mode async --writers 8
+    python3 bench_positions_store.py --modes WAL --servers dev,gunicorn   # dev server vs gunicorn
+
+--bulk N: POST one N-position payload (cold insert, then a re-priced update) and
+check the server-side elapsed_ms against INGEST_BUDGET_MS; exits 1 on overrun.
+
+    python3 bench_positions_store.py --bulk 50000
+
+--scale N: seed N positions, then measure re-priced ingest throughput and GET
+latency/throughput for the full snapshot, a filtered page and a point lookup, and
+time the v1 -> v2 schema migration of an N-row database.
+
+    python3 bench_positions_store.py --scale 100000
+
+--export N: seed N positions and compare GET /positions (JSON, parsed into numpy
+columns) with /export/positions in every installed columnar format: body size,
+fetch time and client-side parse time.
+
+    python3 bench_positions_store.py --export 100000
+
+For throughput/latency runs with saved JSON results and regression checks against
+a baseline, see loadtest_positions.py.
+"""
+import os
+import sys
+import time
+import random
+import socket
+import io
+import json
+import argparse
+import tempfile
+import threading
+import subprocess
+
+from http_transport import build_session
+import positions_schema
+import positions_export
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+
+def make_payload(n: int, uic_base: int = 1000, accounts: int = 3, rng: random.Random = None) -> dict:
+    """Saxo /port/v1/positions/me shaped payload with `n` positions and jittered prices."""
+    rng = rng or random.Random()
+    data = []
+    for i in range(n):
+        uic = uic_base + i
+        price = 50.0 + (uic % 400) * (1.0 + rng.uniform(-0.02, 0.02))
+        data.append({
+            "PositionBase": {
+                "Uic": uic,
+                "AccountId": f"ACC{i % accounts}",
+                "Amount": float((i % 20 + 1) * 10),
+                "AssetType": "Stock" if i % 4 else "StockOption",
+            },
+            "DisplayAndFormat": {"Symbol": f"SYM{uic}:xnas"},
+            "PositionView": {"CurrentPrice": round(price, 4), "ProfitLossOnTrade": round(rng.uniform(-500, 500), 2)},
+        })
+    return {"Data": data}
+
+
+def percentile(values, p: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    idx = min(len(ordered) - 1, int(round(p / 100.0 * (len(ordered) - 1))))
+    return ordered[idx]
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+SERVER_CMDS = {
+    "dev": [sys.executable, os.path.join(HERE, "positions_store.py")],
+    "gunicorn": [sys.executable, "-m", "gunicorn", "-c", os.path.join(HERE, "gunicorn.conf.py"), "positions_store:app"],
+}
+
+
+def start_server(db_path: str, env: dict = None, cmd: list = None):
+    """Launch positions_store.py in a subprocess and wait until /health answers."""
+    port = _free_port()
+    full_env = dict(os.environ, HOST="127.0.0.1", PORT=str(port), DB_PATH=db_path,
+                    THRESHOLDS_FILE=os.path.join(os.path.dirname(db_path), "thresholds.json"),
+                    BACKUP_DIR=os.path.join(os.path.dirname(db_path), "backups"))
+    full_env.update(env or {})
+    proc = subprocess.Popen(cmd or SERVER_CMDS["dev"],
+                            cwd=HERE, env=full_env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    url = f"http://127.0.0.1:{port}"
+    s = build_session()
+    deadline = time.time() + 20
+    while time.time() < deadline:
+        try:
+            if s.get(f"{url}/health", timeout=1).ok:
+                return proc, url
+        except Exception:
+            time.sleep(0.1)
+    proc.kill()
+    raise RuntimeError("positions store did not start")
+
+
+def stop_server(proc):
+    proc.terminate()
+    try:
+        proc.wait(timeout=10)
+    except subprocess.TimeoutExpired:
+        proc.kill()
+
+
+def run_concurrent(url: str, duration: float, writers: int, readers: int, positions: int) -> dict:
+    stop = threading.Event()
+    read_lat, ingest_lat = [], []
+    errors = {"read": 0, "ingest": 0}
+    lock = threading.Lock()
+
+    def writer(idx):
+        s = build_session()
+        rng = random.Random(idx)
+        while not stop.is_set():
+            payload = make_payload(positions, uic_base=1000 + idx * positions, rng=rng)
+            t0 = time.perf_counter()
+            try:
+                r = s.post(f"{url}/ingest", json=payload, timeout=30)
+                ok = r.status_code < 300
+            except Exception:
+                ok = False
+            dt = (time.perf_counter() - t0) * 1000.0
+            with lock:
+                if ok:
+                    ingest_lat.append(dt)
+                else:
+                    errors["ingest"] += 1
+
+    def reader(idx):
+        s = build_session()
+        while not stop.is_set():
+            t0 = time.perf_counter()
+            try:
+                ok = s.get(f"{url}/positions", timeout=30).ok
+            except Exception:
+                ok = False
+            dt = (time.perf_counter() - t0) * 1000.0
+            with lock:
+                if ok:
+                    read_lat.append(dt)
+                else:
+                    errors["read"] += 1
+
+    threads = [threading.Thread(target=writer, args=(i,), daemon=True) for i in range(writers)]
+    threads += [threading.Thread(target=reader, args=(i,), daemon=True) for i in range(readers)]
+    for t in threads:
+        t.start()
+    time.sleep(duration)
+    stop.set()
+    for t in threads:
+        t.join(timeout=35)
+
+    return {
+        "get_count": len(read_lat),
+        "get_p50_ms": percentile(read_lat, 50),
+        "get_p95_ms": percentile(read_lat, 95),
+        "get_p99_ms": percentile(read_lat, 99),
+        "get_max_ms": max(read_lat) if read_lat else 0.0,
+        "ingest_count": len(ingest_lat),
+        "ingest_positions_per_s": len(ingest_lat) * positions / duration,
+        "ingest_p99_ms": percentile(ingest_lat, 99),
+        "errors": errors,
+    }
+
+
+def run_bulk(url: str, n: int) -> list:
+    s = build_session()
+    results = []
+    for label, seed in (("insert", 1), ("update", 2)):
+        payload = make_payload(n, rng=random.Random(seed))
+        t0 = time.perf_counter()
+        r = s.post(f"{url}/ingest", json=payload, timeout=120)
+        r.raise_for_status()
+        body = r.json()
+        results.append({
+            "phase": label,
+            "positions": n,
+            "updated": body.get("updated"),
+            "server_ms": body.get("elapsed_ms"),
+            "roundtrip_ms": (time.perf_counter() - t0) * 1000.0,
+        })
+    return results
+
+
+def _timed_gets(s, url: str, n: int) -> dict:
+    lat = []
+    t0 = time.perf_counter()
+    for _ in range(n):
+        t1 = time.perf_counter()
+        s.get(url, timeout=60).raise_for_status()
+        lat.append((time.perf_counter() - t1) * 1000.0)
+    return {"req_per_s": n / (time.perf_counter() - t0), "p50_ms": percentile(lat, 50), "p99_ms": percentile(lat, 99)}
+
+
+def _slice_payload(start: int, count: int, rng: random.Random) -> dict:
+    # positions start..start+count of one n-row book; accounts stay stable per uic
+    payload = make_payload(count, uic_base=1000 + start, rng=rng)
+    for i, p in enumerate(payload["Data"]):
+        p["PositionBase"]["AccountId"] = f"ACC{(start + i) % 3}"
+    return payload
+
+
+def run_scale(url: str, n: int, batch: int = 1000, batches: int = 50) -> dict:
+    """Seed `n` positions, then time re-priced ingest batches and the read paths."""
+    s = build_session()
+    for base in range(0, n, 20000):
+        payload = _slice_payload(base, min(20000, n - base), random.Random(base))
+        s.post(f"{url}/ingest", json=payload, timeout=120).raise_for_status()
+
+    rng = random.Random(7)
+    updated = 0
+    t0 = time.perf_counter()
+    for _ in range(batches):
+        start = rng.randrange(0, max(1, n - batch))
+        payload = _slice_payload(start, batch, rng)
+        updated += s.post(f"{url}/ingest", json=payload, timeout=60).json().get("updated", 0)
+    ingest_s = time.perf_counter() - t0
+
+    return {
+        "rows": n,
+        "ingest_positions_per_s": batches * batch / ingest_s,
+        "ingest_updated": updated,
+        "full": _timed_gets(s, f"{url}/positions", 20),
+        "page": _timed_gets(s, f"{url}/positions?account=ACC1&limit=1000", 200),
+        "point": _timed_gets(s, f"{url}/positions/{1000 + n // 2}?account=ACC{(n // 2) % 3}", 500),
+    }
+
+
+def run_migration(n: int) -> float:
+    """Build an n-row v1 database and time its online migration to the latest schema (ms)."""
+    path = os.path.join(tempfile.mkdtemp(prefix="bench_migrate_"), "positions.db")
+    connect = positions_schema.connect_factory(path)
+    with connect() as conn:
+        conn.execute("PRAGMA journal_mode=WAL")
+    positions_schema.migrate(connect, target=1)
+    now = int(time.time())
+    with connect() as conn:
+        conn.executemany("INSERT INTO positions VALUES (?,?,?,?,?,?,?)",
+                         ((1000 + i, f"SYM{i}", f"ACC{i % 3}", 10.0, 100.0, 0.0, now) for i in range(n)))
+    t0 = time.perf_counter()
+    positions_schema.migrate(connect)
+    return (time.perf_counter() - t0) * 1000.0
+
+
+def _parse_json_columns(body: bytes):
+    import numpy as np
+    data = json.loads(body)["data"]
+    return {c: np.array([r[c] for r in data]) for c in ("uic", "symbol", "account_id", "amount",
+                                                         "last_price", "pnl", "updated_at")}
+
+
+def _parse_columnar(fmt: str, body: bytes):
+    if fmt == "arrow":
+        import pyarrow as pa
+        return pa.ipc.open_stream(body).read_all()
+    if fmt == "parquet":
+        import pyarrow.parquet as pq
+        return pq.read_table(io.BytesIO(body))
+    import numpy as np
+    return np.load(io.BytesIO(body))
+
+
+def run_export(url: str, n: int, repeat: int = 5) -> list:
+    """Size, fetch and parse time of the JSON snapshot vs each columnar export format."""
+    s = build_session()
+    for base in range(0, n, 20000):
+        payload = _slice_payload(base, min(20000, n - base), random.Random(base))
+        s.post(f"{url}/ingest", json=payload, timeout=120).raise_for_status()
+    s.get(f"{url}/positions", timeout=60)  # warm the read model
+    cases = [("json", f"{url}/positions", _parse_json_columns)]
+    for fmt in positions_export.available_formats():
+        cases.append((fmt, f"{url}/export/positions?format={fmt}", lambda body, f=fmt: _parse_columnar(f, body)))
+    results = []
+    for name, target, parse in cases:
+        fetch, parse_ms = [], []
+        for _ in range(repeat):
+            t0 = time.perf_counter()
+            body = s.get(target, headers={"Accept-Encoding": "identity"}, timeout=120).content
+            t1 = time.perf_counter()
+            parse(body)
+            fetch.append((t1 - t0) * 1000.0)
+            parse_ms.append((time.perf_counter() - t1) * 1000.0)
+        results.append({"format": name, "bytes": len(body), "first_fetch_ms": fetch[0],
+                        "fetch_ms": percentile(fetch, 50), "parse_ms": percentile(parse_ms, 50)})
+    return results
+
+
+def _print(label: str, res: dict):
+    print(f"[{label}] GET n={res['get_count']} p50={res['get_p50_ms']:.2f}ms p95={res['get_p95_ms']:.2f}ms "
+          f"p99={res['get_p99_ms']:.2f}ms max={res['get_max_ms']:.2f}ms | ingest n={res['ingest_count']} "
+          f"{res['ingest_positions_per_s']:.0f} pos/s p99={res['ingest_p99_ms']:.2f}ms | errors={res['errors']}")
+
+
+def main():
+    ap = argparse.ArgumentParser(description="GET /positions latency under concurrent /ingest")
+    ap.add_argument("--url", default=None, help="Benchmark an already running store instead of launching one")
+    ap.add_argument("--modes", default="WAL,DELETE", help="SQLITE_JOURNAL_MODE values to compare (default WAL,DELETE)")
+    ap.add_argument("--duration", type=float, default=20.0, help="Seconds per run (default 20)")
+    ap.add_argument("--servers", default="dev", help="Comma list of servers to compare: dev, gunicorn (default dev)")
+    ap.add_argument("--ingest-mode", default="sync", choices=["sync", "async"],
+                    help="INGEST_MODE of the launched store (default sync)")
+    ap.add_argument("--writers", type=int, default=2, help="Concurrent ingest threads (default 2)")
+    ap.add_argument("--readers", type=int, default=4, help="Concurrent GET threads (default 4)")
+    ap.add_argument("--positions", type=int, default=500, help="Positions per ingest payload (default 500)")
+    ap.add_argument("--bulk", type=int, default=0, help="Run the single-payload bulk ingest check with N positions")
+    ap.add_argument("--scale", type=int, default=0, help="Run the N-row read/ingest/migration benchmark")
+    ap.add_argument("--export", type=int, default=0, help="Run the N-row JSON vs columnar export comparison")
+    ap.add_argument("--budget-ms", type=float, default=float(os.getenv("INGEST_BUDGET_MS", "1000")),
+                    help="Server-side time budget for --bulk (default INGEST_BUDGET_MS or 1000)")
+    args = ap.parse_args()
+
+    if args.bulk:
+        proc = None
+        url = args.url
+        if not url:
+            proc, url = start_server(os.path.join(tempfile.mkdtemp(prefix="bench_positions_"), "positions.db"))
+        try:
+            results = run_bulk(url, args.bulk)
+        finally:
+            if proc:
+                stop_server(proc)
+        over = False
+        for res in results:
+            flag = "OK" if res["server_ms"] <= args.budget_ms else "OVER BUDGET"
+            over = over or flag != "OK"
+            print(f"[bulk {res['phase']}] {res['positions']} positions updated={res['updated']} "
+                  f"server={res['server_ms']:.1f}ms roundtrip={res['roundtrip_ms']:.1f}ms "
+                  f"budget={args.budget_ms:.0f}ms {flag}")
+        return 1 if over else 0
+
+    if args.scale:
+        proc = None
+        url = args.url
+        if not url:
+            proc, url = start_server(os.path.join(tempfile.mkdtemp(prefix="bench_positions_"), "positions.db"))
+        try:
+            res = run_scale(url, args.scale)
+        finally:
+            if proc:
+                stop_server(proc)
+        print(f"[scale] rows={res['rows']} ingest {res['ingest_positions_per_s']:.0f} pos/s "
+              f"(updated {res['ingest_updated']})")
+        for name in ("full", "page", "point"):
+            r = res[name]
+            print(f"[scale] GET {name:<5} {r['req_per_s']:8.1f} req/s p50={r['p50_ms']:.2f}ms p99={r['p99_ms']:.2f}ms")
+        print(f"[scale] migrate v1 -> v{positions_schema.LATEST} of {args.scale} rows: "
+              f"{run_migration(args.scale):.0f} ms")
+        return 0
+
+    if args.export:
+        proc = None
+        url = args.url
+        if not url:
+            proc, url = start_server(os.path.join(tempfile.mkdtemp(prefix="bench_positions_"), "positions.db"))
+        try:
+            results = run_export(url, args.export)
+        finally:
+            if proc:
+                stop_server(proc)
+        for res in results:
+            print(f"[export] {res['format']:<8} {res['bytes'] / 1e6:8.2f} MB "
+                  f"first={res['first_fetch_ms']:.0f}ms fetch={res['fetch_ms']:.0f}ms "
+                  f"parse={res['parse_ms']:.1f}ms")
+        return 0
+
+    if args.url:
+        _print(args.url, run_concurrent(args.url, args.duration, args.writers, args.readers, args.positions))
+        return 0
+
+    for server in [v.strip() for v in args.servers.split(",") if v.strip()]:
+        for mode in [m.strip() for m in args.modes.split(",") if m.strip()]:
+            tmp = tempfile.mkdtemp(prefix="bench_positions_")
+            proc, url = start_server(os.path.join(tmp, "positions.db"),
+                                     {"SQLITE_JOURNAL_MODE": mode, "INGEST_MODE": args.ingest_mode},
+                                     cmd=SERVER_CMDS[server])
+            try:
+                _print(f"{server}/{mode}/{args.ingest_mode}",
+                       run_concurrent(url, args.duration, args.writers, args.readers, args.positions))
+            finally:
+                stop_server(proc)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
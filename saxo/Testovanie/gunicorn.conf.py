@@ -0,0 +1,93 @@
+"""Gunicorn settings for the positions store (the container default).
+
+    gunicorn -c gunicorn.conf.py positions_store:app
+
+gthread workers: each worker process serves WEB_THREADS requests concurrently from
+its own connection pool and read model (both sync through store_meta.version, so
+workers stay consistent). SQLite still has a single writer; extra workers add read
+capacity and keep a slow /ingest from blocking GETs.
+
+Graceful reload: `kill -HUP <master pid>` starts workers with the new code and lets
+the old ones finish in-flight requests (up to WEB_GRACEFUL_TIMEOUT). Schema
+migrations run once in a separate process before the first worker starts, so a
+release that adds a migration needs a restart rather than HUP. Every worker runs its
+own async ingest writer and history retention job (chunked, idempotent deletes) and
+backup job (a lock file lets only one worker copy at a time). A worker leaving on
+reload or shutdown ends its open /positions/stream connections as soon as it gets
+SIGTERM (clients reconnect with Last-Event-ID), then commits its queued async rows
+and writes its buffered audit records (worker_exit).
+
+Thread budget: every request, including each open /positions/stream, holds one of a
+worker's WEB_THREADS threads until it finishes, and an SSE stream only finishes when
+its client leaves. A worker therefore accepts at most SSE_MAX_STREAMS (default
+WEB_THREADS / 2) streams and answers 503 above that, keeping the other threads for
+GET/ingest traffic. Capacity is WEB_WORKERS * SSE_MAX_STREAMS streams (8 by default);
+for more dashboards raise WEB_THREADS (and DB_POOL_SIZE) or WEB_WORKERS.
+
+STORE_BACKEND=memory keeps positions inside the worker process, so it always runs a
+single worker: several would each hold a separate, diverging book.
+
+Config via env:
+- HOST / PORT (default 0.0.0.0 / 8090)
+- WEB_WORKERS (default 2) worker processes
+- WEB_THREADS (default 8) request threads per worker, SSE streams included (see the
+  thread budget above); keep DB_POOL_SIZE >= this
+- WEB_MAX_CONNECTIONS (default 200) open client connections per worker, excess wait in the backlog
+- WEB_BACKLOG (default 512) pending connections the kernel queues
+- WEB_KEEPALIVE_S (default 5)
+- WEB_GRACEFUL_TIMEOUT (default 30) seconds old workers get on reload/shutdown
+- WEB_MAX_REQUESTS (default 0 = never) recycle a worker after this many requests
+"""
+import os
+import sys
+import signal
+import subprocess
+
+bind = f"{os.getenv('HOST', '0.0.0.0')}:{os.getenv('PORT', '8090')}"
+worker_class = "gthread"
+workers = int(os.getenv("WEB_WORKERS", "2"))
+if os.getenv("STORE_BACKEND", "sqlite") == "memory":
+    workers = 1
+threads = int(os.getenv("WEB_THREADS", "8"))
+worker_connections = int(os.getenv("WEB_MAX_CONNECTIONS", "200"))
+backlog = int(os.getenv("WEB_BACKLOG", "512"))
+keepalive = int(os.getenv("WEB_KEEPALIVE_S", "5"))
+graceful_timeout = int(os.getenv("WEB_GRACEFUL_TIMEOUT", "30"))
+# gthread heartbeats independently of requests, so long SSE streams are not killed by this
+timeout = 60
+max_requests = int(os.getenv("WEB_MAX_REQUESTS", "0"))
+max_requests_jitter = max_requests // 10
+# the app is imported in each worker, never in the master, so HUP picks up new code
+preload_app = False
+accesslog = None
+errorlog = "-"
+
+
+def on_starting(server):
+    here = os.path.dirname(os.path.abspath(__file__))
+    db_path = os.getenv("DB_PATH", "/data/positions.db")
+    os.makedirs(os.path.dirname(db_path) or ".", exist_ok=True)
+    # separate process: importing the store here would pin its modules in the master
+    subprocess.run([sys.executable, os.path.join(here, "positions_backends.py"), "init", db_path], check=True)
+
+
+def post_worker_init(worker):
+    import positions_store
+    positions_store.start_background()
+    handle_exit = worker.handle_exit
+
+    # SIGTERM only stops accepting; without this, open SSE streams would keep the worker
+    # (and a HUP) waiting the full graceful_timeout. The main thread never holds the
+    # store's change condition, so notifying it from the handler is safe.
+    def on_sigterm(sig, frame):
+        positions_store.stop_streams()
+        handle_exit(sig, frame)
+
+    signal.signal(signal.SIGTERM, on_sigterm)
+    signal.siginterrupt(signal.SIGTERM, False)
+
+
+def worker_exit(server, worker):
+    import positions_store
+    # 202-acknowledged rows and audit records are still in memory; the master kills after graceful_timeout
+    positions_store.shutdown(timeout=graceful_timeout)
@@ -0,0 +1,196 @@
+#!/usr/bin/env python3
+"""Record/replay of HTTP traffic for deterministic offline runs.
+
+Recording wraps the adapters of a `requests.Session` (normally the shared one from
+`http_transport.get_session()`) and appends every request/response pair to a
+gzip-compressed JSON-lines log. Replay mounts an adapter that serves those pairs
+back without touching the network, optionally time-compressed, so full trading
+cycles can be benchmarked and profiled on identical inputs.
+
+Responses are matched by (method, url, request body); repeated identical requests
+are served in recorded order. Token values are redacted before anything is written.
+
+Config via env (see install_from_env):
+- SAXO_RECORD=path        record traffic to `path` (.jsonl.gz)
+- SAXO_REPLAY=path        serve traffic from `path` instead of the network
+- SAXO_REPLAY_SPEED=N     replay speed factor: 1 = recorded latency, 10 = 10x faster,
+                          0 (default) = no delay at all
+"""
+import os
+import gzip
+import json
+import time
+import atexit
+import hashlib
+import threading
+from collections import defaultdict, deque
+from typing import Dict, Optional, Tuple
+
+import requests
+from requests.adapters import BaseAdapter
+from requests.structures import CaseInsensitiveDict
+
+
+_REDACT_KEYS = ("access_token", "refresh_token", "id_token")
+_KEEP_HEADERS = ("Content-Type", "ETag")
+
+
+def _body_bytes(body) -> bytes:
+    if body is None:
+        return b""
+    if isinstance(body, str):
+        return body.encode("utf-8")
+    return bytes(body)
+
+
+def _key(method: str, url: str, body) -> Tuple[str, str, str]:
+    digest = hashlib.sha1(_body_bytes(body)).hexdigest() if body else ""
+    return method.upper(), url, digest
+
+
+def _redact(text: str) -> str:
+    if not any(k in text for k in _REDACT_KEYS):
+        return text
+    try:
+        data = json.loads(text)
+    except ValueError:
+        return text
+    if isinstance(data, dict):
+        for k in _REDACT_KEYS:
+            if k in data:
+                data[k] = "REDACTED"
+    return json.dumps(data, separators=(",", ":"))
+
+
+class RecordingAdapter(BaseAdapter):
+    """Delegates to the wrapped adapter and logs each exchange."""
+
+    def __init__(self, inner: BaseAdapter, log: "TrafficLog"):
+        super().__init__()
+        self.inner = inner
+        self.log = log
+
+    def send(self, request, **kwargs):
+        t0 = time.perf_counter()
+        resp = self.inner.send(request, **kwargs)
+        self.log.append(request, resp, time.perf_counter() - t0)
+        return resp
+
+    def close(self):
+        self.inner.close()
+
+
+class TrafficLog:
+    """Append-only gzip JSONL writer shared by the recording adapters."""
+
+    def __init__(self, path: str):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.path = path
+        self._f = gzip.open(path, "at", encoding="utf-8")
+        self._lock = threading.Lock()
+        self._t0 = time.monotonic()
+        atexit.register(self.close)
+
+    def append(self, request, resp, elapsed: float):
+        method, url, digest = _key(request.method, request.url, request.body)
+        entry = {
+            "t": round(time.monotonic() - self._t0, 4),
+            "m": method,
+            "u": url,
+            "b": digest,
+            "s": resp.status_code,
+            "h": {k: resp.headers[k] for k in _KEEP_HEADERS if k in resp.headers},
+            "d": _redact(resp.text) if resp.content else "",
+            "e": round(elapsed, 4),
+        }
+        line = json.dumps(entry, separators=(",", ":"), ensure_ascii=False)
+        with self._lock:
+            if not self._f.closed:
+                self._f.write(line + "\n")
+
+    def close(self):
+        with self._lock:
+            if not self._f.closed:
+                self._f.close()
+
+
+def load_log(path: str) -> list:
+    entries = []
+    with gzip.open(path, "rt", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if line:
+                entries.append(json.loads(line))
+    return entries
+
+
+class ReplayAdapter(BaseAdapter):
+    """Serves recorded responses; raises ConnectionError for unrecorded requests."""
+
+    def __init__(self, path: str, speed: float = 0.0, loop: bool = True):
+        super().__init__()
+        self.speed = speed
+        self.loop = loop
+        self._recorded: Dict[tuple, list] = defaultdict(list)
+        for e in load_log(path):
+            self._recorded[(e["m"], e["u"], e["b"])].append(e)
+        self._queues: Dict[tuple, deque] = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def _next(self, key) -> Optional[dict]:
+        with self._lock:
+            q = self._queues.get(key)
+            if not q:
+                entries = self._recorded.get(key)
+                if not entries or (q is not None and not self.loop):
+                    self.misses += 1
+                    return None
+                q = self._queues[key] = deque(entries)
+            self.hits += 1
+            return q.popleft()
+
+    def send(self, request, **kwargs):
+        entry = self._next(_key(request.method, request.url, request.body))
+        if entry is None:
+            raise requests.exceptions.ConnectionError(
+                f"replay: no recorded response for {request.method} {request.url}", request=request)
+        if self.speed > 0:
+            time.sleep(entry["e"] / self.speed)
+        resp = requests.Response()
+        resp.status_code = entry["s"]
+        resp.headers = CaseInsensitiveDict(entry["h"])
+        resp._content = entry["d"].encode("utf-8")
+        resp.encoding = "utf-8"
+        resp.url = request.url
+        resp.request = request
+        return resp
+
+    def close(self):
+        return
+
+
+def start_recording(session: requests.Session, path: str) -> TrafficLog:
+    log = TrafficLog(path)
+    for prefix in ("https://", "http://"):
+        session.mount(prefix, RecordingAdapter(session.get_adapter(prefix), log))
+    return log
+
+
+def start_replay(session: requests.Session, path: str, speed: float = 0.0, loop: bool = True) -> ReplayAdapter:
+    adapter = ReplayAdapter(path, speed=speed, loop=loop)
+    for prefix in ("https://", "http://"):
+        session.mount(prefix, adapter)
+    return adapter
+
+
+def install_from_env(session: requests.Session):
+    """Enable recording or replay on `session` according to SAXO_RECORD / SAXO_REPLAY."""
+    replay = os.getenv("SAXO_REPLAY")
+    if replay:
+        return start_replay(session, replay, speed=float(os.getenv("SAXO_REPLAY_SPEED", "0")))
+    record = os.getenv("SAXO_RECORD")
+    if record:
+        return start_recording(session, record)
+    return None
@@ -0,0 +1,151 @@
+#!/usr/bin/env python3
+"""Shared HTTP transport for saxo services.
+
+One process-wide `requests.Session` with a tuned connection pool per host,
+keep-alive, read-only retries, a default timeout and compressed responses.
+All entry points (trader, live reader, token refreshers, OAuth helpers) go through
+`get_session()` so repeated calls to the Saxo gateway, the token endpoints and the
+positions store reuse TLS connections instead of paying a handshake per call.
+
+Optional HTTP/2: set HTTP2=1 and install `httpx[http2]`; requests are then sent
+through an httpx client mounted as a requests adapter, so callers keep the
+requests API (responses, exceptions) unchanged.
+
+Config via env:
+- HTTP_POOL_CONNECTIONS (default 10) number of per-host pools kept
+- HTTP_POOL_MAXSIZE (default 10) connections kept alive per host
+- HTTP_RETRIES (default 3) retries for GET/HEAD/OPTIONS
+- HTTP_TIMEOUT (default 30) seconds, used when the caller passes no timeout
+- HTTP2 (default 0) enable HTTP/2 if httpx + h2 are installed
+"""
+import os
+import threading
+from typing import Optional
+
+import requests
+from requests.adapters import HTTPAdapter, BaseAdapter
+from requests.structures import CaseInsensitiveDict
+from urllib3.util.retry import Retry
+from urllib3.util.request import ACCEPT_ENCODING
+
+
+POOL_CONNECTIONS = int(os.getenv("HTTP_POOL_CONNECTIONS", "10"))
+POOL_MAXSIZE = int(os.getenv("HTTP_POOL_MAXSIZE", "10"))
+RETRIES = int(os.getenv("HTTP_RETRIES", "3"))
+DEFAULT_TIMEOUT = float(os.getenv("HTTP_TIMEOUT", "30"))
+HTTP2 = os.getenv("HTTP2", "0").lower() in ("1", "true", "yes")
+
+# Only read-only methods are retried. POST places orders and exchanges tokens; PUT and
+# DELETE modify and cancel orders, and a 5xx/timeout after the gateway already applied
+# one would repeat it.
+_RETRY_METHODS = frozenset(["GET", "HEAD", "OPTIONS"])
+_RETRY_STATUSES = (429, 502, 503, 504)
+
+_session: Optional[requests.Session] = None
+_lock = threading.Lock()
+
+
+class TimeoutSession(requests.Session):
+    """Session that applies DEFAULT_TIMEOUT when the caller does not pass one."""
+
+    def __init__(self, timeout: float = DEFAULT_TIMEOUT):
+        super().__init__()
+        self.default_timeout = timeout
+
+    def request(self, method, url, **kwargs):
+        if kwargs.get("timeout") is None:
+            kwargs["timeout"] = self.default_timeout
+        return super().request(method, url, **kwargs)
+
+
+class Http2Adapter(BaseAdapter):
+    """requests adapter backed by an httpx HTTP/2 client."""
+
+    def __init__(self, pool_maxsize: int = POOL_MAXSIZE):
+        super().__init__()
+        import httpx  # optional dependency
+
+        self._httpx = httpx
+        self._client = httpx.Client(
+            http2=True,
+            limits=httpx.Limits(max_connections=pool_maxsize * POOL_CONNECTIONS,
+                                max_keepalive_connections=pool_maxsize),
+        )
+
+    def send(self, request, stream=False, timeout=None, verify=True, cert=None, proxies=None):
+        if isinstance(timeout, tuple):
+            timeout = self._httpx.Timeout(timeout[1], connect=timeout[0])
+        try:
+            r = self._client.request(
+                request.method,
+                request.url,
+                headers=dict(request.headers),
+                content=request.body,
+                timeout=timeout,
+            )
+        except self._httpx.TimeoutException as e:
+            raise requests.exceptions.Timeout(str(e), request=request)
+        except self._httpx.TransportError as e:
+            raise requests.exceptions.ConnectionError(str(e), request=request)
+        resp = requests.Response()
+        resp.status_code = r.status_code
+        resp.reason = r.reason_phrase
+        resp.url = str(r.url)
+        resp.request = request
+        # httpx already decoded the body; drop the encoding header so nothing decodes twice
+        headers = CaseInsensitiveDict(r.headers)
+        headers.pop("content-encoding", None)
+        resp.headers = headers
+        resp.encoding = r.encoding
+        resp._content = r.content
+        resp.raw = None
+        return resp
+
+    def close(self):
+        self._client.close()
+
+
+def _http2_available() -> bool:
+    try:
+        import httpx  # noqa: F401
+        import h2  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+def build_session(timeout: float = DEFAULT_TIMEOUT, http2: bool = HTTP2) -> requests.Session:
+    """Create a new tuned session (use get_session() for the shared one)."""
+    s = TimeoutSession(timeout=timeout)
+    s.headers["Accept-Encoding"] = ACCEPT_ENCODING
+    if http2 and _http2_available():
+        s.mount("https://", Http2Adapter())
+    else:
+        retry = Retry(
+            total=RETRIES,
+            connect=RETRIES,
+            read=RETRIES,
+            status=RETRIES,
+            backoff_factor=0.3,
+            status_forcelist=_RETRY_STATUSES,
+            allowed_methods=_RETRY_METHODS,
+            raise_on_status=False,
+        )
+        s.mount("https://", HTTPAdapter(pool_connections=POOL_CONNECTIONS, pool_maxsize=POOL_MAXSIZE, max_retries=retry))
+    # plain http is only used for in-cluster services (token proxy, positions store)
+    s.mount("http://", HTTPAdapter(
+        pool_connections=POOL_CONNECTIONS,
+        pool_maxsize=POOL_MAXSIZE,
+        max_retries=Retry(total=RETRIES, backoff_factor=0.1, allowed_methods=_RETRY_METHODS, raise_on_status=False),
+    ))
+    return s
+
+
+def get_session() -> requests.Session:
+    """Return the process-wide shared session, creating it on first use."""
+    global _session
+    if _session is None:
+        with _lock:
+            if _session is None:
+                _session = build_session()
+    return _session
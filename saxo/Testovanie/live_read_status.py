@@ -11,9 +11,13 @@ import json
 import argparse
 import requests
 
+from http_transport import get_session
+import saxo_positions
+import wire_format
+
 
 def get_token(proxy_url: str, timeout: float = 5.0) -> str:
-    r = requests.get(proxy_url, timeout=timeout)
+    r = get_session().get(proxy_url, timeout=timeout)
     r.raise_for_status()
     data = r.json() or {}
     token = data.get("access_token")
@@ -32,12 +36,12 @@ def get_gateway_base(env: str | None = None) -> str:
 
 def _req_json(access_token: str, url: str, params: dict | None = None) -> requests.Response:
     headers = {"Authorization": f"Bearer {access_token}", "Accept": "application/json"}
-    return requests.get(url, headers=headers, params=(params or {}), timeout=30)
+    return get_session().get(url, headers=headers, params=(params or {}), timeout=30)
 
 
 def get_positions(access_token: str, gateway_base: str) -> dict:
     url = f"{gateway_base}/port/v1/positions/me"
-    params = {"FieldGroups": "PositionBase,DisplayAndFormat,PositionView"}
+    params = {"FieldGroups": saxo_positions.FIELD_GROUPS}
     r = _req_json(access_token, url, params)
     if r.status_code == 401:
         raise SystemExit("Unauthorized (401). Check that the token has 'read' scope and is LIVE.")
@@ -85,18 +89,10 @@ def main():
         gateway = get_gateway_base(args.env)
         if not args.no_positions:
             data = get_positions(token, gateway)
-            rows = data.get("Data") or data.get("Positions") or []
-            print(f"Positions count: {len(rows)}")
+            rows, skipped = saxo_positions.parse_all(data)
+            print(f"Positions count: {len(rows)}" + (f" (skipped {skipped} without Uic)" if skipped else ""))
             for p in rows[:5]:
-                base = p.get("PositionBase", {})
-                fmt = p.get("DisplayAndFormat", {})
-                view = p.get("PositionView", {})
-                sym = fmt.get("Symbol") or base.get("Symbol") or base.get("Uic")
-                acc = base.get("AccountId")
-                amt = base.get("Amount")
-                px = view.get("CurrentPrice")
-                pnl = view.get("ProfitLossOnTrade")
-                print(f"- {sym} acc={acc} amount={amt} price={px} PnL={pnl}")
+                print(f"- {p.symbol} acc={p.account_id} amount={p.amount} price={p.price} PnL={p.pnl}")
 
             if args.json_out or args.store_url:
                 try:
@@ -106,9 +102,13 @@ def main():
                             json.dump(data, f, indent=2)
                         print(f"Saved JSON to {args.json_out}")
                     if args.store_url:
-                        hdrs = {"Content-Type": "application/json"}
-                        rs = requests.post(args.store_url, headers=hdrs, data=json.dumps(data), timeout=15)
-                        print(f"Store ingest status: {rs.status_code} {rs.text[:200]}")
+                        # compressed / MessagePack per STORE_WIRE_*, plain JSON fallback on 415
+                        rs = wire_format.post(get_session(), args.store_url, data, timeout=15)
+                        try:
+                            summary = str(wire_format.response_body(rs))
+                        except Exception:
+                            summary = rs.text
+                        print(f"Store ingest status: {rs.status_code} {summary[:200]}")
                 except Exception as e:
                     print(f"Warning: failed to write JSON: {e}")
 
@@ -0,0 +1,465 @@
+#!/usr/bin/env python3
+"""Load-test suite for positions_store.py with JSON results and regression checks.
+
+Generates Saxo /port/v1/positions shaped books (several accounts, mixed asset types,
+prices following a random walk between snapshots, so the store's thresholds filter a
+realistic share of each payload) and runs timed workloads against the store:
+
+- ingest: `--writers` threads POST snapshots of `--sizes` positions back to back
+- read:   `--readers` threads GET a weighted mix of the read paths (full snapshot,
+          filtered page, point lookup, aggregates) against a seeded book
+- mixed:  both at once
+
+Every run reports request and position throughput and latency percentiles
+(p50/p90/p95/p99/max) per operation and writes everything, plus the environment,
+to a JSON file. `--compare` checks the new run against an earlier results file and
+exits 1 when a throughput drops or a p50/p90/p95/p99 latency rises by more than
+`--tolerance` (max is reported but too noisy to gate on). With `--current` two
+existing result files are compared without running anything.
+
+    python3 loadtest_positions.py --out data/loadtest/base.json
+    python3 loadtest_positions.py --out new.json --compare data/loadtest/base.json
+    python3 loadtest_positions.py --workloads ingest --sizes 500,5000,50000 --duration 30
+    python3 loadtest_positions.py --server gunicorn --wire-format msgpack --wire-encoding zstd
+    python3 loadtest_positions.py --url http://localhost:8090 --workloads read
+    python3 loadtest_positions.py --current new.json --compare base.json
+    python3 loadtest_positions.py --workloads ingest --server-env BACKUP_INTERVAL_S=2   # during backups
+    python3 loadtest_positions.py --backends sqlite,memory --out data/loadtest/backends.json
+    python3 loadtest_positions.py --backends sqlite,sharded --server-env STORE_SHARDS=4 \
+        --workloads ingest --accounts 8 --writers 8 --per-account
+
+Without --url a store is launched on a temporary database per workload and size
+(see bench_positions_store.start_server), so runs do not influence each other.
+`--backends` repeats every run once per storage backend (STORE_BACKEND); runs on a
+backend other than sqlite are named <backend>/<run>, so sqlite results keep the names
+older baselines use.
+The client runs in this process: compare results from the same machine only.
+"""
+import os
+import sys
+import json
+import time
+import random
+import sqlite3
+import argparse
+import platform
+import tempfile
+import threading
+import subprocess
+from typing import Dict, List, Optional, Tuple
+
+from http_transport import build_session
+from bench_positions_store import SERVER_CMDS, percentile, start_server, stop_server
+import wire_format
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+WORKLOADS = ("ingest", "read", "mixed")
+_PERCENTILES = (50, 90, 95, 99)
+# (Saxo AssetType, share of the book, typical price, lot size)
+_ASSET_MIX = (
+    ("Stock", 0.55, 120.0, 100),
+    ("Etf", 0.10, 300.0, 50),
+    ("StockOption", 0.20, 4.0, 10),
+    ("StockIndexOption", 0.05, 25.0, 5),
+    ("FxSpot", 0.10, 1.1, 100000),
+)
+_CURRENCIES = ("USD", "EUR", "GBP")
+
+
+class BookGenerator:
+    """A synthetic multi-account book whose prices random-walk between snapshots.
+
+    snapshot() returns a payload shaped like Saxo's /port/v1/positions response for
+    `size` positions of the book, or of one account's part of it (a rotating slice
+    when size is smaller), with each price moved by a normal step of `volatility`
+    (relative) since the previous snapshot.
+    """
+
+    def __init__(self, positions: int, accounts: int = 3, volatility: float = 0.004, seed: int = 1,
+                 uic_base: int = 1000):
+        self.rng = random.Random(seed)
+        self.volatility = volatility
+        # rotating slice start per account (None: the whole book)
+        self._offset: Dict[Optional[str], int] = {}
+        self._books: Dict[str, List[dict]] = {}
+        self.book = []
+        weights = [w for _, w, _, _ in _ASSET_MIX]
+        for i in range(positions):
+            asset_type, _, price, lot = self.rng.choices(_ASSET_MIX, weights=weights)[0]
+            open_price = price * self.rng.uniform(0.5, 1.5)
+            self.book.append({
+                "uic": uic_base + i,
+                "account": f"ACC{i % accounts}",
+                "asset_type": asset_type,
+                "symbol": f"SYM{uic_base + i}:xnas" if asset_type != "FxSpot" else f"FX{i}",
+                "currency": _CURRENCIES[i % len(_CURRENCIES)],
+                "amount": float(self.rng.choice((-1, 1, 1, 1)) * lot * self.rng.randint(1, 20)),
+                "open_price": open_price,
+                "price": open_price * self.rng.uniform(0.9, 1.1),
+            })
+
+    def _position(self, p: dict) -> dict:
+        pnl = (p["price"] - p["open_price"]) * p["amount"]
+        return {
+            "NetPositionId": f"{p['uic']}__{p['asset_type']}",
+            "PositionId": str(p["uic"] * 7919),
+            "PositionBase": {
+                "AccountId": p["account"],
+                "Amount": p["amount"],
+                "AssetType": p["asset_type"],
+                "CanBeClosed": True,
+                "OpenPrice": round(p["open_price"], 5),
+                "Status": "Open",
+                "Uic": p["uic"],
+                "ValueDate": "2026-01-02T00:00:00.000000Z",
+            },
+            "PositionView": {
+                "CalculationReliability": "Ok",
+                "CurrentPrice": round(p["price"], 5),
+                "CurrentPriceType": "Bid",
+                "Exposure": round(p["amount"] * p["price"], 2),
+                "MarketValue": round(p["amount"] * p["price"], 2),
+                "ProfitLossOnTrade": round(pnl, 2),
+            },
+            "DisplayAndFormat": {
+                "Currency": p["currency"],
+                "Decimals": 2,
+                "Description": f"Instrument {p['uic']}",
+                "Symbol": p["symbol"],
+            },
+        }
+
+    def accounts(self) -> List[str]:
+        return sorted({p["account"] for p in self.book})
+
+    def _by_account(self, account: str) -> List[dict]:
+        if account not in self._books:
+            self._books[account] = [p for p in self.book if p["account"] == account]
+        return self._books[account]
+
+    def snapshot(self, size: Optional[int] = None, account: Optional[str] = None) -> dict:
+        book = self.book if account is None else self._by_account(account)
+        size = min(size or len(book), len(book))
+        start = self._offset.get(account, 0)
+        self._offset[account] = (start + size) % len(book)
+        data = []
+        for k in range(size):
+            p = book[(start + k) % len(book)]
+            p["price"] *= 1.0 + self.rng.gauss(0.0, self.volatility)
+            data.append(self._position(p))
+        return {"__count": len(data), "Data": data}
+
+    def point_targets(self, n: int = 64) -> List[str]:
+        picks = self.rng.sample(self.book, min(n, len(self.book)))
+        return [f"/positions/{p['uic']}?account={p['account']}" for p in picks]
+
+
+def _latency(values: List[float]) -> dict:
+    out = {f"p{p}": round(percentile(values, p), 3) for p in _PERCENTILES}
+    out["max"] = round(max(values), 3) if values else 0.0
+    out["mean"] = round(sum(values) / len(values), 3) if values else 0.0
+    return out
+
+
+class _Recorder:
+    """Thread-safe latency samples per operation, split into warmup and measured."""
+
+    def __init__(self, warmup_until: float):
+        self.warmup_until = warmup_until
+        self.samples: Dict[str, List[float]] = {}
+        self.positions: Dict[str, int] = {}
+        self.updated: Dict[str, int] = {}
+        self.errors: Dict[str, int] = {}
+        self.bytes: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def record(self, op: str, started: float, ms: float, ok: bool, positions: int = 0, updated: int = 0,
+               size: int = 0):
+        if started < self.warmup_until:
+            return
+        with self._lock:
+            if not ok:
+                self.errors[op] = self.errors.get(op, 0) + 1
+                return
+            self.samples.setdefault(op, []).append(ms)
+            self.positions[op] = self.positions.get(op, 0) + positions
+            self.updated[op] = self.updated.get(op, 0) + updated
+            self.bytes[op] = self.bytes.get(op, 0) + size
+
+    def summary(self, seconds: float) -> dict:
+        out = {}
+        for op in sorted(set(self.samples) | set(self.errors)):
+            lat = self.samples.get(op, [])
+            res = {"requests": len(lat), "errors": self.errors.get(op, 0),
+                   "req_per_s": round(len(lat) / seconds, 2), "latency_ms": _latency(lat)}
+            if self.positions.get(op):
+                res["positions_per_s"] = round(self.positions[op] / seconds, 1)
+                res["updated_per_s"] = round(self.updated[op] / seconds, 1)
+            if self.bytes.get(op):
+                res["mean_body_bytes"] = self.bytes[op] // max(1, len(lat))
+            out[op] = res
+        return out
+
+
+def _parse_mix(raw: str) -> List[Tuple[str, float]]:
+    mix = []
+    for part in raw.split(","):
+        name, _, weight = part.partition(":")
+        mix.append((name.strip(), float(weight or 1)))
+    return mix
+
+
+def _read_targets(gen: BookGenerator) -> Dict[str, List[str]]:
+    return {
+        "snapshot": ["/positions"],
+        "page": ["/positions?account=ACC1&limit=500", "/positions?account=ACC2&limit=500&order=desc"],
+        "point": gen.point_targets(),
+        "aggregates": ["/aggregates?by=total,account,asset_type"],
+    }
+
+
+def _seed(url: str, gen: BookGenerator, media: str, encoding: str):
+    s = build_session()
+    for _ in range(0, len(gen.book), 20000):
+        body, headers = wire_format.encode_request(gen.snapshot(20000), media, encoding)
+        s.post(f"{url}/ingest", data=body, headers=headers, timeout=120).raise_for_status()
+
+
+def run_workload(url: str, workload: str, size: int, args) -> dict:
+    """One timed run of `workload` against `url`; returns its JSON-ready summary."""
+    writers = args.writers if workload in ("ingest", "mixed") else 0
+    readers = args.readers if workload in ("read", "mixed") else 0
+    book = max(args.book, size * max(1, writers))
+    gen = BookGenerator(book, accounts=args.accounts, volatility=args.volatility, seed=args.seed)
+    _seed(url, gen, args.wire_format, args.wire_encoding)
+    targets = _read_targets(gen)
+    mix = [(name, w) for name, w in _parse_mix(args.read_mix) if name in targets]
+
+    t_start = time.perf_counter()
+    rec = _Recorder(t_start + args.warmup)
+    stop = threading.Event()
+    gen_lock = threading.Lock()
+
+    accounts = gen.accounts()
+
+    def writer(idx: int):
+        s = build_session()
+        # --per-account: writer i posts only account i % accounts, like one poller per account
+        account = accounts[idx % len(accounts)] if args.per_account else None
+        while not stop.is_set():
+            with gen_lock:
+                payload = gen.snapshot(size, account)
+            # encoding is client work, keep it out of the request latency
+            body, headers = wire_format.encode_request(payload, args.wire_format, args.wire_encoding)
+            t0 = time.perf_counter()
+            try:
+                r = s.post(f"{url}/ingest", data=body, headers=headers, timeout=120)
+                ok = r.status_code < 300
+                updated = wire_format.response_body(r).get("updated", 0) if ok else 0
+            except Exception:
+                ok, updated = False, 0
+            rec.record("ingest", t0, (time.perf_counter() - t0) * 1000.0, ok, positions=size,
+                       updated=updated or 0, size=len(body))
+
+    def reader(idx: int):
+        s = build_session()
+        rng = random.Random(args.seed * 1000 + idx)
+        names, weights = [n for n, _ in mix], [w for _, w in mix]
+        while not stop.is_set():
+            name = rng.choices(names, weights=weights)[0]
+            t0 = time.perf_counter()
+            try:
+                r = s.get(url + rng.choice(targets[name]), headers={"Accept-Encoding": args.accept_encoding},
+                          timeout=60)
+                ok, size_b = r.ok, len(r.content)
+            except Exception:
+                ok, size_b = False, 0
+            rec.record(f"read_{name}", t0, (time.perf_counter() - t0) * 1000.0, ok, size=size_b)
+
+    threads = [threading.Thread(target=writer, args=(i,), daemon=True) for i in range(writers)]
+    threads += [threading.Thread(target=reader, args=(i,), daemon=True) for i in range(readers)]
+    for t in threads:
+        t.start()
+    time.sleep(args.warmup + args.duration)
+    stop.set()
+    for t in threads:
+        t.join(timeout=130)
+    measured = time.perf_counter() - t_start - args.warmup
+
+    ops = rec.summary(measured)
+    reads = [v for op, v in ops.items() if op.startswith("read_")]
+    if reads:
+        lat = [ms for op, v in rec.samples.items() if op.startswith("read_") for ms in v]
+        ops["read"] = {"requests": len(lat), "errors": sum(v["errors"] for v in reads),
+                       "req_per_s": round(len(lat) / measured, 2), "latency_ms": _latency(lat)}
+    return {"workload": workload, "payload_positions": size if writers else 0, "book_positions": book,
+            "writers": writers, "readers": readers, "seconds": round(measured, 2), "ops": ops}
+
+
+def _environment(args) -> dict:
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=HERE, capture_output=True,
+                                text=True, timeout=5).stdout.strip() or None
+    except Exception:
+        commit = None
+    return {
+        "timestamp": int(time.time()),
+        "commit": commit,
+        "python": platform.python_version(),
+        "sqlite": sqlite3.sqlite_version,
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "server": args.url or args.server,
+        "wire": {"format": args.wire_format, "encoding": args.wire_encoding, "accept": args.accept_encoding},
+        "args": {k: v for k, v in vars(args).items() if k not in ("out", "compare")},
+    }
+
+
+def _flatten(results: dict) -> Dict[str, float]:
+    """{'mixed[500].ingest.latency_ms.p99': 12.3, ...} for every run and operation."""
+    flat = {}
+    for run_name, run in results.items():
+        for op, res in run["ops"].items():
+            for key in ("req_per_s", "positions_per_s"):
+                if key in res:
+                    flat[f"{run_name}.{op}.{key}"] = res[key]
+            for p in _PERCENTILES:
+                flat[f"{run_name}.{op}.latency_ms.p{p}"] = res["latency_ms"][f"p{p}"]
+    return flat
+
+
+def compare(current: dict, baseline: dict, tolerance: float) -> List[dict]:
+    """Metrics of `current` that regressed against `baseline` by more than `tolerance` (relative)."""
+    base, cur = _flatten(baseline["results"]), _flatten(current["results"])
+    regressions = []
+    for name in sorted(set(base) & set(cur)):
+        old, new = base[name], cur[name]
+        if old <= 0:
+            continue
+        change = (new - old) / old
+        # latencies regress upwards, throughputs downwards
+        worse = change > tolerance if ".latency_ms." in name else change < -tolerance
+        if worse:
+            regressions.append({"metric": name, "baseline": old, "current": new, "change_pct": round(change * 100, 1)})
+    return regressions
+
+
+# settings that make two result files incomparable when they differ
+_COMPARABLE_ARGS = ("server", "server_env", "backends", "book", "accounts", "per_account", "volatility", "writers",
+                    "readers", "read_mix", "duration", "wire_format", "wire_encoding", "accept_encoding")
+
+
+def _mismatched_settings(current: dict, baseline: dict) -> List[str]:
+    cur, base = current["environment"], baseline["environment"]
+    out = [f"{k}: {base['args'].get(k)} -> {cur['args'].get(k)}"
+           for k in _COMPARABLE_ARGS if base["args"].get(k) != cur["args"].get(k)]
+    for k in ("cpus", "platform"):
+        if base.get(k) != cur.get(k):
+            out.append(f"{k}: {base.get(k)} -> {cur.get(k)}")
+    return out
+
+
+def _print_run(name: str, run: dict):
+    for op, res in run["ops"].items():
+        lat = res["latency_ms"]
+        extra = f" {res['positions_per_s']:.0f} pos/s ({res['updated_per_s']:.0f} updated/s)" \
+            if "positions_per_s" in res else ""
+        print(f"[{name}] {op:<16} n={res['requests']:<6} {res['req_per_s']:8.1f} req/s{extra} "
+              f"p50={lat['p50']:.2f} p95={lat['p95']:.2f} p99={lat['p99']:.2f} max={lat['max']:.2f} ms "
+              f"errors={res['errors']}")
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Positions store load-test suite")
+    ap.add_argument("--url", default=None, help="Test an already running store instead of launching one")
+    ap.add_argument("--server", default="dev", choices=sorted(SERVER_CMDS), help="Store to launch (default dev)")
+    ap.add_argument("--server-env", action="append", default=[], metavar="KEY=VALUE",
+                    help="Extra env for the launched store, repeatable (e.g. BACKUP_INTERVAL_S=5)")
+    ap.add_argument("--backends", default="sqlite",
+                    help="Comma list of storage backends to run everything against (default sqlite)")
+    ap.add_argument("--workloads", default=",".join(WORKLOADS), help="Comma list of ingest, read, mixed (default all)")
+    ap.add_argument("--sizes", default="500,5000", help="Positions per ingest payload, comma list (default 500,5000)")
+    ap.add_argument("--book", type=int, default=20000, help="Positions seeded before each run (default 20000)")
+    ap.add_argument("--accounts", type=int, default=3, help="Accounts in the generated book (default 3)")
+    ap.add_argument("--per-account", action="store_true",
+                    help="Each writer posts one account's positions instead of slices of the whole book")
+    ap.add_argument("--volatility", type=float, default=0.004,
+                    help="Relative price step per snapshot, one sigma (default 0.004)")
+    ap.add_argument("--writers", type=int, default=2, help="Ingest threads (default 2)")
+    ap.add_argument("--readers", type=int, default=4, help="Read threads (default 4)")
+    ap.add_argument("--read-mix", default="snapshot:1,page:3,point:5,aggregates:1",
+                    help="Weighted read paths (default snapshot:1,page:3,point:5,aggregates:1)")
+    ap.add_argument("--duration", type=float, default=15.0, help="Measured seconds per run (default 15)")
+    ap.add_argument("--warmup", type=float, default=2.0, help="Unmeasured seconds before each run (default 2)")
+    ap.add_argument("--wire-format", default="json", choices=["json", "msgpack"], help="Ingest body format")
+    ap.add_argument("--wire-encoding", default="identity", choices=["identity", "gzip", "zstd"],
+                    help="Ingest body compression (default identity)")
+    ap.add_argument("--accept-encoding", default="identity", help="Accept-Encoding sent by readers")
+    ap.add_argument("--seed", type=int, default=1)
+    ap.add_argument("--out", default=None, help="Write results JSON here")
+    ap.add_argument("--compare", default=None, help="Baseline results JSON to check for regressions")
+    ap.add_argument("--current", default=None, help="With --compare: compare this results JSON instead of running")
+    ap.add_argument("--tolerance", type=float, default=0.15,
+                    help="Allowed relative regression per metric for --compare (default 0.15)")
+    args = ap.parse_args()
+
+    workloads = [w.strip() for w in args.workloads.split(",") if w.strip()]
+    unknown = [w for w in workloads if w not in WORKLOADS]
+    if unknown:
+        ap.error(f"unknown workload: {', '.join(unknown)}")
+    sizes = [int(s) for s in args.sizes.split(",") if s.strip()]
+    # with --url the running store's backend is whatever it was started with
+    backends = [b.strip() for b in args.backends.split(",") if b.strip()] if not args.url else ["sqlite"]
+
+    if args.current:
+        if not args.compare:
+            ap.error("--current needs --compare")
+        with open(args.current) as f:
+            return _report(json.load(f), args.compare, args.tolerance)
+
+    results = {}
+    for backend in backends:
+        for workload in workloads:
+            for size in (sizes if workload != "read" else [0]):
+                name = f"{workload}[{size}]" if size else workload
+                if backend != "sqlite":
+                    name = f"{backend}/{name}"
+                proc, url = None, args.url
+                if not url:
+                    db_path = os.path.join(tempfile.mkdtemp(prefix="loadtest_positions_"), "positions.db")
+                    env = dict(kv.split("=", 1) for kv in args.server_env)
+                    env["STORE_BACKEND"] = backend
+                    proc, url = start_server(db_path, env, cmd=SERVER_CMDS[args.server])
+                try:
+                    results[name] = run_workload(url, workload, size, args)
+                finally:
+                    if proc:
+                        stop_server(proc)
+                _print_run(name, results[name])
+
+    doc = {"environment": _environment(args), "results": results}
+    if args.out:
+        os.makedirs(os.path.dirname(os.path.abspath(args.out)), exist_ok=True)
+        with open(args.out, "w") as f:
+            json.dump(doc, f, indent=2, sort_keys=True)
+        print(f"results written to {args.out}")
+
+    return _report(doc, args.compare, args.tolerance) if args.compare else 0
+
+
+def _report(doc: dict, baseline_path: str, tolerance: float) -> int:
+    with open(baseline_path) as f:
+        baseline = json.load(f)
+    for diff in _mismatched_settings(doc, baseline):
+        print(f"  WARNING settings differ from the baseline, {diff}")
+    regressions = compare(doc, baseline, tolerance)
+    print(f"compared with {baseline_path} (commit {baseline['environment'].get('commit')}, "
+          f"tolerance {tolerance:.0%}): {len(regressions)} regression(s)")
+    for r in regressions:
+        print(f"  REGRESSION {r['metric']}: {r['baseline']} -> {r['current']} ({r['change_pct']:+.1f}%)")
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,170 @@
+#!/usr/bin/env python3
+"""Adaptive, volatility-scaled update thresholds for the positions store.
+
+With THRESHOLD_MODE=adaptive the store stops comparing every price move with a
+fixed percentage. Instead:
+
+- Every ingested price (written or not) updates an exponentially weighted
+  variance of that Uic's relative price steps (ADAPTIVE_ALPHA per observation),
+  so sigma is the instrument's typical move between two snapshots.
+- A row is written when its move since the stored price reaches k * sigma,
+  clamped to [ADAPTIVE_MIN_PCT, ADAPTIVE_MAX_PCT]. A quiet instrument gets a
+  tight threshold and a volatile one a wide one, so writes spread evenly over
+  the book instead of following volatility. Until a Uic has ADAPTIVE_MIN_OBS
+  observations its static threshold (THRESHOLDS_FILE / THRESHOLD_PCT) applies.
+- k is one multiplier for the whole book, retuned every ADAPTIVE_WINDOW_S from
+  the rows actually written: above ADAPTIVE_WRITE_BUDGET rows/s it grows, below
+  it shrinks (at most x2 / x0.5 per window, within [ADAPTIVE_K_MIN, ADAPTIVE_K_MAX]).
+- Max staleness: a position whose stored row is older than ADAPTIVE_MAX_STALENESS_S
+  is rewritten by the next snapshot that carries it, whatever its price did. The
+  limit is spread over [0.75, 1] * ADAPTIVE_MAX_STALENESS_S by Uic so a book
+  written in one go is not refreshed in one burst either. These refreshes count
+  against the budget; when they alone exceed it, k settles at ADAPTIVE_K_MAX.
+- The clamp wins over the budget: once k * sigma passes ADAPTIVE_MAX_PCT for the
+  volatile part of the book, those rows keep being written at the clamp and a
+  budget below that rate is not reached (k then sits at ADAPTIVE_K_MAX).
+
+The state lives in process memory and starts cold after a restart. With several
+gunicorn workers each one tracks the snapshots it receives and keeps to the budget
+on its own, so the store as a whole writes up to WEB_WORKERS times the budget.
+
+Config via env:
+- ADAPTIVE_WRITE_BUDGET (default 500) written rows per second to aim for
+- ADAPTIVE_MAX_STALENESS_S (default 300, 0 = off)
+- ADAPTIVE_ALPHA (default 0.05) weight of the newest step in the variance
+- ADAPTIVE_MIN_OBS (default 10) observations before sigma is trusted
+- ADAPTIVE_WINDOW_S (default 10) how often k is retuned
+- ADAPTIVE_K (default 2.0) initial k; ADAPTIVE_K_MIN / ADAPTIVE_K_MAX (default 0.1 / 50)
+- ADAPTIVE_MIN_PCT / ADAPTIVE_MAX_PCT (default 0.0001 / 0.05) threshold clamp
+"""
+import os
+import math
+import time
+import threading
+from typing import Dict, List, Optional
+
+ADAPTIVE_WRITE_BUDGET = float(os.getenv("ADAPTIVE_WRITE_BUDGET", "500"))
+ADAPTIVE_MAX_STALENESS_S = float(os.getenv("ADAPTIVE_MAX_STALENESS_S", "300"))
+ADAPTIVE_ALPHA = float(os.getenv("ADAPTIVE_ALPHA", "0.05"))
+ADAPTIVE_MIN_OBS = int(os.getenv("ADAPTIVE_MIN_OBS", "10"))
+ADAPTIVE_WINDOW_S = float(os.getenv("ADAPTIVE_WINDOW_S", "10"))
+ADAPTIVE_K = float(os.getenv("ADAPTIVE_K", "2.0"))
+ADAPTIVE_K_MIN = float(os.getenv("ADAPTIVE_K_MIN", "0.1"))
+ADAPTIVE_K_MAX = float(os.getenv("ADAPTIVE_K_MAX", "50"))
+ADAPTIVE_MIN_PCT = float(os.getenv("ADAPTIVE_MIN_PCT", "0.0001"))
+ADAPTIVE_MAX_PCT = float(os.getenv("ADAPTIVE_MAX_PCT", "0.05"))
+
+# a window's correction of k is limited to this factor either way
+_MAX_STEP = 2.0
+
+
+class AdaptiveThresholds:
+    """Per-Uic EW volatility plus the budget controller; see the module docstring.
+
+    observe() runs once per ingested batch, before the backend commit, so a Uic held by
+    several accounts (possibly on different shards) counts as one observation per
+    snapshot. stale() is called per row from the shard commits and wrote() once per
+    selected batch. observe() and wrote() each take the lock once, so concurrent
+    /ingest requests (request threads, async writer) do not interleave their updates.
+    """
+
+    def __init__(self, budget: float = ADAPTIVE_WRITE_BUDGET, max_staleness_s: float = ADAPTIVE_MAX_STALENESS_S,
+                 alpha: float = ADAPTIVE_ALPHA, min_obs: int = ADAPTIVE_MIN_OBS, window_s: float = ADAPTIVE_WINDOW_S,
+                 k: float = ADAPTIVE_K):
+        self.budget = budget
+        self.max_staleness_s = max_staleness_s
+        self.alpha = alpha
+        self.min_obs = min_obs
+        self.window_s = window_s
+        self.k = k
+        # uic -> [last observed price, EW variance of relative steps, observations]
+        self._vol: Dict[int, List[float]] = {}
+        self._window_start = time.monotonic()
+        self._window_writes = 0
+        self._window_stale = 0
+        self.last_rate: Optional[float] = None
+        self.last_stale_rate: Optional[float] = None
+        self.writes = 0
+        self.stale_writes = 0
+        self._lock = threading.Lock()
+
+    def observe(self, prices: Dict[int, Optional[float]]) -> Dict[int, Optional[float]]:
+        """Record one snapshot's price per Uic; returns each Uic's threshold (see threshold())."""
+        threshold = self._threshold
+        with self._lock:
+            return {uic: threshold(uic, price) for uic, price in prices.items()}
+
+    def threshold(self, uic: int, price: Optional[float]) -> Optional[float]:
+        """Record `price` for `uic` and return its current threshold, None while warming up.
+
+        One call per Uic and snapshot: each call is an observation of the Uic's volatility.
+        """
+        with self._lock:
+            return self._threshold(uic, price)
+
+    def _threshold(self, uic: int, price: Optional[float]) -> Optional[float]:
+        state = self._vol.get(uic)
+        if state is None:
+            if price is not None:
+                self._vol[uic] = [price, 0.0, 0]
+            return None
+        if price is not None:
+            prev = state[0]
+            # an unchanged price is an observation too: a zero step pulls the variance down
+            step = (price - prev) / prev if prev else 0.0
+            state[1] += self.alpha * (step * step - state[1])
+            state[2] += 1
+            state[0] = price
+        if state[2] < self.min_obs:
+            return None
+        return min(ADAPTIVE_MAX_PCT, max(ADAPTIVE_MIN_PCT, self.k * math.sqrt(state[1])))
+
+    def stale(self, uic: int, updated_at: Optional[int], now: int) -> bool:
+        """True when the stored row of `uic` is past its max staleness."""
+        if not self.max_staleness_s or updated_at is None:
+            return False
+        # spread the limits over [0.75, 1] * max so rows written together expire apart
+        limit = self.max_staleness_s * (1.0 - (uic % 256) / 1024.0)
+        return now - updated_at >= limit
+
+    def wrote(self, rows: int, stale: int):
+        """Account one selected batch: `rows` to write, `stale` of them only for staleness."""
+        with self._lock:
+            self.writes += rows
+            self.stale_writes += stale
+            self._window_writes += rows
+            self._window_stale += stale
+            now = time.monotonic()
+            elapsed = now - self._window_start
+            if elapsed < self.window_s:
+                return
+            rate = self._window_writes / elapsed
+            self.last_rate = rate
+            self.last_stale_rate = self._window_stale / elapsed
+            if self.budget > 0:
+                # half the log-error per window; a window without writes shrinks k by the maximum step
+                step = min(_MAX_STEP, max(1.0 / _MAX_STEP, math.sqrt(rate / self.budget)))
+                self.k = min(ADAPTIVE_K_MAX, max(ADAPTIVE_K_MIN, self.k * step))
+            self._window_start = now
+            self._window_writes = self._window_stale = 0
+
+    def describe(self) -> dict:
+        with self._lock:
+            sigmas = sorted(math.sqrt(s[1]) for s in self._vol.values() if s[2] >= self.min_obs)
+
+        def pct(p):
+            return sigmas[min(len(sigmas) - 1, int(p / 100.0 * len(sigmas)))] if sigmas else None
+
+        return {
+            "k": self.k,
+            "write_budget": self.budget,
+            "last_write_rate": self.last_rate,
+            "last_stale_rate": self.last_stale_rate,
+            "max_staleness_s": self.max_staleness_s,
+            "tracked_uics": len(self._vol),
+            "warm_uics": len(sigmas),
+            "sigma_p50": pct(50),
+            "sigma_p90": pct(90),
+            "writes": self.writes,
+            "stale_writes": self.stale_writes,
+        }
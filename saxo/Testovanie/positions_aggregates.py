@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+"""Running portfolio aggregates for the positions store.
+
+For each group the store keeps the number of positions and the sums of amount,
+market value and PnL, along four dimensions:
+
+- total: a single group
+- account: one group per account_id
+- asset_type: one group per Saxo AssetType ('' when unknown)
+- symbol: one group per symbol, summed across accounts
+
+The aggregates live next to the store's in-memory read model and follow it: a
+full reload recomputes them in one pass, and every applied ingest batch only
+moves the contribution of the rows it changed (subtract the old row, add the new
+one; a row whose account, symbol or asset type changed moves between groups), so
+an ingest costs O(changed rows) no matter how large the book is. A reload also
+clears the floating-point drift that long runs of deltas accumulate.
+
+Market value is Saxo's own MarketValue as stored with the position, which accounts
+for contract multipliers (options) and FX/CFD conventions; amount * last_price is
+only the fallback for rows stored without it (written before schema v4, or sent
+without a PositionView.MarketValue).
+"""
+from typing import Dict, Iterable, List, Optional, Tuple
+
+DIMENSIONS = ("total", "account", "asset_type", "symbol")
+
+_Group = Tuple[str, str]
+_TOTAL: _Group = ("total", "")
+
+
+def _groups(row: dict) -> Tuple[_Group, ...]:
+    return (_TOTAL, ("account", row["account_id"] or ""), ("asset_type", row.get("asset_type") or ""),
+            ("symbol", row["symbol"] or ""))
+
+
+def _values(row: dict) -> Tuple[float, float, float]:
+    amount, price, pnl = row["amount"], row["last_price"], row["pnl"]
+    market_value = row.get("market_value")
+    if market_value is None:
+        # NULLs count as 0, the way SQL TOTAL() would sum them
+        market_value = amount * price if amount is not None and price is not None else 0.0
+    return amount or 0.0, market_value, pnl or 0.0
+
+
+class Aggregates:
+    """{(dimension, key): [positions, amount, market_value, pnl]}, updated by deltas.
+
+    Not thread-safe on its own; the read model calls it under its lock.
+    """
+
+    def __init__(self, rows: Iterable[dict] = ()):
+        self._groups: Dict[_Group, List[float]] = {}
+        for row in rows:
+            self._add(_groups(row), 1, *_values(row))
+
+    def _add(self, groups: Tuple[_Group, ...], n: int, amount: float, mv: float, pnl: float):
+        acc = self._groups
+        for g in groups:
+            d = acc.get(g)
+            if d is None:
+                acc[g] = [n, amount, mv, pnl]
+                continue
+            d[0] += n
+            d[1] += amount
+            d[2] += mv
+            d[3] += pnl
+            if d[0] <= 0:
+                del acc[g]
+
+    def update(self, old: Optional[dict], new: dict):
+        """Replace `old`'s contribution (None for a new position) with `new`'s."""
+        amount, mv, pnl = _values(new)
+        if old is None:
+            self._add(_groups(new), 1, amount, mv, pnl)
+            return
+        old_groups, groups = _groups(old), _groups(new)
+        old_amount, old_mv, old_pnl = _values(old)
+        if old_groups == groups:
+            # the common case, a price/amount move: one net delta per group
+            self._add(groups, 0, amount - old_amount, mv - old_mv, pnl - old_pnl)
+        else:
+            self._add(old_groups, -1, -old_amount, -old_mv, -old_pnl)
+            self._add(groups, 1, amount, mv, pnl)
+
+    def snapshot(self, dimensions: Iterable[str] = DIMENSIONS) -> Dict[str, dict]:
+        """{dimension: {key: {"positions", "amount", "market_value", "pnl"}}}; total is a single dict."""
+        out: Dict[str, dict] = {d: {} for d in dimensions}
+        for (dimension, key), (n, amount, mv, pnl) in self._groups.items():
+            if dimension in out:
+                out[dimension][key] = {"positions": n, "amount": amount, "market_value": mv, "pnl": pnl}
+        for dimension, groups in out.items():
+            out[dimension] = dict(sorted(groups.items()))
+        if "total" in out:
+            out["total"] = out["total"].get("", {"positions": 0, "amount": 0.0, "market_value": 0.0, "pnl": 0.0})
+        return out
@@ -0,0 +1,381 @@
+#!/usr/bin/env python3
+"""Audit log of raw /ingest payloads for the positions store.
+
+The store keeps seven columns per position; with AUDIT_ENABLED=1 it also keeps
+every /ingest body as it arrived (after Content-Encoding, before parsing), so what
+the gateway returned at a given moment can be reconstructed later.
+
+- /ingest only appends (timestamp, media type, body, parsed rows) to an in-memory
+  buffer. A writer thread packs the buffer into blocks of about AUDIT_BLOCK_BYTES,
+  compresses each block (zstd when `zstandard` is installed, else gzip) and appends
+  it to the current segment file; the buffer is written at least every AUDIT_FLUSH_S.
+  A crash loses at most that much (a clean exit writes the buffer, see stop());
+  past AUDIT_BUFFER_MAX_BYTES pending, payloads are dropped (counted) rather than
+  stalling /ingest.
+- Each block gets one JSON line in the segment's .idx file: its offset and length,
+  time range, record count and the Uics of its payloads (as sorted runs). Queries
+  read the index only and decompress just the blocks whose time range and Uics
+  match; within a block only the records in the time range are decoded.
+- Every process writes its own segments (audit-<UTC start>-<pid>.log + .idx) and
+  rolls over at AUDIT_SEGMENT_BYTES; segments older than AUDIT_RETENTION_DAYS are
+  deleted. Queries read the segments of all processes; the calling process writes
+  its buffer first, other workers' last AUDIT_FLUSH_S may not be visible yet.
+
+A block on disk is a header (magic, codec, raw length, compressed length) followed
+by the compressed records; a record is a header (ts, body length, media length),
+the media type and the body.
+
+    python3 positions_audit.py blocks /data/audit [from] [to] [uic]
+    python3 positions_audit.py payloads /data/audit [from] [to] [uic]
+
+Config via env:
+- AUDIT_ENABLED (default 0)
+- AUDIT_DIR (default /data/audit)
+- AUDIT_CODEC (default zstd if installed, else gzip) zstd | gzip
+- AUDIT_BLOCK_BYTES (default 4194304) uncompressed bytes per block
+- AUDIT_FLUSH_S (default 5) max time a payload waits in memory
+- AUDIT_BUFFER_MAX_BYTES (default 268435456) pending bytes before payloads are dropped
+- AUDIT_SEGMENT_BYTES (default 268435456) segment size before rolling over
+- AUDIT_RETENTION_DAYS (default 30, 0 = forever)
+"""
+import os
+import sys
+import json
+import time
+import bisect
+import struct
+import logging
+import threading
+from typing import Dict, Iterator, List, Optional, Tuple
+
+import saxo_positions
+import wire_format
+
+AUDIT_ENABLED = os.getenv("AUDIT_ENABLED", "0").lower() in ("1", "true", "yes")
+AUDIT_DIR = os.getenv("AUDIT_DIR", "/data/audit")
+AUDIT_CODEC = os.getenv("AUDIT_CODEC", "zstd" if wire_format.zstandard is not None else "gzip").lower()
+AUDIT_BLOCK_BYTES = int(os.getenv("AUDIT_BLOCK_BYTES", str(4 * 1024 * 1024)))
+AUDIT_FLUSH_S = float(os.getenv("AUDIT_FLUSH_S", "5"))
+AUDIT_BUFFER_MAX_BYTES = int(os.getenv("AUDIT_BUFFER_MAX_BYTES", str(256 * 1024 * 1024)))
+AUDIT_SEGMENT_BYTES = int(os.getenv("AUDIT_SEGMENT_BYTES", str(256 * 1024 * 1024)))
+AUDIT_RETENTION_DAYS = int(os.getenv("AUDIT_RETENTION_DAYS", "30"))
+
+_MAGIC = b"PAL1"
+_BLOCK = struct.Struct("<4sBII")  # magic, codec, raw length, compressed length
+_RECORD = struct.Struct("<dIH")  # ts, body length, media length
+_CODECS = {1: "gzip", 2: "zstd"}
+_CODEC_IDS = {name: i for i, name in _CODECS.items()}
+_PREFIX = "audit-"
+_LOG = ".log"
+_IDX = ".idx"
+_RETENTION_CHECK_S = 3600
+
+logger = logging.getLogger(__name__)
+
+
+def segments(audit_dir: str) -> List[str]:
+    """Segment .log paths in `audit_dir`, oldest first (names sort by start time)."""
+    try:
+        names = os.listdir(audit_dir)
+    except FileNotFoundError:
+        return []
+    return [os.path.join(audit_dir, n) for n in sorted(names) if n.startswith(_PREFIX) and n.endswith(_LOG)]
+
+
+def _pack_block(records: List[Tuple[float, str, bytes, dict]], codec: str) -> Tuple[bytes, dict]:
+    """One on-disk block for `records` plus its index entry (without the offset)."""
+    parts = []
+    uics = set()
+    for ts, media, body, rows in records:
+        m = media.encode("ascii")
+        parts += (_RECORD.pack(ts, len(body), len(m)), m, body)
+        uics.update(k[1] for k in rows)
+    raw = b"".join(parts)
+    data = wire_format.compress(raw, codec)
+    entry = {"len": _BLOCK.size + len(data), "raw": len(raw), "n": len(records),
+             "t0": records[0][0], "t1": records[-1][0], "uics": _ranges(uics)}
+    return _BLOCK.pack(_MAGIC, _CODEC_IDS[codec], len(raw), len(data)) + data, entry
+
+
+def _ranges(uics) -> List[List[int]]:
+    """`uics` as sorted [first, last] runs of consecutive Uics, to keep index lines short."""
+    out: List[List[int]] = []
+    for uic in sorted(uics):
+        if out and out[-1][1] == uic - 1:
+            out[-1][1] = uic
+        else:
+            out.append([uic, uic])
+    return out
+
+
+def read_block(path: str, offset: int) -> bytes:
+    """The decompressed records of the block at `offset` in segment `path`."""
+    with open(path, "rb") as f:
+        f.seek(offset)
+        magic, codec, raw_len, length = _BLOCK.unpack(f.read(_BLOCK.size))
+        if magic != _MAGIC or codec not in _CODECS:
+            raise ValueError(f"{path}@{offset}: not an audit block")
+        data = f.read(length)
+    return wire_format.decompress(data, _CODECS[codec], raw_len)
+
+
+def iter_records(raw: bytes) -> Iterator[Tuple[float, str, memoryview]]:
+    """(ts, media type, body) of every record in a decompressed block; bodies are not decoded."""
+    view = memoryview(raw)
+    pos = 0
+    while pos < len(raw):
+        ts, body_len, media_len = _RECORD.unpack_from(raw, pos)
+        pos += _RECORD.size
+        media = bytes(view[pos:pos + media_len]).decode("ascii")
+        pos += media_len
+        yield ts, media, view[pos:pos + body_len]
+        pos += body_len
+
+
+def blocks(audit_dir: str, start: Optional[float] = None, end: Optional[float] = None,
+           uic: Optional[int] = None) -> List[dict]:
+    """Index entries of the blocks that may hold payloads in [start, end) carrying `uic`.
+
+    Reads only .idx files; each entry gets its "segment" path and loses its Uic list.
+    """
+    out = []
+    for path in segments(audit_dir):
+        try:
+            f = open(path[:-len(_LOG)] + _IDX, "r")
+        except FileNotFoundError:
+            continue
+        with f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    # a line another process is still writing
+                    continue
+                if start is not None and entry["t1"] < start:
+                    continue
+                if end is not None and entry["t0"] >= end:
+                    continue
+                uics = entry.pop("uics")
+                if uic is not None and not _contains(uics, uic):
+                    continue
+                entry["segment"] = path
+                out.append(entry)
+    return out
+
+
+def _contains(ranges: List[List[int]], uic: int) -> bool:
+    i = bisect.bisect_right(ranges, uic, key=lambda r: r[0]) - 1
+    return i >= 0 and ranges[i][1] >= uic
+
+
+def _uic_of(item) -> Optional[int]:
+    p = saxo_positions.parse(item)
+    return p.uic if p is not None else None
+
+
+def payloads(audit_dir: str, start: Optional[float] = None, end: Optional[float] = None,
+             uic: Optional[int] = None, limit: int = 100) -> List[dict]:
+    """Decoded payloads received in [start, end), oldest first, at most `limit`.
+
+    With `uic` each result carries only the items of that Uic (as received) instead of
+    the whole payload. Only blocks selected by blocks() are decompressed.
+    """
+    out: List[dict] = []
+    for entry in blocks(audit_dir, start, end, uic):
+        raw = read_block(entry["segment"], entry["off"])
+        for ts, media, body in iter_records(raw):
+            if (start is not None and ts < start) or (end is not None and ts >= end):
+                continue
+            try:
+                payload = wire_format.loads(bytes(body), media)
+            except Exception:
+                payload = None
+            rec = {"ts": ts, "segment": os.path.basename(entry["segment"]), "offset": entry["off"],
+                   "media": media, "bytes": len(body)}
+            if uic is None:
+                rec["payload"] = payload
+            else:
+                items = saxo_positions.items(payload)
+                matched = [item for item in items if _uic_of(item) == uic]
+                if not matched:
+                    continue
+                rec["count"] = len(items)
+                rec["items"] = matched
+            out.append(rec)
+            if len(out) >= limit:
+                return out
+    return out
+
+
+class AuditLog:
+    """Per-process audit writer: append() buffers, a thread compresses and writes blocks.
+
+    The thread starts with the first append() or start(), i.e. after gunicorn forks, so
+    each worker has its own thread and segments; flush() writes the buffer synchronously,
+    e.g. before a query.
+    """
+
+    def __init__(self, audit_dir: str = AUDIT_DIR, codec: str = AUDIT_CODEC, block_bytes: int = AUDIT_BLOCK_BYTES,
+                 flush_s: float = AUDIT_FLUSH_S, buffer_max: int = AUDIT_BUFFER_MAX_BYTES,
+                 segment_bytes: int = AUDIT_SEGMENT_BYTES, retention_days: int = AUDIT_RETENTION_DAYS):
+        if codec not in _CODEC_IDS:
+            raise ValueError(f"unsupported AUDIT_CODEC {codec}")
+        self.audit_dir = audit_dir
+        self.codec = codec
+        self.block_bytes = block_bytes
+        self.flush_s = flush_s
+        self.buffer_max = buffer_max
+        self.segment_bytes = segment_bytes
+        self.retention_days = retention_days
+        self._buffer: List[Tuple[float, str, bytes, dict]] = []
+        self._buffered = 0
+        self._lock = threading.Lock()
+        # serializes flushes of the writer thread and of queries
+        self._write_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stop_event = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._segment: Optional[str] = None
+        self._offset = 0
+        self._next_retention = 0.0
+        self.appended = 0
+        self.dropped = 0
+        self.blocks_written = 0
+        self.raw_bytes = 0
+        self.written_bytes = 0
+
+    def append(self, body: bytes, media: str, rows: Dict[tuple, tuple]):
+        """Queue one /ingest body; `rows` are its parsed rows keyed (account_id, uic), not copied."""
+        with self._lock:
+            if self._buffered + len(body) > self.buffer_max:
+                self.dropped += 1
+                return False
+            self._buffer.append((time.time(), media, body, rows))
+            self._buffered += len(body)
+            self.appended += 1
+            full = self._buffered >= self.block_bytes
+        if self._thread is None:
+            self.start()
+        if full:
+            self._wake.set()
+        return True
+
+    def start(self):
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="positions-audit", daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        while not self._stop_event.is_set():
+            self._wake.wait(self.flush_s)
+            self._wake.clear()
+            try:
+                self.flush()
+                if self.retention_days > 0 and time.monotonic() >= self._next_retention:
+                    self._next_retention = time.monotonic() + _RETENTION_CHECK_S
+                    self.enforce_retention()
+            except Exception:
+                logger.exception("positions audit flush failed")
+        self.flush()
+
+    def flush(self) -> int:
+        """Write everything buffered so far; returns the number of blocks written."""
+        with self._write_lock:
+            with self._lock:
+                pending, self._buffer = self._buffer, []
+                self._buffered = 0
+            written = 0
+            start = 0
+            size = 0
+            for i, rec in enumerate(pending):
+                size += len(rec[2])
+                if size >= self.block_bytes or i == len(pending) - 1:
+                    self._write_block(pending[start:i + 1])
+                    written += 1
+                    start, size = i + 1, 0
+            return written
+
+    def _write_block(self, records):
+        block, entry = _pack_block(records, self.codec)
+        if self._segment is None or self._offset >= self.segment_bytes:
+            os.makedirs(self.audit_dir, exist_ok=True)
+            now = time.time()
+            stamp = time.strftime("%Y%m%dT%H%M%S", time.gmtime(now)) + f".{int(now * 1000) % 1000:03d}Z"
+            self._segment = os.path.join(self.audit_dir, f"{_PREFIX}{stamp}-{os.getpid()}{_LOG}")
+        # block first, index line after: a crash in between leaves an unindexed block, never a dangling entry
+        with open(self._segment, "ab") as f:
+            # the file's own end, not a counter: a segment reopened within the same millisecond already has data
+            entry["off"] = f.tell()
+            f.write(block)
+        with open(self._segment[:-len(_LOG)] + _IDX, "a") as f:
+            f.write(json.dumps(entry, separators=(",", ":")) + "\n")
+        self._offset = entry["off"] + len(block)
+        self.blocks_written += 1
+        self.raw_bytes += entry["raw"]
+        self.written_bytes += len(block)
+
+    def enforce_retention(self, now: Optional[float] = None) -> List[str]:
+        """Delete segments (of any process) last written before the retention window."""
+        cutoff = (now or time.time()) - self.retention_days * 86400
+        removed = []
+        for path in segments(self.audit_dir):
+            if path == self._segment:
+                continue
+            try:
+                if os.path.getmtime(path) >= cutoff:
+                    continue
+                os.remove(path)
+                removed.append(path)
+                os.remove(path[:-len(_LOG)] + _IDX)
+            except FileNotFoundError:
+                # another worker removed it first
+                pass
+        return removed
+
+    def stop(self, timeout: float = 30.0):
+        """Stop the writer thread and write whatever is still buffered (process exit)."""
+        self._stop_event.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+        # also covers a thread that never started and appends that raced the thread's last flush
+        self.flush()
+
+    def describe(self) -> dict:
+        with self._lock:
+            pending, buffered = len(self._buffer), self._buffered
+        return {
+            "dir": self.audit_dir,
+            "codec": self.codec,
+            "segment": self._segment,
+            "pending": pending,
+            "pending_bytes": buffered,
+            "appended": self.appended,
+            "dropped": self.dropped,
+            "blocks": self.blocks_written,
+            "raw_bytes": self.raw_bytes,
+            "written_bytes": self.written_bytes,
+            "ratio": round(self.raw_bytes / self.written_bytes, 2) if self.written_bytes else None,
+        }
+
+
+def main():
+    args = sys.argv[1:]
+    if len(args) < 2 or args[0] not in ("blocks", "payloads"):
+        print(__doc__)
+        return 2
+    start = float(args[2]) if len(args) > 2 else None
+    end = float(args[3]) if len(args) > 3 else None
+    uic = int(args[4]) if len(args) > 4 else None
+    if args[0] == "blocks":
+        for entry in blocks(args[1], start, end, uic):
+            print(json.dumps(entry))
+    else:
+        for rec in payloads(args[1], start, end, uic, limit=sys.maxsize):
+            print(json.dumps(rec))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
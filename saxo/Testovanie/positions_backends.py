@@ -0,0 +1,660 @@
+#!/usr/bin/env python3
+"""Storage backends for the positions store.
+
+positions_store.py keeps the HTTP layer, threshold filtering, the in-memory read
+model and the write-behind queue; everything it needs from storage goes through a
+PositionsBackend:
+
+- version(): store version, bumped by every commit that changes rows
+- versions(): the version of each partition (a single one unless sharded)
+- rows(): every stored position (read model reloads)
+- commit(rows, select): one ingest. For each partition it touches, the backend looks
+  up the stored (last_price, asset_type, updated_at) of the incoming keys, `select` picks the
+  rows to write from that, and the backend writes them, bumps the partition version
+  and appends them to the change feed before anyone else can write there
+- query(q): one keyset page of positions for a PositionQuery
+- changes_since() / last_seq() / oldest_seq(): the change feed (/positions/changes,
+  SSE); parse_cursor() reads its cursors back from a request
+- scan(account): a DB-API style cursor over positions (columnar export)
+- history(sql, params, account): a cursor over a positions_history query
+
+Backends (STORE_BACKEND):
+- sqlite (default): WAL database with schema migrations; also provides price
+  history and online backups (`features`), reachable through connect()
+- sharded: STORE_SHARDS sqlite databases next to DB_PATH (positions.shard0.db, ...),
+  positions routed by account_id. Every shard has its own writer lock, so ingests
+  for different accounts no longer queue behind each other and one payload spanning
+  several accounts commits its shards in parallel (atomic per shard, not across
+  them). Single-account reads go to one shard; everything else fans out and merges.
+  Versions and change-feed cursors become one component per shard (the cursor is
+  "seq0.seq1...", the version their sum). The shard count is recorded in every
+  shard and checked at startup: accounts would land on other shards after a change
+- memory: dicts under one lock, nothing persisted; for tests and ephemeral
+  deployments that rebuild their book from the next snapshots. Every process has
+  its own copy, so it needs a single worker process. History and backups are
+  not available (those routes answer 501)
+
+    STORE_BACKEND=sharded python3 positions_backends.py init /data/positions.db
+
+creates or migrates the configured backend's databases (gunicorn runs it before
+the first worker starts).
+
+Config via env:
+- STORE_BACKEND (default sqlite): sqlite, sharded or memory
+- STORE_SHARDS (default 4) databases of the sharded backend
+- SQLITE_JOURNAL_MODE, SQLITE_SYNCHRONOUS, SQLITE_CACHE_KB, SQLITE_MMAP_BYTES,
+  SQLITE_BUSY_TIMEOUT_MS: per-connection pragmas (cache and mmap apply per shard)
+"""
+import os
+import sys
+import zlib
+import heapq
+import queue
+import logging
+import sqlite3
+import threading
+from bisect import bisect_left
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack, contextmanager
+from typing import Callable, Dict, Iterator, List, NamedTuple, Optional, Tuple
+
+import positions_history
+import positions_schema
+
+STORE_BACKEND = os.getenv("STORE_BACKEND", "sqlite").lower()
+STORE_SHARDS = int(os.getenv("STORE_SHARDS", "4"))
+SQLITE_JOURNAL_MODE = os.getenv("SQLITE_JOURNAL_MODE", "WAL")
+SQLITE_SYNCHRONOUS = os.getenv("SQLITE_SYNCHRONOUS", "NORMAL")
+SQLITE_CACHE_KB = int(os.getenv("SQLITE_CACHE_KB", "16384"))
+SQLITE_MMAP_BYTES = int(os.getenv("SQLITE_MMAP_BYTES", str(256 * 1024 * 1024)))
+SQLITE_BUSY_TIMEOUT_MS = int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "5000"))
+
+COLUMNS = ("uic", "symbol", "account_id", "amount", "last_price", "pnl", "updated_at", "asset_type", "market_value")
+# position_changes as returned by SELECT *
+CHANGE_COLUMNS = ("seq",) + COLUMNS
+
+HISTORY = "history"
+BACKUP = "backup"
+
+Key = Tuple[str, int]
+# stored (last_price, asset_type, updated_at) per (account_id, uic)
+Existing = Dict[Key, Tuple[Optional[float], Optional[str], Optional[int]]]
+# (rows of one partition, their stored state) -> rows to write
+Select = Callable[[Dict[Key, tuple], Existing], List[tuple]]
+
+# stay below SQLITE_MAX_VARIABLE_NUMBER of older SQLite builds (999)
+_IN_CHUNK = 900
+
+
+class PositionQuery(NamedTuple):
+    """Filters of a keyset page; `after` is an (updated_at, account_id, uic) cursor."""
+    columns: Tuple[str, ...]
+    account: Optional[str] = None
+    symbol: Optional[str] = None
+    updated_since: Optional[int] = None
+    after: Optional[Tuple[int, str, int]] = None
+    limit: int = 1000
+    order: str = "desc"
+
+
+class Commit(NamedTuple):
+    """Rows one partition wrote in an ingest and the partition version they produced."""
+    part: int
+    version: int
+    batch: List[tuple]
+
+
+def _symbol_range(prefix: str) -> Tuple[str, str]:
+    # a half-open range instead of LIKE, so the symbol index is usable
+    return prefix, prefix[:-1] + chr(ord(prefix[-1]) + 1)
+
+
+class PositionsBackend:
+    """Storage interface of the positions store; see the module docstring."""
+
+    name = ""
+    features: frozenset = frozenset()
+
+    def init(self):
+        """Create or migrate storage; called once at startup."""
+
+    def version(self) -> int:
+        raise NotImplementedError
+
+    def versions(self) -> Tuple[int, ...]:
+        return (self.version(),)
+
+    def partitions(self) -> List["PositionsBackend"]:
+        """The independently stored parts (history retention and backups run per part)."""
+        return [self]
+
+    def rows(self) -> List[dict]:
+        raise NotImplementedError
+
+    def commit(self, rows: Dict[Key, tuple], select: Select) -> List[Commit]:
+        """Write what `select` picks, atomically per partition; one Commit per partition written."""
+        raise NotImplementedError
+
+    def query(self, q: PositionQuery) -> List[dict]:
+        """Up to q.limit rows for `q`, ordered by (updated_at, account_id, uic) in q.order."""
+        raise NotImplementedError
+
+    def changes_since(self, since: int, limit: int) -> List[dict]:
+        raise NotImplementedError
+
+    def last_seq(self) -> int:
+        raise NotImplementedError
+
+    def oldest_seq(self) -> Optional[int]:
+        raise NotImplementedError
+
+    def parse_cursor(self, raw: str):
+        """A change-feed cursor (a change's "seq") from a request; raises ValueError."""
+        return int(raw)
+
+    def cursor_expired(self, since) -> bool:
+        """True when changes after `since` have already been trimmed from the feed.
+
+        Applies to 0 as well: a client reading "from the beginning" after retention
+        trimmed the feed would otherwise silently miss the trimmed changes.
+        """
+        oldest = self.oldest_seq()
+        return oldest is not None and since < oldest - 1
+
+    def scan(self, account: Optional[str] = None):
+        """Context manager yielding a cursor over COLUMNS, ordered by (account_id, uic)."""
+        raise NotImplementedError
+
+    def history(self, sql: str, params: tuple, account: Optional[str] = None):
+        """Context manager yielding a cursor over a positions_history.range_query() query
+        (`account` is the query's account filter, if any)."""
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+
+class ConnectionPool:
+    """Bounded pool of SQLite connections shared by request threads.
+
+    Connections are opened lazily up to `size`, configured once (WAL, pragmas) and
+    reused, so each keeps its statement cache across requests.
+    """
+
+    def __init__(self, path: str, size: int):
+        self.path = path
+        self.size = max(1, size)
+        self._idle: "queue.LifoQueue[sqlite3.Connection]" = queue.LifoQueue()
+        self._created = 0
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+
+    def _open(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(
+            self.path,
+            timeout=SQLITE_BUSY_TIMEOUT_MS / 1000.0,
+            check_same_thread=False,
+            cached_statements=256,
+        )
+        conn.row_factory = sqlite3.Row
+        conn.execute(f"PRAGMA journal_mode={SQLITE_JOURNAL_MODE}")
+        conn.execute(f"PRAGMA synchronous={SQLITE_SYNCHRONOUS}")
+        conn.execute(f"PRAGMA cache_size=-{SQLITE_CACHE_KB}")
+        conn.execute(f"PRAGMA mmap_size={SQLITE_MMAP_BYTES}")
+        conn.execute("PRAGMA temp_store=MEMORY")
+        conn.execute(f"PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT_MS}")
+        return conn
+
+    def _acquire(self) -> sqlite3.Connection:
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+        with self._lock:
+            if self._created < self.size:
+                self._created += 1
+                try:
+                    return self._open()
+                except Exception:
+                    self._created -= 1
+                    raise
+        return self._idle.get(timeout=SQLITE_BUSY_TIMEOUT_MS / 1000.0)
+
+    @contextmanager
+    def connection(self):
+        """Yield a pooled connection inside a transaction (commit on success, rollback on error)."""
+        conn = self._acquire()
+        try:
+            with conn:
+                yield conn
+        finally:
+            self._idle.put(conn)
+
+    def close(self):
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                break
+        with self._lock:
+            self._created = 0
+
+
+_UPSERT_SQL = """
+    INSERT INTO positions (uic, symbol, account_id, amount, last_price, pnl, updated_at, asset_type, market_value)
+    VALUES(?,?,?,?,?,?,?,?,?)
+    ON CONFLICT(account_id, uic) DO UPDATE SET
+        symbol=excluded.symbol,
+        amount=excluded.amount,
+        last_price=excluded.last_price,
+        pnl=excluded.pnl,
+        updated_at=excluded.updated_at,
+        asset_type=excluded.asset_type,
+        market_value=excluded.market_value
+"""
+_CHANGE_SQL = """
+    INSERT INTO position_changes (uic, symbol, account_id, amount, last_price, pnl, updated_at, asset_type,
+                                  market_value)
+    VALUES(?,?,?,?,?,?,?,?,?)
+"""
+
+
+def _db_version(conn) -> int:
+    row = conn.execute("SELECT value FROM store_meta WHERE key='version'").fetchone()
+    return row[0] if row else 0
+
+
+def _bump_version(conn) -> int:
+    conn.execute("UPDATE store_meta SET value=value+1 WHERE key='version'")
+    return _db_version(conn)
+
+
+def _last_seq(conn) -> int:
+    return conn.execute("SELECT COALESCE(MAX(seq), 0) FROM position_changes").fetchone()[0]
+
+
+def _fetch_existing(conn, keys: List[Key]) -> Existing:
+    """Stored (last_price, asset_type, updated_at) for all (account_id, uic) `keys`; one primary-key
+    query per account and chunk of _IN_CHUNK uics."""
+    by_account: Dict[str, List[int]] = {}
+    for account_id, uic in keys:
+        by_account.setdefault(account_id, []).append(uic)
+    out: Existing = {}
+    for account_id, uics in by_account.items():
+        for i in range(0, len(uics), _IN_CHUNK):
+            chunk = uics[i:i + _IN_CHUNK]
+            marks = ",".join("?" * len(chunk))
+            sql = (f"SELECT uic, last_price, asset_type, updated_at FROM positions"
+                   f" WHERE account_id = ? AND uic IN ({marks})")
+            for uic, price, asset_type, updated_at in conn.execute(sql, [account_id] + chunk):
+                out[(account_id, uic)] = (price, asset_type, updated_at)
+    return out
+
+
+class SQLiteBackend(PositionsBackend):
+    """The durable store: one SQLite database behind a connection pool."""
+
+    name = "sqlite"
+    features = frozenset((HISTORY, BACKUP))
+
+    def __init__(self, path: str, pool_size: int = 8, changes_retention: int = 100000):
+        self.path = path
+        self.changes_retention = changes_retention
+        self.pool = ConnectionPool(path, pool_size)
+
+    def connect(self):
+        return self.pool.connection()
+
+    def init(self):
+        positions_schema.migrate(self.connect)
+
+    def version(self) -> int:
+        with self.connect() as conn:
+            return _db_version(conn)
+
+    def rows(self) -> List[dict]:
+        with self.connect() as conn:
+            return [dict(r) for r in conn.execute(f"SELECT {', '.join(COLUMNS)} FROM positions")]
+
+    def commit(self, rows: Dict[Key, tuple], select: Select, part: int = 0) -> List[Commit]:
+        with self.connect() as conn:
+            # take the write lock up front: read-then-write in one snapshot
+            conn.execute("BEGIN IMMEDIATE")
+            batch = select(rows, _fetch_existing(conn, list(rows)))
+            if not batch:
+                return []
+            conn.executemany(_UPSERT_SQL, batch)
+            version = _bump_version(conn)
+            prev_seq = _last_seq(conn)
+            conn.executemany(_CHANGE_SQL, batch)
+            positions_history.record(conn, prev_seq)
+            last_seq = _last_seq(conn)
+            if last_seq > self.changes_retention:
+                conn.execute("DELETE FROM position_changes WHERE seq <= ?", (last_seq - self.changes_retention,))
+        return [Commit(part, version, batch)]
+
+    def query(self, q: PositionQuery) -> List[dict]:
+        where, params = [], []
+        if q.account is not None:
+            where.append("account_id = ?")
+            params.append(q.account)
+        if q.symbol:
+            where.append("symbol >= ? AND symbol < ?")
+            params += list(_symbol_range(q.symbol))
+        if q.updated_since is not None:
+            where.append("updated_at >= ?")
+            params.append(q.updated_since)
+        if q.after:
+            where.append(f"(updated_at, account_id, uic) {'<' if q.order == 'desc' else '>'} (?, ?, ?)")
+            params += list(q.after)
+        sql = f"SELECT {', '.join(q.columns)} FROM positions"
+        if where:
+            sql += " WHERE " + " AND ".join(where)
+        direction = "DESC" if q.order == "desc" else "ASC"
+        sql += f" ORDER BY updated_at {direction}, account_id {direction}, uic {direction} LIMIT ?"
+        with self.connect() as conn:
+            return [dict(r) for r in conn.execute(sql, params + [q.limit])]
+
+    def changes_since(self, since: int, limit: int) -> List[dict]:
+        with self.connect() as conn:
+            rows = conn.execute("SELECT * FROM position_changes WHERE seq > ? ORDER BY seq LIMIT ?", (since, limit))
+            return [dict(r) for r in rows]
+
+    def last_seq(self) -> int:
+        with self.connect() as conn:
+            return _last_seq(conn)
+
+    def oldest_seq(self) -> Optional[int]:
+        with self.connect() as conn:
+            return conn.execute("SELECT MIN(seq) FROM position_changes").fetchone()[0]
+
+    @contextmanager
+    def scan(self, account: Optional[str] = None):
+        sql = f"SELECT {', '.join(COLUMNS)} FROM positions"
+        params: tuple = ()
+        if account is not None:
+            sql += " WHERE account_id = ?"
+            params = (account,)
+        with self.connect() as conn:
+            yield conn.execute(sql + " ORDER BY account_id, uic", params)
+
+    @contextmanager
+    def history(self, sql: str, params: tuple, account: Optional[str] = None):
+        with self.connect() as conn:
+            yield conn.execute(sql, params)
+
+    def close(self):
+        self.pool.close()
+
+
+class _ListCursor:
+    """The slice of the DB-API cursor interface positions_export reads."""
+
+    def __init__(self, columns: Tuple[str, ...], rows: List[tuple]):
+        self.description = [(c, None, None, None, None, None, None) for c in columns]
+        self._rows = rows
+        self._pos = 0
+
+    def fetchmany(self, size: int) -> List[tuple]:
+        out = self._rows[self._pos:self._pos + size]
+        self._pos += len(out)
+        return out
+
+    def fetchall(self) -> List[tuple]:
+        return self.fetchmany(len(self._rows))
+
+
+class _MergedCursor:
+    """Several cursors ordered by `key` read as one (heapq.merge keeps each input's order)."""
+
+    def __init__(self, cursors: list, key: Callable, reverse: bool = False):
+        self.description = cursors[0].description
+        self._rows = heapq.merge(*cursors, key=key, reverse=reverse)
+
+    def __iter__(self):
+        return self._rows
+
+    def fetchmany(self, size: int) -> list:
+        return [r for _, r in zip(range(size), self._rows)]
+
+    def fetchall(self) -> list:
+        return list(self._rows)
+
+
+class MemoryBackend(PositionsBackend):
+    """Positions, version and change feed in process memory, guarded by one lock."""
+
+    name = "memory"
+
+    def __init__(self, changes_retention: int = 100000):
+        self.changes_retention = max(1, changes_retention)
+        self._rows: Dict[Key, tuple] = {}
+        self._version = 0
+        # change feed: parallel lists of seqs (sorted) and change dicts
+        self._seqs: List[int] = []
+        self._changes: List[dict] = []
+        self._seq = 0
+        self._lock = threading.Lock()
+
+    def version(self) -> int:
+        return self._version
+
+    def rows(self) -> List[dict]:
+        with self._lock:
+            return [dict(zip(COLUMNS, r)) for r in self._rows.values()]
+
+    def commit(self, rows: Dict[Key, tuple], select: Select) -> List[Commit]:
+        with self._lock:
+            stored = self._rows
+            existing = {k: (stored[k][4], stored[k][7], stored[k][6]) for k in rows if k in stored}
+            batch = select(rows, existing)
+            if not batch:
+                return []
+            for r in batch:
+                stored[(r[2], r[0])] = r
+                self._seq += 1
+                self._seqs.append(self._seq)
+                self._changes.append(dict(zip(CHANGE_COLUMNS, (self._seq,) + r)))
+            excess = len(self._seqs) - self.changes_retention
+            if excess > 0:
+                del self._seqs[:excess]
+                del self._changes[:excess]
+            self._version += 1
+            return [Commit(0, self._version, batch)]
+
+    def query(self, q: PositionQuery) -> List[dict]:
+        with self._lock:
+            candidates = list(self._rows.values())
+        lo, hi = _symbol_range(q.symbol) if q.symbol else (None, None)
+        desc = q.order == "desc"
+        out = []
+        for r in candidates:
+            if q.account is not None and r[2] != q.account:
+                continue
+            if lo is not None and not (r[1] is not None and lo <= r[1] < hi):
+                continue
+            if q.updated_since is not None and (r[6] is None or r[6] < q.updated_since):
+                continue
+            if q.after:
+                key = (r[6], r[2], r[0])
+                if (key >= q.after) if desc else (key <= q.after):
+                    continue
+            out.append(r)
+        out.sort(key=lambda r: (r[6] or 0, r[2], r[0]), reverse=desc)
+        idx = [COLUMNS.index(c) for c in q.columns]
+        return [{c: r[i] for c, i in zip(q.columns, idx)} for r in out[:q.limit]]
+
+    def changes_since(self, since: int, limit: int) -> List[dict]:
+        with self._lock:
+            start = bisect_left(self._seqs, since + 1)
+            return [dict(ch) for ch in self._changes[start:start + limit]]
+
+    def last_seq(self) -> int:
+        return self._seq
+
+    def oldest_seq(self) -> Optional[int]:
+        with self._lock:
+            return self._seqs[0] if self._seqs else None
+
+    @contextmanager
+    def scan(self, account: Optional[str] = None) -> Iterator[_ListCursor]:
+        with self._lock:
+            rows = [r for r in self._rows.values() if account is None or r[2] == account]
+        rows.sort(key=lambda r: (r[2], r[0]))
+        yield _ListCursor(COLUMNS, rows)
+
+
+def shard_of(account_id: str, shards: int) -> int:
+    """Shard holding `account_id`; crc32 so every process and restart agrees."""
+    return zlib.crc32(account_id.encode("utf-8")) % shards
+
+
+def shard_path(db_path: str, index: int) -> str:
+    root, ext = os.path.splitext(db_path)
+    return f"{root}.shard{index}{ext or '.db'}"
+
+
+class ShardedBackend(PositionsBackend):
+    """SQLiteBackend per shard, positions routed by account_id (see the module docstring)."""
+
+    name = "sharded"
+    features = SQLiteBackend.features
+
+    def __init__(self, path: str, shards: int = STORE_SHARDS, pool_size: int = 8, changes_retention: int = 100000):
+        if shards < 1:
+            raise ValueError("STORE_SHARDS must be at least 1")
+        self.path = path
+        self.shards = [SQLiteBackend(shard_path(path, i), pool_size, changes_retention) for i in range(shards)]
+        self._executor = ThreadPoolExecutor(max_workers=shards, thread_name_prefix="positions-shard")
+
+    def shard(self, account_id: str) -> SQLiteBackend:
+        return self.shards[shard_of(account_id, len(self.shards))]
+
+    def init(self):
+        n = len(self.shards)
+        for i, shard in enumerate(self.shards):
+            shard.init()
+            with shard.connect() as conn:
+                conn.execute("INSERT OR IGNORE INTO store_meta (key, value) VALUES ('shard_count', ?)", (n,))
+                conn.execute("INSERT OR IGNORE INTO store_meta (key, value) VALUES ('shard_index', ?)", (i,))
+                meta = dict(conn.execute(
+                    "SELECT key, value FROM store_meta WHERE key IN ('shard_count', 'shard_index')").fetchall())
+            if (meta["shard_count"], meta["shard_index"]) != (n, i):
+                raise RuntimeError(f"{shard.path} is shard {meta['shard_index']} of {meta['shard_count']}, "
+                                   f"not {i} of {n}: STORE_SHARDS changed, the accounts would be misrouted")
+
+    def version(self) -> int:
+        # each component only grows, so the sum changes whenever any shard does
+        return sum(self.versions())
+
+    def versions(self) -> Tuple[int, ...]:
+        return tuple(shard.version() for shard in self.shards)
+
+    def partitions(self) -> List[PositionsBackend]:
+        return list(self.shards)
+
+    def rows(self) -> List[dict]:
+        return [r for shard in self.shards for r in shard.rows()]
+
+    def commit(self, rows: Dict[Key, tuple], select: Select) -> List[Commit]:
+        n = len(self.shards)
+        parts: Dict[int, Dict[Key, tuple]] = {}
+        for key, r in rows.items():
+            parts.setdefault(shard_of(key[0], n), {})[key] = r
+        if len(parts) == 1:
+            (i, part), = parts.items()
+            return self.shards[i].commit(part, select, i)
+        done = self._executor.map(lambda item: self.shards[item[0]].commit(item[1], select, item[0]),
+                                  parts.items())
+        return [c for commits in done for c in commits]
+
+    def query(self, q: PositionQuery) -> List[dict]:
+        if q.account is not None:
+            return self.shard(q.account).query(q)
+        pages = [shard.query(q) for shard in self.shards]
+        merged = heapq.merge(*pages, key=lambda r: (r["updated_at"] or 0, r["account_id"], r["uic"]),
+                             reverse=q.order == "desc")
+        return [r for _, r in zip(range(q.limit), merged)]
+
+    def _format(self, seqs) -> str:
+        return ".".join(str(s) for s in seqs)
+
+    def parse_cursor(self, raw: str) -> str:
+        seqs = [int(s) for s in raw.split(".")]
+        if seqs == [0]:
+            seqs = [0] * len(self.shards)
+        if len(seqs) != len(self.shards) or min(seqs) < 0:
+            raise ValueError(f"cursor {raw!r} does not match {len(self.shards)} shards")
+        return self._format(seqs)
+
+    def cursor_expired(self, since: str) -> bool:
+        seqs = [int(s) for s in since.split(".")]
+        return any(shard.cursor_expired(seq) for shard, seq in zip(self.shards, seqs))
+
+    def changes_since(self, since: str, limit: int) -> List[dict]:
+        seqs = [int(s) for s in since.split(".")]
+        feeds = [[(i, ch) for ch in shard.changes_since(seqs[i], limit)] for i, shard in enumerate(self.shards)]
+        out = []
+        for i, ch in heapq.merge(*feeds, key=lambda item: (item[1]["updated_at"] or 0, item[0])):
+            if len(out) == limit:
+                break
+            # the cursor after this change: every shard's position so far
+            seqs[i] = ch["seq"]
+            ch["seq"] = self._format(seqs)
+            out.append(ch)
+        return out
+
+    def last_seq(self) -> str:
+        return self._format(shard.last_seq() for shard in self.shards)
+
+    def oldest_seq(self) -> str:
+        return self._format(shard.oldest_seq() or 0 for shard in self.shards)
+
+    @contextmanager
+    def _merged(self, open_cursor: Callable, account: Optional[str], key: Callable):
+        if account is not None:
+            with open_cursor(self.shard(account)) as cursor:
+                yield cursor
+            return
+        with ExitStack() as stack:
+            yield _MergedCursor([stack.enter_context(open_cursor(shard)) for shard in self.shards], key)
+
+    def scan(self, account: Optional[str] = None):
+        return self._merged(lambda shard: shard.scan(account), account, key=lambda r: (r[2], r[0]))
+
+    def history(self, sql: str, params: tuple, account: Optional[str] = None):
+        # range queries are ordered by their first column (ts / bucket); a LIMIT applies per shard
+        return self._merged(lambda shard: shard.history(sql, params), account, key=lambda r: r[0])
+
+    def close(self):
+        for shard in self.shards:
+            shard.close()
+
+
+def create_backend(name: str, db_path: str, pool_size: int, changes_retention: int) -> PositionsBackend:
+    if name == "sqlite":
+        return SQLiteBackend(db_path, pool_size, changes_retention)
+    if name == "sharded":
+        return ShardedBackend(db_path, STORE_SHARDS, pool_size, changes_retention)
+    if name == "memory":
+        return MemoryBackend(changes_retention)
+    raise ValueError(f"unknown STORE_BACKEND {name!r} (sqlite, sharded, memory)")
+
+
+def main():
+    if len(sys.argv) != 3 or sys.argv[1] != "init":
+        print(__doc__)
+        return 2
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+    backend = create_backend(STORE_BACKEND, sys.argv[2], 1, 100000)
+    try:
+        backend.init()
+    finally:
+        backend.close()
+    paths = [p.path for p in backend.partitions() if hasattr(p, "path")]
+    print(f"{backend.name}: initialized {', '.join(paths) or 'in memory'}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
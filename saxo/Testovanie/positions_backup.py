@@ -0,0 +1,218 @@
+#!/usr/bin/env python3
+"""Online backups of the positions database.
+
+Backups use SQLite's backup API in steps of BACKUP_PAGES_PER_STEP pages, sleeping
+BACKUP_STEP_SLEEP_MS between steps, so the copy never holds a lock /ingest needs.
+The source connection keeps one read transaction open for the whole copy: in WAL
+mode that pins a consistent snapshot while writers carry on, and it stops the backup
+from restarting whenever /ingest commits (without it a busy store never finishes).
+The WAL cannot be checkpointed past that snapshot until the copy ends, so it grows
+by whatever is ingested meanwhile.
+
+Each copy is written to a .partial file, checked with PRAGMA quick_check and only
+then renamed to positions-<UTC timestamp, ms>.db; the newest BACKUP_KEEP are kept.
+The store runs BackupJob on a schedule and POST /admin/backup takes one on demand.
+With several gunicorn workers a lock file in BACKUP_DIR lets only one of them copy.
+
+    python3 positions_backup.py backup /data/positions.db /data/backups
+    python3 positions_backup.py list /data/backups
+    python3 positions_backup.py restore /data/backups/positions-20260101T000000.000Z.db /data/positions.db
+
+Restore with the store stopped (docker compose stop positions): it verifies the
+backup, then copies it over the live file through the backup API, so the target's
+WAL and shm files stay consistent.
+
+Config via env:
+- BACKUP_DIR (default /data/backups)
+- BACKUP_INTERVAL_S (default 3600, 0 = no scheduled backups)
+- BACKUP_KEEP (default 24) backups kept by rotation
+- BACKUP_PAGES_PER_STEP (default 256) pages copied per step
+- BACKUP_STEP_SLEEP_MS (default 5) pause between steps
+"""
+import os
+import sys
+import time
+import fcntl
+import sqlite3
+import logging
+import threading
+from typing import List, Optional
+
+BACKUP_DIR = os.getenv("BACKUP_DIR", "/data/backups")
+BACKUP_INTERVAL_S = int(os.getenv("BACKUP_INTERVAL_S", "3600"))
+BACKUP_KEEP = int(os.getenv("BACKUP_KEEP", "24"))
+BACKUP_PAGES_PER_STEP = int(os.getenv("BACKUP_PAGES_PER_STEP", "256"))
+BACKUP_STEP_SLEEP_MS = float(os.getenv("BACKUP_STEP_SLEEP_MS", "5"))
+
+_PREFIX = "positions-"
+_SUFFIX = ".db"
+_LOCK_NAME = ".backup.lock"
+
+logger = logging.getLogger(__name__)
+
+
+class BackupInProgress(RuntimeError):
+    """Another thread or process is already writing a backup to this directory."""
+
+
+def list_backups(dest_dir: str) -> List[str]:
+    """Completed backups in `dest_dir`, oldest first (names sort by timestamp)."""
+    try:
+        names = os.listdir(dest_dir)
+    except FileNotFoundError:
+        return []
+    return [os.path.join(dest_dir, n) for n in sorted(names) if n.startswith(_PREFIX) and n.endswith(_SUFFIX)]
+
+
+def _check(path: str):
+    conn = sqlite3.connect(path)
+    try:
+        result = conn.execute("PRAGMA quick_check").fetchone()[0]
+    finally:
+        conn.close()
+    if result != "ok":
+        raise sqlite3.DatabaseError(f"{path}: quick_check failed: {result}")
+
+
+def _copy(src: sqlite3.Connection, dest_path: str, pages: int, sleep_s: float) -> int:
+    """Step-wise backup of `src` into `dest_path`; returns the number of steps."""
+    steps = 0
+
+    def progress(status, remaining, total):
+        nonlocal steps
+        steps += 1
+
+    dest = sqlite3.connect(dest_path)
+    try:
+        src.backup(dest, pages=pages, progress=progress, sleep=sleep_s)
+    finally:
+        dest.close()
+    return steps
+
+
+def backup(db_path: str, dest_dir: str = BACKUP_DIR, keep: int = BACKUP_KEEP,
+           pages: int = BACKUP_PAGES_PER_STEP, sleep_ms: float = BACKUP_STEP_SLEEP_MS) -> dict:
+    """Copy `db_path` into `dest_dir` without blocking writers, then rotate; returns stats."""
+    os.makedirs(dest_dir, exist_ok=True)
+    lock = open(os.path.join(dest_dir, _LOCK_NAME), "w")
+    try:
+        try:
+            fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            raise BackupInProgress(f"a backup into {dest_dir} is already running")
+        t0 = time.perf_counter()
+        now = time.time()
+        # millisecond resolution: on-demand backups can follow each other within a second
+        stamp = time.strftime("%Y%m%dT%H%M%S", time.gmtime(now)) + f".{int(now * 1000) % 1000:03d}Z"
+        name = _PREFIX + stamp + _SUFFIX
+        final = os.path.join(dest_dir, name)
+        partial = final + ".partial"
+        src = sqlite3.connect(db_path, isolation_level=None, timeout=30)
+        try:
+            # pin one WAL snapshot for the whole copy, see the module docstring
+            src.execute("BEGIN")
+            src.execute("SELECT COUNT(*) FROM sqlite_master").fetchone()
+            steps = _copy(src, partial, pages, sleep_ms / 1000.0)
+            src.execute("COMMIT")
+        finally:
+            src.close()
+        _check(partial)
+        os.replace(partial, final)
+        removed = rotate(dest_dir, keep)
+        stats = {"path": final, "bytes": os.path.getsize(final), "steps": steps,
+                 "elapsed_ms": round((time.perf_counter() - t0) * 1000.0, 1), "removed": removed}
+        logger.info("positions backup %s (%d bytes, %d steps) in %.0f ms", final, stats["bytes"], steps,
+                    stats["elapsed_ms"])
+        return stats
+    finally:
+        lock.close()
+
+
+def rotate(dest_dir: str, keep: int = BACKUP_KEEP) -> List[str]:
+    """Delete all but the newest `keep` backups (and stale .partial files); returns removed paths."""
+    removed = []
+    backups = list_backups(dest_dir)
+    for path in backups[:max(0, len(backups) - keep)]:
+        os.remove(path)
+        removed.append(path)
+    for n in os.listdir(dest_dir):
+        if n.endswith(".partial"):
+            # only reached under the backup lock, so no copy is writing to it
+            os.remove(os.path.join(dest_dir, n))
+            removed.append(os.path.join(dest_dir, n))
+    return removed
+
+
+def restore(backup_path: str, db_path: str, pages: int = BACKUP_PAGES_PER_STEP) -> dict:
+    """Replace the contents of `db_path` with `backup_path`. The store must be stopped."""
+    _check(backup_path)
+    t0 = time.perf_counter()
+    src = sqlite3.connect(backup_path)
+    try:
+        steps = _copy(src, db_path, pages, 0.0)
+    finally:
+        src.close()
+    _check(db_path)
+    return {"path": db_path, "from": backup_path, "steps": steps,
+            "elapsed_ms": round((time.perf_counter() - t0) * 1000.0, 1)}
+
+
+def _latest_age_s(dest_dir: str) -> Optional[float]:
+    backups = list_backups(dest_dir)
+    return time.time() - os.path.getmtime(backups[-1]) if backups else None
+
+
+class BackupJob(threading.Thread):
+    """Daemon thread taking a backup every `interval` seconds.
+
+    Every store process runs one; a process skips its turn when another one has
+    written a backup within the interval or is writing one right now.
+    """
+
+    def __init__(self, db_path: str, dest_dir: str = BACKUP_DIR, interval: int = BACKUP_INTERVAL_S):
+        super().__init__(name="positions-backup", daemon=True)
+        self.db_path = db_path
+        self.dest_dir = dest_dir
+        self.interval = interval
+        self._stop_event = threading.Event()
+
+    def run(self):
+        while not self._stop_event.wait(self._next_wait()):
+            age = _latest_age_s(self.dest_dir)
+            if age is not None and age < self.interval * 0.9:
+                continue
+            try:
+                backup(self.db_path, self.dest_dir)
+            except BackupInProgress:
+                pass
+            except Exception:
+                logger.exception("positions backup failed")
+
+    def _next_wait(self) -> float:
+        age = _latest_age_s(self.dest_dir)
+        if age is None:
+            return min(60.0, float(self.interval))
+        return max(1.0, self.interval - age)
+
+    def stop(self):
+        self._stop_event.set()
+
+
+def main():
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+    args = sys.argv[1:]
+    if len(args) == 3 and args[0] == "backup":
+        print(backup(args[1], args[2]))
+    elif len(args) == 2 and args[0] == "list":
+        for path in list_backups(args[1]):
+            print(f"{path}\t{os.path.getsize(path)}")
+    elif len(args) == 3 and args[0] == "restore":
+        print(restore(args[1], args[2]))
+    else:
+        print(__doc__)
+        return 2
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
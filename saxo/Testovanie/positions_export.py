@@ -0,0 +1,158 @@
+#!/usr/bin/env python3
+"""Columnar export of store query results (positions, history ranges).
+
+Rows are read from a SQLite cursor in chunks and converted straight into typed
+columns, with no per-row JSON on either side. Formats, by preference:
+- arrow: Arrow IPC stream, one record batch per chunk, streamed as it is produced
+- parquet: one row group per chunk, streamed (the footer comes last)
+- npy: NumPy structured array (one record dtype, fixed-width strings); needs the
+  full result before the header can be written, so it is built in memory
+
+arrow/parquet need pyarrow, npy needs numpy. Both are in requirements.txt, so the
+images ship all three formats; outside them available_formats() lists what is
+installed, and the default is the first of them.
+
+Reading the result:
+    pyarrow.ipc.open_stream(body).read_all()
+    pyarrow.parquet.read_table(io.BytesIO(body))
+    numpy.load(io.BytesIO(body))            # structured array, arr["last_price"] etc.
+"""
+import io
+from typing import Iterator, List, Optional, Sequence
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # optional
+    pa = None
+    pq = None
+
+try:
+    import numpy as np
+except ImportError:  # optional
+    np = None
+
+CHUNK_ROWS = 65536
+
+MEDIA_TYPES = {
+    "arrow": "application/vnd.apache.arrow.stream",
+    "parquet": "application/vnd.apache.parquet",
+    "npy": "application/octet-stream",
+}
+EXTENSIONS = {"arrow": "arrows", "parquet": "parquet", "npy": "npy"}
+
+# column -> "int" | "str"; anything else is float64
+_COLUMN_KINDS = {
+    "uic": "int",
+    "updated_at": "int",
+    "ts": "int",
+    "samples": "int",
+    "symbol": "str",
+    "account_id": "str",
+    "asset_type": "str",
+}
+
+
+def available_formats() -> List[str]:
+    formats = []
+    if pa is not None:
+        formats += ["arrow", "parquet"]
+    if np is not None:
+        formats.append("npy")
+    return formats
+
+
+def _kind(column: str) -> str:
+    return _COLUMN_KINDS.get(column, "float")
+
+
+def _chunks(cursor, chunk_rows: int) -> Iterator[list]:
+    while True:
+        rows = cursor.fetchmany(chunk_rows)
+        if not rows:
+            return
+        yield rows
+
+
+def _arrow_schema(columns: Sequence[str]):
+    types = {"int": pa.int64(), "str": pa.string(), "float": pa.float64()}
+    return pa.schema([(c, types[_kind(c)]) for c in columns])
+
+
+def _arrow_batches(cursor, schema, chunk_rows: int):
+    for rows in _chunks(cursor, chunk_rows):
+        # transpose once per chunk; pyarrow converts each column list in C
+        cols = list(zip(*rows))
+        yield pa.RecordBatch.from_arrays(
+            [pa.array(col, type=schema.field(i).type) for i, col in enumerate(cols)], schema=schema)
+
+
+def _drain(buf: io.BytesIO) -> bytes:
+    data = buf.getvalue()
+    buf.seek(0)
+    buf.truncate()
+    return data
+
+
+def _stream_arrow(cursor, columns: Sequence[str], chunk_rows: int) -> Iterator[bytes]:
+    schema = _arrow_schema(columns)
+    buf = io.BytesIO()
+    with pa.ipc.new_stream(buf, schema) as writer:
+        for batch in _arrow_batches(cursor, schema, chunk_rows):
+            writer.write_batch(batch)
+            yield _drain(buf)
+    yield _drain(buf)
+
+
+def _stream_parquet(cursor, columns: Sequence[str], chunk_rows: int) -> Iterator[bytes]:
+    schema = _arrow_schema(columns)
+    buf = io.BytesIO()
+    with pq.ParquetWriter(buf, schema, compression="zstd") as writer:
+        for batch in _arrow_batches(cursor, schema, chunk_rows):
+            writer.write_batch(batch)
+            yield _drain(buf)
+    yield _drain(buf)
+
+
+def _npy(cursor, columns: Sequence[str]) -> bytes:
+    rows = cursor.fetchall()
+    cols = list(zip(*rows)) if rows else [()] * len(columns)
+    arrays = []
+    for name, col in zip(columns, cols):
+        kind = _kind(name)
+        if kind == "str":
+            arrays.append(np.array(["" if v is None else v for v in col], dtype=str))
+        elif kind == "int":
+            arrays.append(np.array([0 if v is None else v for v in col], dtype=np.int64))
+        else:
+            arrays.append(np.array([np.nan if v is None else v for v in col], dtype=np.float64))
+    out = np.empty(len(rows), dtype=[(name, a.dtype) for name, a in zip(columns, arrays)])
+    for name, a in zip(columns, arrays):
+        out[name] = a
+    buf = io.BytesIO()
+    np.save(buf, out, allow_pickle=False)
+    return buf.getvalue()
+
+
+def export(cursor, fmt: str, chunk_rows: int = CHUNK_ROWS) -> Iterator[bytes]:
+    """Encode the rows of an executed cursor as `fmt`, yielding body chunks."""
+    if fmt not in available_formats():
+        raise ValueError(f"format {fmt!r} not available (have: {', '.join(available_formats()) or 'none'})")
+    columns = [d[0] for d in cursor.description]
+    if fmt == "arrow":
+        yield from _stream_arrow(cursor, columns, chunk_rows)
+    elif fmt == "parquet":
+        yield from _stream_parquet(cursor, columns, chunk_rows)
+    else:
+        yield _npy(cursor, columns)
+
+
+def pick_format(requested: Optional[str], accept: Optional[str] = None) -> Optional[str]:
+    """Explicit ?format= wins, then a matching Accept media type, then the best installed."""
+    formats = available_formats()
+    if requested:
+        return requested if requested in formats else None
+    for fmt in formats:
+        if accept and MEDIA_TYPES[fmt] in accept:
+            return fmt
+    return formats[0] if formats else None
@@ -0,0 +1,210 @@
+#!/usr/bin/env python3
+"""Price/PnL history for the positions store.
+
+Every update accepted by /ingest is appended to `price_history` and folded into
+OHLC rollups at 1-minute, 1-hour and 1-day resolution in the same transaction.
+Both steps are single INSERT ... SELECT statements over the rows the ingest just
+appended to the change feed, so no per-row binding happens in Python. A background
+job enforces retention per level, deleting in small chunks so ingest is never
+blocked for long; once the raw and 1-minute rows age out, only the coarser rollups
+remain (downsampling).
+Range queries pick the finest level that covers the requested window.
+
+Config via env:
+- HISTORY_ENABLED (default 1)
+- HISTORY_RAW_DAYS (default 7) raw samples kept
+- HISTORY_1M_DAYS (default 30) 1-minute rollups kept
+- HISTORY_1H_DAYS (default 365) 1-hour rollups kept
+- HISTORY_1D_DAYS (default 0 = forever) 1-day rollups kept
+- HISTORY_RETENTION_INTERVAL_S (default 3600) how often the retention job runs
+"""
+import os
+import time
+import logging
+import threading
+from typing import Dict, Optional, Tuple
+
+HISTORY_ENABLED = os.getenv("HISTORY_ENABLED", "1").lower() in ("1", "true", "yes")
+RETENTION_INTERVAL_S = int(os.getenv("HISTORY_RETENTION_INTERVAL_S", "3600"))
+
+RAW = "raw"
+# resolution name -> bucket width in seconds
+LEVELS: Dict[str, int] = {"1m": 60, "1h": 3600, "1d": 86400}
+RETENTION_DAYS: Dict[str, int] = {
+    RAW: int(os.getenv("HISTORY_RAW_DAYS", "7")),
+    "1m": int(os.getenv("HISTORY_1M_DAYS", "30")),
+    "1h": int(os.getenv("HISTORY_1H_DAYS", "365")),
+    "1d": int(os.getenv("HISTORY_1D_DAYS", "0")),
+}
+# auto resolution: largest window (seconds) served from each level, finest first
+_AUTO_MAX_SPAN = ((RAW, 2 * 3600), ("1m", 2 * 86400), ("1h", 90 * 86400), ("1d", None))
+_DELETE_CHUNK = 5000
+
+logger = logging.getLogger(__name__)
+
+_HISTORY_SQL = """
+    INSERT INTO price_history (ts, account_id, uic, price, pnl)
+    SELECT updated_at, COALESCE(account_id, ''), uic, last_price, pnl
+    FROM position_changes WHERE seq > ? ORDER BY seq
+"""
+# the WHERE clause is required: without it SQLite parses ON CONFLICT as a join constraint
+_ROLLUP_SQL = """
+    INSERT INTO price_rollups (resolution, account_id, uic, bucket, open, high, low, close, pnl, samples)
+    SELECT ?, account_id, uic, ts - ts % ?, price, price, price, price, pnl, 1
+    FROM price_history WHERE rowid > ? AND price IS NOT NULL ORDER BY rowid
+    ON CONFLICT(resolution, account_id, uic, bucket) DO UPDATE SET
+        high=MAX(high, excluded.high),
+        low=MIN(low, excluded.low),
+        close=excluded.close,
+        pnl=excluded.pnl,
+        samples=samples+1
+"""
+
+
+def init_history(conn):
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS price_history (
+            ts INTEGER NOT NULL,
+            account_id TEXT NOT NULL DEFAULT '',
+            uic INTEGER NOT NULL,
+            price REAL,
+            pnl REAL
+        )
+        """
+    )
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_price_history_uic_ts ON price_history (uic, ts)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_price_history_ts ON price_history (ts)")
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS price_rollups (
+            resolution INTEGER NOT NULL,
+            account_id TEXT NOT NULL DEFAULT '',
+            uic INTEGER NOT NULL,
+            bucket INTEGER NOT NULL,
+            open REAL,
+            high REAL,
+            low REAL,
+            close REAL,
+            pnl REAL,
+            samples INTEGER NOT NULL,
+            PRIMARY KEY (resolution, account_id, uic, bucket)
+        ) WITHOUT ROWID
+        """
+    )
+
+
+def record(conn, after_seq: int):
+    """Append the change-feed rows with seq > `after_seq` to history and fold them into rollups."""
+    if not HISTORY_ENABLED:
+        return
+    after_rowid = conn.execute("SELECT COALESCE(MAX(rowid), 0) FROM price_history").fetchone()[0]
+    conn.execute(_HISTORY_SQL, (after_seq,))
+    for width in LEVELS.values():
+        conn.execute(_ROLLUP_SQL, (width, width, after_rowid))
+
+
+def _pick_level(start: int, end: int, now: int) -> str:
+    span = end - start
+    for level, max_span in _AUTO_MAX_SPAN:
+        days = RETENTION_DAYS[level]
+        retained = days == 0 or start >= now - days * 86400
+        if retained and (max_span is None or span <= max_span):
+            return level
+    return "1d"
+
+
+def range_query(start: int, end: int, resolution: str = "auto", uic: Optional[int] = None,
+                account_id: Optional[str] = None, limit: Optional[int] = None) -> Tuple[str, str, tuple]:
+    """SQL for history in [start, end); returns (level, sql, params). uic=None spans all instruments."""
+    level = _pick_level(start, end, int(time.time())) if resolution == "auto" else resolution
+    where, params = [], []
+    if uic is not None:
+        where.append("uic = ?")
+        params.append(uic)
+    if account_id is not None:
+        where.append("account_id = ?")
+        params.append(account_id)
+    if level == RAW:
+        sql = "SELECT ts, account_id, uic, price, pnl FROM price_history WHERE ts >= ? AND ts < ?"
+        params = [start, end] + params
+        order = "ts"
+    else:
+        width = LEVELS[level]
+        sql = ("SELECT bucket AS ts, account_id, uic, open, high, low, close, pnl, samples FROM price_rollups"
+               " WHERE resolution = ? AND bucket >= ? AND bucket < ?")
+        params = [width, start - start % width, end] + params
+        order = "bucket"
+    sql += "".join(f" AND {w}" for w in where) + f" ORDER BY {order}"
+    if limit is not None:
+        sql += " LIMIT ?"
+        params.append(limit)
+    return level, sql, tuple(params)
+
+
+def query_range(open_cursor, uic: int, start: int, end: int, resolution: str = "auto",
+                account_id: Optional[str] = None, limit: int = 10000) -> dict:
+    """History of `uic` in [start, end); `resolution` is auto, raw, 1m, 1h or 1d.
+
+    `open_cursor(sql, params, account_id)` runs the query, e.g. the store backend's history().
+    """
+    level, sql, params = range_query(start, end, resolution, uic, account_id, limit)
+    data = []
+    with open_cursor(sql, params, account_id) as cursor:
+        # a sharded backend applies the LIMIT per shard
+        for r in cursor.fetchmany(limit):
+            row = dict(r)
+            del row["uic"]
+            data.append(row)
+    return {"uic": uic, "resolution": level, "from": start, "to": end, "count": len(data), "data": data}
+
+
+def enforce_retention(connect, now: Optional[int] = None) -> Dict[str, int]:
+    """Delete rows past retention, in chunks; `connect` is the store's connection factory."""
+    now = int(now or time.time())
+    deleted: Dict[str, int] = {}
+    for level, days in RETENTION_DAYS.items():
+        if days <= 0:
+            continue
+        cutoff = now - days * 86400
+        if level == RAW:
+            sql = ("DELETE FROM price_history WHERE rowid IN"
+                   " (SELECT rowid FROM price_history WHERE ts < ? LIMIT ?)")
+            args = (cutoff, _DELETE_CHUNK)
+        else:
+            sql = ("DELETE FROM price_rollups WHERE (resolution, account_id, uic, bucket) IN"
+                   " (SELECT resolution, account_id, uic, bucket FROM price_rollups"
+                   "  WHERE resolution = ? AND bucket < ? LIMIT ?)")
+            args = (LEVELS[level], cutoff, _DELETE_CHUNK)
+        total = 0
+        while True:
+            # one short transaction per chunk keeps the write lock available to /ingest
+            with connect() as conn:
+                n = conn.execute(sql, args).rowcount
+            total += n
+            if n < _DELETE_CHUNK:
+                break
+        deleted[level] = total
+    return deleted
+
+
+class RetentionJob(threading.Thread):
+    """Daemon thread running enforce_retention() every `interval` seconds."""
+
+    def __init__(self, connect, interval: int = RETENTION_INTERVAL_S):
+        super().__init__(name="history-retention", daemon=True)
+        self.connect = connect
+        self.interval = interval
+        self._stop_event = threading.Event()
+
+    def run(self):
+        while not self._stop_event.wait(self.interval):
+            try:
+                deleted = enforce_retention(self.connect)
+                if any(deleted.values()):
+                    logger.info("history retention deleted %s", deleted)
+            except Exception:
+                logger.exception("history retention failed")
+
+    def stop(self):
+        self._stop_event.set()
@@ -0,0 +1,213 @@
+#!/usr/bin/env python3
+"""Schema migrations for the positions store.
+
+The schema version lives in SQLite's `PRAGMA user_version`; `migrate()` applies every
+migration above it, in order, at store startup. Each migration receives the store's
+connection factory and must set user_version in the same transaction as its final
+step, so a crash leaves either the old or the new version, never a half-applied one.
+
+Migration 2 (composite key) is online: rows are copied into `positions_v2` in short
+chunked transactions while the old table keeps serving reads and writes, then one
+brief write transaction catches up rows changed during the copy and swaps the tables.
+It can also be run against a live volume before deploying the new store:
+
+    python3 positions_schema.py /data/positions.db
+
+Versions:
+1. single-account schema: positions keyed by uic, change feed, history, store_meta
+2. positions keyed by (account_id, uic); indexes on updated_at and symbol
+3. asset_type on positions and the change feed
+4. market_value (Saxo's PositionView.MarketValue) on positions and the change feed
+"""
+import sys
+import time
+import sqlite3
+import logging
+from contextlib import contextmanager
+from typing import Callable, List, Tuple
+
+import positions_history
+
+_COPY_CHUNK = 5000
+
+logger = logging.getLogger(__name__)
+
+
+def schema_version(conn) -> int:
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+
+def _migrate_1(connect):
+    with connect() as conn:
+        conn.execute("BEGIN IMMEDIATE")
+        if schema_version(conn) >= 1:
+            return
+        conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS positions (
+                uic INTEGER PRIMARY KEY,
+                symbol TEXT,
+                account_id TEXT,
+                amount REAL,
+                last_price REAL,
+                pnl REAL,
+                updated_at INTEGER
+            )
+            """
+        )
+        conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS position_changes (
+                seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                uic INTEGER,
+                symbol TEXT,
+                account_id TEXT,
+                amount REAL,
+                last_price REAL,
+                pnl REAL,
+                updated_at INTEGER
+            )
+            """
+        )
+        positions_history.init_history(conn)
+        conn.execute("CREATE TABLE IF NOT EXISTS store_meta (key TEXT PRIMARY KEY, value INTEGER)")
+        conn.execute("INSERT OR IGNORE INTO store_meta (key, value) VALUES ('version', 0)")
+        conn.execute("PRAGMA user_version = 1")
+
+
+_POSITIONS_V2 = """
+    CREATE TABLE IF NOT EXISTS positions_v2 (
+        account_id TEXT NOT NULL DEFAULT '',
+        uic INTEGER NOT NULL,
+        symbol TEXT,
+        amount REAL,
+        last_price REAL,
+        pnl REAL,
+        updated_at INTEGER,
+        PRIMARY KEY (account_id, uic)
+    ) WITHOUT ROWID
+"""
+_COPY_V2 = """
+    INSERT OR REPLACE INTO positions_v2 (account_id, uic, symbol, amount, last_price, pnl, updated_at)
+    SELECT COALESCE(account_id, ''), uic, symbol, amount, last_price, pnl, updated_at FROM positions
+"""
+
+
+def _migrate_2(connect):
+    with connect() as conn:
+        if schema_version(conn) >= 2:
+            return
+        conn.execute(_POSITIONS_V2)
+        # rows written after this point are picked up again by the catch-up step
+        watermark = conn.execute("SELECT COALESCE(MAX(updated_at), 0) FROM positions").fetchone()[0]
+
+    last_uic = -1
+    while True:
+        # one short write transaction per chunk; uic is the rowid, so this walks the table in order
+        with connect() as conn:
+            rows = conn.execute("SELECT uic FROM positions WHERE uic > ? ORDER BY uic LIMIT ?",
+                                (last_uic, _COPY_CHUNK)).fetchall()
+            if not rows:
+                break
+            conn.execute(_COPY_V2 + " WHERE uic > ? AND uic <= ?", (last_uic, rows[-1][0]))
+        last_uic = rows[-1][0]
+
+    with connect() as conn:
+        conn.execute("BEGIN IMMEDIATE")
+        if schema_version(conn) >= 2:
+            return
+        # updated_at has 1 s resolution: re-copy the watermark second as well
+        conn.execute(_COPY_V2 + " WHERE updated_at >= ?", (watermark,))
+        conn.execute("DROP TABLE positions")
+        conn.execute("ALTER TABLE positions_v2 RENAME TO positions")
+        # the primary key columns trail every index, so pages order by (updated_at, account_id, uic)
+        conn.execute("CREATE INDEX idx_positions_updated ON positions (updated_at)")
+        conn.execute("CREATE INDEX idx_positions_account ON positions (account_id, updated_at)")
+        conn.execute("CREATE INDEX idx_positions_symbol ON positions (symbol)")
+        # force every reader's in-memory model to reload from the new table
+        conn.execute("UPDATE store_meta SET value=value+1 WHERE key='version'")
+        conn.execute("PRAGMA user_version = 2")
+
+
+def _migrate_3(connect):
+    with connect() as conn:
+        conn.execute("BEGIN IMMEDIATE")
+        if schema_version(conn) >= 3:
+            return
+        # ADD COLUMN only rewrites the schema, not the rows; existing positions read NULL
+        # until their next ingest fills it in
+        conn.execute("ALTER TABLE positions ADD COLUMN asset_type TEXT")
+        conn.execute("ALTER TABLE position_changes ADD COLUMN asset_type TEXT")
+        conn.execute("UPDATE store_meta SET value=value+1 WHERE key='version'")
+        conn.execute("PRAGMA user_version = 3")
+
+
+def _migrate_4(connect):
+    with connect() as conn:
+        conn.execute("BEGIN IMMEDIATE")
+        if schema_version(conn) >= 4:
+            return
+        # like v3: existing rows read NULL (aggregates fall back to amount * last_price)
+        # until their next write
+        conn.execute("ALTER TABLE positions ADD COLUMN market_value REAL")
+        conn.execute("ALTER TABLE position_changes ADD COLUMN market_value REAL")
+        conn.execute("UPDATE store_meta SET value=value+1 WHERE key='version'")
+        conn.execute("PRAGMA user_version = 4")
+
+
+MIGRATIONS: List[Tuple[int, Callable]] = [
+    (1, _migrate_1),
+    (2, _migrate_2),
+    (3, _migrate_3),
+    (4, _migrate_4),
+]
+LATEST = MIGRATIONS[-1][0]
+
+
+def migrate(connect, target: int = LATEST) -> List[int]:
+    """Apply pending migrations up to `target`; returns the versions applied."""
+    applied = []
+    for version, fn in MIGRATIONS:
+        if version > target:
+            break
+        with connect() as conn:
+            current = schema_version(conn)
+        if current >= version:
+            continue
+        t0 = time.perf_counter()
+        fn(connect)
+        logger.info("positions schema migrated to v%d in %.0f ms", version, (time.perf_counter() - t0) * 1000.0)
+        applied.append(version)
+    return applied
+
+
+def connect_factory(path: str, timeout: float = 30.0):
+    """Connection factory for use outside the store (CLI, benchmarks)."""
+    @contextmanager
+    def connect():
+        conn = sqlite3.connect(path, timeout=timeout)
+        conn.row_factory = sqlite3.Row
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+    return connect
+
+
+def main():
+    if len(sys.argv) != 2:
+        print(__doc__)
+        return 2
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+    connect = connect_factory(sys.argv[1])
+    with connect() as conn:
+        conn.execute("PRAGMA journal_mode=WAL")
+        before = schema_version(conn)
+    applied = migrate(connect)
+    print(f"{sys.argv[1]}: schema v{before} -> v{LATEST}" if applied else f"{sys.argv[1]}: already at v{before}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
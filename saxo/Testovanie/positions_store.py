@@ -2,22 +2,86 @@
 """Positions Store Service
 
 Simple read-only aggregation store for live positions, backed by SQLite.
-Ingests position snapshots via POST /ingest and only updates rows when price change
-exceeds a configurable threshold per instrument.
+Ingests position snapshots via POST /ingest (Saxo /port/v1/positions items, read by
+saxo_positions.py) and only updates rows when price change exceeds a configurable
+threshold per instrument.
+
+GET /positions without parameters returns every row from the in-memory read model.
+Any of account, symbol (prefix), updated_since, after, limit, order, fields switches
+to an index-backed keyset-paginated query, see _query_positions(). For analytics,
+GET /export/positions and /export/history stream typed columnar files (Arrow IPC,
+Parquet or .npy), see positions_export.py. GET /aggregates returns position count,
+amount, market value and PnL per account, asset type and symbol, maintained
+incrementally alongside the read model (positions_aggregates.py).
+
+Storage goes through positions_backends.py (STORE_BACKEND): the SQLite database
+by default, SQLite databases sharded by account_id, or a process-local in-memory
+store for tests and ephemeral use. With shards, change-feed cursors are
+"seq0.seq1..." strings instead of integers. GET /positions carries the current
+change-feed cursor in X-Changes-Cursor, so a client whose cursor expired (410 from
+/positions/changes or /positions/stream) resyncs from the snapshot and continues
+from there; a malformed cursor is a 400.
 
 Config via env:
+- STORE_BACKEND (default sqlite) sqlite | sharded | memory (memory: single process, no history/backups)
+- STORE_SHARDS (default 4) databases of the sharded backend, DB_PATH.shard<i>; fixed once created
 - HOST (default 0.0.0.0)
 - PORT (default 8090)
 - DB_PATH (default /data/positions.db)
 - THRESHOLD_PCT (default 0.005 = 0.5%)
-- THRESHOLDS_FILE (default /data/thresholds.json) optional per-UIC thresholds
+- THRESHOLDS_FILE (default /data/thresholds.json) optional thresholds, either flat
+  {"<uic>": pct} or {"default": pct, "uic": {...}, "account": {...}, "asset_type": {...}}
+- THRESHOLDS_CHECK_S (default 5) how often the file mtime is checked for hot reload
+- THRESHOLD_MODE (default static) adaptive: per-Uic volatility-scaled thresholds held to a
+  write budget, with a max-staleness refresh (the file's values apply while a Uic warms up);
+  ADAPTIVE_* settings, see positions_adaptive.py
+- DB_POOL_SIZE (default 8) max pooled SQLite connections (per shard)
+- SQLITE_JOURNAL_MODE (default WAL) readers do not block on /ingest writes
+- SQLITE_SYNCHRONOUS (default NORMAL) safe with WAL, one fsync per checkpoint
+- SQLITE_CACHE_KB (default 16384) page cache per connection
+- SQLITE_MMAP_BYTES (default 268435456) memory-mapped I/O window
+- SQLITE_BUSY_TIMEOUT_MS (default 5000)
+- CHANGES_RETENTION (default 100000) change-feed entries kept for /positions/changes cursors
+- SSE_POLL_S (default 2) max wait between change checks in /positions/stream
+- SSE_MAX_STREAMS (default WEB_THREADS / 2 = 4) open /positions/stream connections per
+  process; each holds a request thread for its whole life, further streams get 503
+- HISTORY_* price/PnL history and rollups, see positions_history.py
+- BACKUP_* scheduled online backups (POST /admin/backup for one now), see positions_backup.py
+- AUDIT_* compressed log of raw /ingest bodies (GET /admin/audit, /admin/audit/payloads),
+  off by default, see positions_audit.py
+- INGEST_BUDGET_MS (default 1000) time budget for one /ingest call (50k positions); overruns are logged
+- INGEST_MODE (default sync) async: /ingest validates, enqueues and returns 202; a single
+  writer thread commits coalesced batches (per request: /ingest?mode=sync|async)
+- INGEST_QUEUE_MAX (default 200000) pending positions before async /ingest answers 503
+- INGEST_FLUSH_MS (default 50) how long the writer lets a burst coalesce before committing
+- INGEST_BATCH_MAX (default 50000) max positions per writer transaction
+- INGEST_MAX_BYTES (default 268435456) max decoded /ingest body
+- STORE_WIRE_MIN_BYTES (default 1024) responses below this are not compressed
+
+Wire formats (wire_format.py): /ingest accepts JSON or MessagePack bodies
+(Content-Type), optionally gzip/zstd compressed (Content-Encoding); JSON responses
+are re-encoded per Accept (MessagePack) and Accept-Encoding (zstd, gzip).
 """
 import os
 import json
 import time
-import sqlite3
-from typing import Optional, Dict
-from flask import Flask, request, jsonify
+import zlib
+import atexit
+import threading
+from itertools import islice
+from typing import Optional, Dict, List, Tuple
+from flask import Flask, Response, request, jsonify
+
+import positions_history
+import positions_aggregates
+import positions_adaptive
+import positions_audit
+import positions_backup
+import positions_backends
+import positions_export
+import saxo_positions
+import wire_format
+from stage_metrics import REGISTRY, span
 
 
 HOST = os.getenv("HOST", "0.0.0.0")
@@ -25,52 +89,160 @@ PORT = int(os.getenv("PORT", "8090"))
 DB_PATH = os.getenv("DB_PATH", "/data/positions.db")
 DEFAULT_THRESHOLD = float(os.getenv("THRESHOLD_PCT", "0.005"))  # 0.5%
 THRESHOLDS_FILE = os.getenv("THRESHOLDS_FILE", "/data/thresholds.json")
+THRESHOLD_MODE = os.getenv("THRESHOLD_MODE", "static").lower()
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "8"))
+STORE_BACKEND = positions_backends.STORE_BACKEND
+INGEST_BUDGET_MS = int(os.getenv("INGEST_BUDGET_MS", "1000"))
+THRESHOLDS_CHECK_S = float(os.getenv("THRESHOLDS_CHECK_S", "5"))
+CHANGES_RETENTION = int(os.getenv("CHANGES_RETENTION", "100000"))
+SSE_POLL_S = float(os.getenv("SSE_POLL_S", "2"))
+SSE_KEEPALIVE_S = 15.0
+SSE_MAX_STREAMS = int(os.getenv("SSE_MAX_STREAMS", str(max(1, int(os.getenv("WEB_THREADS", "8")) // 2))))
+INGEST_MODE = os.getenv("INGEST_MODE", "sync").lower()
+INGEST_QUEUE_MAX = int(os.getenv("INGEST_QUEUE_MAX", "200000"))
+INGEST_FLUSH_MS = float(os.getenv("INGEST_FLUSH_MS", "50"))
+INGEST_BATCH_MAX = int(os.getenv("INGEST_BATCH_MAX", "50000"))
+INGEST_MAX_BYTES = int(os.getenv("INGEST_MAX_BYTES", str(256 * 1024 * 1024)))
 
 app = Flask(__name__)
 
 
-def _connect():
-    os.makedirs(os.path.dirname(DB_PATH) or ".", exist_ok=True)
-    conn = sqlite3.connect(DB_PATH)
-    conn.row_factory = sqlite3.Row
-    return conn
+_backend: Optional[positions_backends.PositionsBackend] = None
+_backend_lock = threading.Lock()
+
+
+def _get_backend() -> positions_backends.PositionsBackend:
+    global _backend
+    if _backend is None or getattr(_backend, "path", DB_PATH) != DB_PATH:
+        with _backend_lock:
+            if _backend is None or getattr(_backend, "path", DB_PATH) != DB_PATH:
+                if _backend is not None:
+                    _backend.close()
+                _backend = positions_backends.create_backend(STORE_BACKEND, DB_PATH, DB_POOL_SIZE,
+                                                             CHANGES_RETENTION)
+    return _backend
 
 
 def _init_db():
-    with _connect() as conn:
-        c = conn.cursor()
-        c.execute(
-            """
-            CREATE TABLE IF NOT EXISTS positions (
-                uic INTEGER PRIMARY KEY,
-                symbol TEXT,
-                account_id TEXT,
-                amount REAL,
-                last_price REAL,
-                pnl REAL,
-                updated_at INTEGER
-            )
-            """
-        )
-        conn.commit()
-
-
-def _load_thresholds() -> Dict[str, float]:
-    try:
-        with open(THRESHOLDS_FILE, "r", encoding="utf-8") as f:
-            data = json.load(f)
-        # ensure floats
-        return {str(k): float(v) for k, v in data.items()}
-    except Exception:
-        return {}
+    _get_backend().init()
+
+
+class ThresholdTable:
+    """In-memory threshold table, hot-reloaded when THRESHOLDS_FILE changes.
+
+    Lookup precedence: per-Uic, per-account, per-asset-type, then the default.
+    Resolved values are memoized per (uic, account, asset_type) and the memo is
+    dropped on reload, so steady-state ingest does one dict lookup per row.
+    """
+
+    _MEMO_MAX = 200_000
+
+    def __init__(self, path: str, default: float):
+        self.path = path
+        self.default = default
+        self.by_uic: Dict[str, float] = {}
+        self.by_account: Dict[str, float] = {}
+        self.by_asset_type: Dict[str, float] = {}
+        self.mtime: Optional[float] = None
+        self.loaded_at = 0.0
+        self.error: Optional[str] = None
+        self._checked_at = 0.0
+        self._memo: Dict[tuple, float] = {}
+        self._lock = threading.Lock()
+
+    def maybe_reload(self, force: bool = False) -> bool:
+        """Reload if the file mtime changed; the stat runs at most every THRESHOLDS_CHECK_S."""
+        now = time.monotonic()
+        if not force and now - self._checked_at < THRESHOLDS_CHECK_S:
+            return False
+        with self._lock:
+            self._checked_at = now
+            try:
+                mtime = os.stat(self.path).st_mtime
+            except FileNotFoundError:
+                mtime = None
+            if not force and mtime == self.mtime:
+                return False
+            return self._load(mtime)
+
+    def _load(self, mtime: Optional[float]) -> bool:
+        by_uic, by_account, by_asset_type, default = {}, {}, {}, DEFAULT_THRESHOLD
+        if mtime is not None:
+            try:
+                with open(self.path, "r", encoding="utf-8") as f:
+                    data = json.load(f)
+                if any(isinstance(data.get(k), dict) for k in ("uic", "account", "asset_type")) or "default" in data:
+                    default = float(data.get("default", DEFAULT_THRESHOLD))
+                    by_uic = {str(k): float(v) for k, v in (data.get("uic") or {}).items()}
+                    by_account = {str(k): float(v) for k, v in (data.get("account") or {}).items()}
+                    by_asset_type = {str(k): float(v) for k, v in (data.get("asset_type") or {}).items()}
+                else:
+                    by_uic = {str(k): float(v) for k, v in data.items()}
+            except Exception as e:
+                # keep serving the previous table rather than silently falling back to defaults
+                self.error = f"{type(e).__name__}: {e}"
+                app.logger.error("failed to load thresholds from %s: %s", self.path, self.error)
+                return False
+        self.by_uic, self.by_account, self.by_asset_type, self.default = by_uic, by_account, by_asset_type, default
+        self.mtime = mtime
+        self.loaded_at = time.time()
+        self.error = None
+        self._memo = {}
+        return True
+
+    def resolve(self, uic, account_id: Optional[str] = None, asset_type: Optional[str] = None) -> float:
+        key = (uic, account_id, asset_type)
+        thr = self._memo.get(key)
+        if thr is None:
+            u = str(uic)
+            if u in self.by_uic:
+                thr = self.by_uic[u]
+            elif account_id is not None and account_id in self.by_account:
+                thr = self.by_account[account_id]
+            elif asset_type is not None and asset_type in self.by_asset_type:
+                thr = self.by_asset_type[asset_type]
+            else:
+                thr = self.default
+            if len(self._memo) >= self._MEMO_MAX:
+                self._memo = {}
+            self._memo[key] = thr
+        return thr
+
+    def describe(self) -> dict:
+        return {
+            "path": self.path,
+            "default": self.default,
+            "uic": self.by_uic,
+            "account": self.by_account,
+            "asset_type": self.by_asset_type,
+            "mtime": self.mtime,
+            "loaded_at": self.loaded_at,
+            "error": self.error,
+        }
 
 
-def _should_update(old_price: Optional[float], new_price: Optional[float], uic: str, thresholds: Dict[str, float]) -> bool:
+_thresholds = ThresholdTable(THRESHOLDS_FILE, DEFAULT_THRESHOLD)
+_adaptive = positions_adaptive.AdaptiveThresholds()
+_audit = positions_audit.AuditLog() if positions_audit.AUDIT_ENABLED else None
+
+
+def _get_thresholds() -> ThresholdTable:
+    if _thresholds.path != THRESHOLDS_FILE:
+        _thresholds.path = THRESHOLDS_FILE
+        _thresholds.maybe_reload(force=True)
+    else:
+        _thresholds.maybe_reload()
+    return _thresholds
+
+
+_MISSING = (None, None, None)
+
+
+def _should_update(old_price: Optional[float], new_price: Optional[float], thr: float) -> bool:
     if new_price is None:
         return False
     if old_price is None:
         return True
-    thr = thresholds.get(str(uic), DEFAULT_THRESHOLD)
     try:
         if old_price == 0:
             # avoid div by zero; any non-zero change triggers update
@@ -81,82 +253,844 @@ def _should_update(old_price: Optional[float], new_price: Optional[float], uic:
         return True
 
 
+_COLUMNS = positions_backends.COLUMNS
+
+
+class ReadModel:
+    """Versioned in-memory copy of the positions table.
+
+    Every committed ingest that changes rows bumps the version of the partition it
+    wrote (there is one unless the backend is sharded) and applies its rows here.
+    Readers compare the backend versions (one point read per partition) with the
+    model's: equal means the cached snapshot and its pre-serialized JSON body are
+    current; different (another process wrote, or an ingest has not applied yet)
+    triggers a full reload. `version`, their sum, labels the snapshot.
+    """
+
+    def __init__(self):
+        self.versions: Optional[Tuple[int, ...]] = None
+        self.version = -1
+        # uic -> account_id -> row
+        self.rows: Dict[int, Dict[str, dict]] = {}
+        self.aggregates = positions_aggregates.Aggregates()
+        # (media type, content coding) -> encoded snapshot of _body_version
+        self._bodies: Dict[Tuple[str, Optional[str]], bytes] = {}
+        self._body_version = -1
+        self._lock = threading.Lock()
+
+    def _reload(self, backend, versions: Tuple[int, ...]):
+        rows: Dict[int, Dict[str, dict]] = {}
+        for r in backend.rows():
+            rows.setdefault(r["uic"], {})[r["account_id"]] = r
+        self.rows = rows
+        self.aggregates = positions_aggregates.Aggregates(r for per in rows.values() for r in per.values())
+        self.versions = versions
+        self.version = sum(versions)
+        self._bodies = {}
+
+    def sync(self, backend) -> int:
+        """Make the model current with the backend; returns the version served."""
+        versions = backend.versions()
+        if versions != self.versions:
+            with self._lock:
+                if versions != self.versions:
+                    self._reload(backend, versions)
+        return sum(versions)
+
+    def apply(self, part: int, version: int, batch: List[tuple]):
+        """Apply rows committed as `version` of partition `part`; out-of-order applies invalidate the model."""
+        with self._lock:
+            if self.versions is None or self.versions[part] != version - 1:
+                self.versions = None
+                self.version = -1
+                return
+            update = self.aggregates.update
+            for r in batch:
+                per = self.rows.setdefault(r[0], {})
+                row = dict(zip(_COLUMNS, r))
+                update(per.get(r[2]), row)
+                per[r[2]] = row
+            self.versions = self.versions[:part] + (version,) + self.versions[part + 1:]
+            self.version += 1
+            self._bodies = {}
+
+    def body(self, media: str = wire_format.JSON, encoding: Optional[str] = None) -> Tuple[int, bytes]:
+        """The snapshot encoded as `media` + `encoding`, built once per version and representation."""
+        with self._lock:
+            if self._body_version != self.version:
+                self._bodies = {}
+                self._body_version = self.version
+            out = self._bodies.get((media, encoding))
+            if out is None:
+                raw = self._bodies.get((media, None))
+                if raw is None:
+                    data = sorted((r for per in self.rows.values() for r in per.values()),
+                                  key=lambda r: r["updated_at"] or 0, reverse=True)
+                    doc = {"count": len(data), "data": data}
+                    if media == wire_format.JSON:
+                        raw = json.dumps(doc, sort_keys=True, separators=(",", ":")).encode("utf-8")
+                    else:
+                        raw = wire_format.dumps(doc, media)
+                    self._bodies[(media, None)] = raw
+                out = self._bodies[(media, encoding)] = wire_format.compress(raw, encoding)
+            return self._body_version, out
+
+    def aggregate(self, dimensions) -> Tuple[int, Dict[str, dict]]:
+        with self._lock:
+            return self.version, self.aggregates.snapshot(dimensions)
+
+    def get(self, uic: int, account_id: Optional[str] = None) -> List[dict]:
+        """Rows for `uic`, one per account holding it (or only `account_id`'s)."""
+        per = self.rows.get(uic) or {}
+        if account_id is not None:
+            row = per.get(account_id)
+            return [row] if row else []
+        return list(per.values())
+
+
+_read_model = ReadModel()
+
+
+def _etag(version: int, query: bytes = b"") -> str:
+    # filtered responses differ per query string, so it is folded into the tag
+    return f"v{version}-{zlib.crc32(query):08x}" if query else f"v{version}"
+
+
+_QUERY_PARAMS = ("account", "symbol", "updated_since", "after", "limit", "order", "fields")
+_PAGE_LIMIT = 1000
+_PAGE_LIMIT_MAX = 10000
+
+
+class QueryError(ValueError):
+    pass
+
+
+def _parse_fields(raw: Optional[str]) -> Tuple[str, ...]:
+    if not raw:
+        return _COLUMNS
+    fields = tuple(f.strip() for f in raw.split(",") if f.strip())
+    unknown = [f for f in fields if f not in _COLUMNS]
+    if unknown:
+        raise QueryError(f"unknown fields: {', '.join(unknown)}")
+    return fields
+
+
+def _parse_cursor(raw: str) -> Tuple[int, str, int]:
+    # "updated_at:uic:account_id"; the account id goes last since it may contain ':'
+    try:
+        updated_at, uic, account_id = raw.split(":", 2)
+        return int(updated_at), account_id, int(uic)
+    except ValueError:
+        raise QueryError(f"invalid cursor {raw!r}")
+
+
+def _query_positions(backend, args) -> dict:
+    """One keyset page of positions for the filters in `args` (request.args).
+
+    In SQLite, filters map onto indexes: account -> (account_id, updated_at), symbol
+    prefix -> symbol range, updated_since / cursor -> updated_at. Pages are ordered by
+    (updated_at, account_id, uic), descending by default; `next` is the cursor for the following
+    page, or None on the last one.
+    """
+    fields = _parse_fields(args.get("fields"))
+    order = args.get("order", "desc").lower()
+    if order not in ("asc", "desc"):
+        raise QueryError("order must be asc or desc")
+    limit = max(1, min(args.get("limit", default=_PAGE_LIMIT, type=int), _PAGE_LIMIT_MAX))
+    after = args.get("after")
+    q = positions_backends.PositionQuery(
+        columns=tuple(fields) + tuple(c for c in ("uic", "account_id", "updated_at") if c not in fields),
+        account=args.get("account"),
+        symbol=args.get("symbol") or None,
+        updated_since=args.get("updated_since", type=int),
+        after=_parse_cursor(after) if after else None,
+        limit=limit + 1,
+        order=order,
+    )
+    rows = backend.query(q)
+
+    more = len(rows) > limit
+    rows = rows[:limit]
+    last = rows[-1] if rows else None
+    nxt = f"{last['updated_at']}:{last['uic']}:{last['account_id']}" if more else None
+    data = [{f: r[f] for f in fields} for r in rows]
+    return {"count": len(data), "next": nxt, "data": data}
+
+
+# woken after every committed ingest; SSE streams also poll so writes from other processes show up
+_changes_cond = threading.Condition()
+
+
+def _notify_changes():
+    with _changes_cond:
+        _changes_cond.notify_all()
+
+
+# an SSE stream keeps its request thread until the client leaves; cap them so plain
+# requests keep threads of their own, and end them all when the process drains
+_streams = threading.BoundedSemaphore(SSE_MAX_STREAMS)
+_streams_stop = threading.Event()
+
+
+def stop_streams():
+    """End every open /positions/stream so its thread is free for the drain (and refuse new ones)."""
+    _streams_stop.set()
+    _notify_changes()
+
+
+def _representation() -> Tuple[str, Optional[str]]:
+    """(media type, content coding) negotiated for the current request."""
+    return (wire_format.pick_media(request.headers.get("Accept")),
+            wire_format.pick_encoding(request.headers.get("Accept-Encoding")))
+
+
+def _variant(media: str, encoding: Optional[str]) -> str:
+    # ETag suffix: every representation of a version needs its own tag
+    return ("-mp" if media == wire_format.MSGPACK else "") + (f"-{encoding}" if encoding else "")
+
+
+@app.after_request
+def _encode_response(resp):
+    """Re-encode JSON responses per Accept / Accept-Encoding; pre-encoded bodies pass through."""
+    if (resp.direct_passthrough or resp.is_streamed or resp.status_code == 304
+            or "Content-Encoding" in resp.headers or resp.mimetype != wire_format.JSON):
+        return resp
+    media, encoding = _representation()
+    body = resp.get_data()
+    if media != wire_format.JSON:
+        body = wire_format.dumps(json.loads(body), media)
+        resp.content_type = media
+    if encoding and len(body) >= wire_format.MIN_BYTES:
+        body = wire_format.compress(body, encoding)
+        resp.headers["Content-Encoding"] = encoding
+    resp.set_data(body)
+    resp.vary.update(("Accept", "Accept-Encoding"))
+    return resp
+
+
 @app.route("/health")
 def health():
-    return jsonify({"ok": True})
+    return jsonify({"ok": True, "backend": STORE_BACKEND, "ingest_mode": INGEST_MODE,
+                    "ingest_queue_depth": _ingest_queue.depth()})
+
+
+@app.route("/metrics")
+def metrics():
+    """Prometheus text: stage histograms (ingest_commit) plus write-behind queue gauges."""
+    q = _ingest_queue.stats()
+    lines = [REGISTRY.render_prometheus().rstrip("\n")]
+    for name, kind, help_text, value in (
+        ("positions_ingest_queue_depth", "gauge", "Positions waiting for the writer.", q["depth"]),
+        ("positions_ingest_queue_inflight", "gauge", "Positions in the transaction being committed.", q["inflight"]),
+        ("positions_ingest_queue_oldest_seconds", "gauge", "Age of the oldest pending position.", q["oldest_s"]),
+        ("positions_ingest_last_flush_seconds", "gauge", "Duration of the last writer commit.", q["last_flush_s"]),
+        ("positions_ingest_enqueued_total", "counter", "Positions accepted by async /ingest.", q["enqueued"]),
+        ("positions_ingest_coalesced_total", "counter", "Pending positions replaced by a newer snapshot.", q["coalesced"]),
+        ("positions_ingest_flushed_total", "counter", "Positions committed by the writer.", q["flushed"]),
+        ("positions_ingest_rejected_total", "counter", "Positions refused because the queue was full.", q["rejected"]),
+        ("positions_ingest_flush_errors_total", "counter", "Writer commits that failed and were retried.", q["errors"]),
+    ):
+        lines += [f"# HELP {name} {help_text}", f"# TYPE {name} {kind}", f"{name} {value}"]
+    return Response("\n".join(lines) + "\n", mimetype="text/plain; version=0.0.4")
 
 
 @app.route("/positions", methods=["GET"])
 def list_positions():
-    with _connect() as conn:
-        rows = conn.execute("SELECT * FROM positions ORDER BY updated_at DESC").fetchall()
-        out = [dict(r) for r in rows]
-    return jsonify({"count": len(out), "data": out})
+    if any(k in request.args for k in _QUERY_PARAMS):
+        return _list_positions_query()
+    backend = _get_backend()
+    # read before the sync so the snapshot covers at least this far; replaying the
+    # change feed from here may repeat a few rows, which clients apply idempotently
+    feed_cursor = str(backend.last_seq())
+    version = _read_model.sync(backend)
+    media, encoding = _representation()
+    variant = _variant(media, encoding)
+    if request.if_none_match.contains(_etag(version) + variant):
+        return Response(status=304, headers={"ETag": f'"{_etag(version)}{variant}"',
+                                             "X-Changes-Cursor": feed_cursor})
+    version, body = _read_model.body(media, encoding)
+    headers = {"ETag": f'"{_etag(version)}{variant}"', "Cache-Control": "no-cache",
+               "Vary": "Accept, Accept-Encoding", "X-Changes-Cursor": feed_cursor}
+    if encoding:
+        headers["Content-Encoding"] = encoding
+    return Response(body, content_type=media, headers=headers)
+
+
+def _list_positions_query():
+    query = request.query_string
+    backend = _get_backend()
+    tag = _etag(backend.version(), query) + _variant(*_representation())
+    if request.if_none_match.contains(tag):
+        return Response(status=304, headers={"ETag": f'"{tag}"'})
+    try:
+        out = _query_positions(backend, request.args)
+    except QueryError as e:
+        return jsonify({"error": str(e)}), 400
+    resp = jsonify(out)
+    resp.headers["ETag"] = f'"{tag}"'
+    resp.headers["Cache-Control"] = "no-cache"
+    return resp
+
+
+def _parse_since(backend, raw: Optional[str]):
+    # change-feed cursors are ints, or one int per shard; ValueError for malformed ones
+    return backend.parse_cursor(raw) if raw is not None else None
+
+
+def _cursor_error(backend, raw: Optional[str] = None):
+    if raw is not None:
+        return jsonify({"error": f"malformed cursor {raw!r}"}), 400
+    # cursor fell out of retention: the client re-reads GET /positions and continues
+    # from its X-Changes-Cursor header (or from "cursor" here, read before the snapshot)
+    return jsonify({"error": "cursor expired", "oldest": backend.oldest_seq(),
+                    "cursor": backend.last_seq()}), 410
+
+
+@app.route("/positions/changes", methods=["GET"])
+def list_changes():
+    limit = min(request.args.get("limit", default=1000, type=int), 10000)
+    backend = _get_backend()
+    raw = request.args.get("since")
+    try:
+        since = _parse_since(backend, raw)
+    except ValueError:
+        return _cursor_error(backend, raw)
+    if since is None:
+        since = backend.parse_cursor("0")
+    if backend.cursor_expired(since):
+        return _cursor_error(backend)
+    changes = backend.changes_since(since, limit + 1)
+    more = len(changes) > limit
+    changes = changes[:limit]
+    cursor = changes[-1]["seq"] if changes else since
+    return jsonify({"count": len(changes), "cursor": cursor, "more": more, "data": changes})
+
+
+@app.route("/positions/stream", methods=["GET"])
+def stream_changes():
+    backend = _get_backend()
+    raw = request.headers.get("Last-Event-ID")
+    if raw is None:
+        raw = request.args.get("since")
+    try:
+        since = _parse_since(backend, raw)
+    except ValueError:
+        return _cursor_error(backend, raw)
+    if since is None:
+        # start from "now" unless the client asks for history
+        since = backend.last_seq()
+    elif backend.cursor_expired(since):
+        return _cursor_error(backend)
+    if _streams_stop.is_set() or not _streams.acquire(blocking=False):
+        return jsonify({"error": "too many streams", "max": SSE_MAX_STREAMS}), 503, {"Retry-After": "3"}
+
+    def generate(cursor):
+        yield f"retry: 3000\n: cursor {cursor}\n\n"
+        last_sent = time.monotonic()
+        while not _streams_stop.is_set():
+            changes = _get_backend().changes_since(cursor, 1000)
+            for ch in changes:
+                cursor = ch["seq"]
+                yield f"id: {cursor}\nevent: change\ndata: {json.dumps(ch, separators=(',', ':'))}\n\n"
+            if changes:
+                last_sent = time.monotonic()
+                if len(changes) == 1000:
+                    continue
+            elif time.monotonic() - last_sent >= SSE_KEEPALIVE_S:
+                yield ": keepalive\n\n"
+                last_sent = time.monotonic()
+            with _changes_cond:
+                _changes_cond.wait(timeout=SSE_POLL_S)
+
+    resp = Response(generate(since), mimetype="text/event-stream",
+                    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+    # close() runs whether or not the body was ever iterated; the client reconnects
+    # (to another worker after a reload) with Last-Event-ID
+    resp.call_on_close(_streams.release)
+    return resp
+
+
+def _unsupported(backend, feature: str):
+    return jsonify({"error": f"{feature} is not available with the {backend.name} backend"}), 501
+
+
+@app.route("/positions/<uic>/history", methods=["GET"])
+def position_history(uic: str):
+    # [from, to) is half-open, so the default end is the next second: rows written now are included
+    end = request.args.get("to", default=int(time.time()) + 1, type=int)
+    start = request.args.get("from", default=end - 86400, type=int)
+    resolution = request.args.get("resolution", "auto")
+    if resolution not in ("auto", positions_history.RAW, *positions_history.LEVELS):
+        return jsonify({"error": f"unknown resolution {resolution}"}), 400
+    limit = min(request.args.get("limit", default=10000, type=int), 100000)
+    backend = _get_backend()
+    if positions_backends.HISTORY not in backend.features:
+        return _unsupported(backend, "history")
+    out = positions_history.query_range(backend.history, int(uic), start, end, resolution,
+                                        account_id=request.args.get("account"), limit=limit)
+    return jsonify(out)
+
+
+# format -> (store version, encoded full snapshot); mirrors ReadModel.body() for JSON
+_export_cache: Dict[str, Tuple[int, bytes]] = {}
+
+
+def _export_response(open_cursor, name: str, cache: bool = False):
+    """Columnar response for the rows of `open_cursor()`, a context manager yielding a cursor."""
+    fmt = positions_export.pick_format(request.args.get("format"), request.headers.get("Accept"))
+    if fmt is None:
+        return jsonify({"error": "no matching export format",
+                        "available": positions_export.available_formats()}), 406
+    headers = {"Content-Disposition": f'attachment; filename="{name}.{positions_export.EXTENSIONS[fmt]}"'}
+    mimetype = positions_export.MEDIA_TYPES[fmt]
+
+    if cache:
+        version = _get_backend().version()
+        hit = _export_cache.get(fmt)
+        if hit is None or hit[0] != version:
+            # rows read after `version` are never older than it, so the label stays safe
+            with open_cursor() as cursor:
+                hit = (version, b"".join(positions_export.export(cursor, fmt)))
+            _export_cache[fmt] = hit
+        headers["ETag"] = f'"{_etag(version)}-{fmt}"'
+        return Response(hit[1], mimetype=mimetype, headers=headers)
+
+    def generate():
+        with open_cursor() as cursor:
+            yield from positions_export.export(cursor, fmt)
+
+    return Response(generate(), mimetype=mimetype, headers=headers)
+
+
+@app.route("/export/positions", methods=["GET"])
+def export_positions():
+    """Current positions as Arrow IPC / Parquet / .npy (?format=, optional ?account=)."""
+    backend = _get_backend()
+    account = request.args.get("account")
+    if account is not None:
+        return _export_response(lambda: backend.scan(account), "positions")
+    # the unfiltered snapshot is encoded once per store version
+    return _export_response(backend.scan, "positions", cache=True)
+
+
+@app.route("/export/history", methods=["GET"])
+def export_history():
+    """History range as a columnar file: from, to, resolution, optional uic and account."""
+    # [from, to) is half-open, so the default end is the next second: rows written now are included
+    end = request.args.get("to", default=int(time.time()) + 1, type=int)
+    start = request.args.get("from", default=end - 86400, type=int)
+    resolution = request.args.get("resolution", "auto")
+    if resolution not in ("auto", positions_history.RAW, *positions_history.LEVELS):
+        return jsonify({"error": f"unknown resolution {resolution}"}), 400
+    backend = _get_backend()
+    if positions_backends.HISTORY not in backend.features:
+        return _unsupported(backend, "history")
+    account = request.args.get("account")
+    level, sql, params = positions_history.range_query(
+        start, end, resolution, uic=request.args.get("uic", type=int), account_id=account)
+    return _export_response(lambda: backend.history(sql, params, account), f"history_{level}_{start}_{end}")
+
+
+@app.route("/aggregates", methods=["GET"])
+def aggregates():
+    """Running totals per dimension: ?by=total,account,asset_type,symbol (default: all)."""
+    by = tuple(d.strip() for d in request.args.get("by", ",".join(positions_aggregates.DIMENSIONS)).split(",")
+               if d.strip())
+    unknown = [d for d in by if d not in positions_aggregates.DIMENSIONS]
+    if unknown:
+        return jsonify({"error": f"unknown dimension: {', '.join(unknown)}",
+                        "dimensions": list(positions_aggregates.DIMENSIONS)}), 400
+    _read_model.sync(_get_backend())
+    version, out = _read_model.aggregate(by)
+    tag = _etag(version, request.query_string) + _variant(*_representation())
+    if request.if_none_match.contains(tag):
+        return Response(status=304, headers={"ETag": f'"{tag}"'})
+    resp = jsonify({"version": version, **out})
+    resp.headers["ETag"] = f'"{tag}"'
+    resp.headers["Cache-Control"] = "no-cache"
+    return resp
 
 
 @app.route("/positions/<uic>", methods=["GET"])
 def get_position(uic: str):
-    with _connect() as conn:
-        row = conn.execute("SELECT * FROM positions WHERE uic=?", (int(uic),)).fetchone()
-        if not row:
-            return jsonify({"error": "not found"}), 404
-        return jsonify(dict(row))
+    _read_model.sync(_get_backend())
+    matches = _read_model.get(int(uic), request.args.get("account"))
+    if not matches:
+        return jsonify({"error": "not found"}), 404
+    if len(matches) > 1:
+        accounts = sorted(r["account_id"] for r in matches)
+        return jsonify({"error": "held by several accounts, pass ?account=", "accounts": accounts}), 409
+    try:
+        fields = _parse_fields(request.args.get("fields"))
+    except QueryError as e:
+        return jsonify({"error": str(e)}), 400
+    return jsonify({f: matches[0][f] for f in fields})
 
 
-@app.route("/ingest", methods=["POST"])
-def ingest():
-    payload = request.get_json(silent=True) or {}
-    items = payload.get("Data") or payload.get("Positions") or []
-    thresholds = _load_thresholds()
-    now = int(time.time())
-    updated = 0
+_Key = positions_backends.Key
+
+
+def _parse_rows(items) -> Tuple[Dict[_Key, tuple], int]:
+    """Parse Saxo positions into {(account_id, uic): (uic, symbol, account_id, amount, last_price, pnl, asset_type,
+    market_value)}.
+
+    Returns the rows and the number of items skipped (no Uic, or an earlier duplicate
+    of an (AccountId, Uic) that appears again later in the same payload), see
+    saxo_positions.parse().
+    """
+    rows: Dict[_Key, tuple] = {}
     skipped = 0
-    with _connect() as conn:
-        cur = conn.cursor()
-        for p in items:
-            base = p.get("PositionBase", {})
-            fmt = p.get("DisplayAndFormat", {})
-            view = p.get("PositionView", {})
+    parse = saxo_positions.parse
+    for item in items:
+        p = parse(item)
+        if p is None:
+            skipped += 1
+            continue
+        key = (p.account_id, p.uic)
+        if key in rows:
+            skipped += 1
+        rows[key] = (p.uic, p.symbol, p.account_id, p.amount, p.price, p.pnl, p.asset_type, p.market_value)
+    return rows, skipped
+
+
+def _select_rows(rows: Dict[_Key, tuple], existing: positions_backends.Existing, thresholds: ThresholdTable,
+                 now: int, adaptive: Optional[Dict[int, Optional[float]]] = None) -> List[tuple]:
+    """The rows of `rows` to write: threshold-filtered against the stored prices in `existing`.
+
+    `adaptive` holds the batch's per-Uic thresholds in adaptive mode, see _observe_prices().
+    """
+    if adaptive is not None:
+        return _select_rows_adaptive(rows, existing, thresholds, now, adaptive)
+    resolve = thresholds.resolve
+    batch = []
+    for key, r in rows.items():
+        old_price, old_type, _ = existing.get(key, _MISSING)
+        # rows stored before asset_type was tracked are rewritten once to pick it up
+        backfill = key in existing and old_type is None and r[6] is not None and r[4] is not None
+        if backfill or _should_update(old_price, r[4], resolve(r[0], r[2], r[6])):
+            batch.append(r[:6] + (now, r[6] if r[6] is not None else old_type, r[7]))
+    return batch
+
+
+def _observe_prices(rows: Dict[_Key, tuple]) -> Dict[int, Optional[float]]:
+    """Feed the batch's prices to the volatility estimates, once per Uic; returns their thresholds.
+
+    Runs before the backend commit: every account holding a Uic carries the same price,
+    and one observation per account would bias the Uic's variance towards zero.
+    """
+    prices: Dict[int, Optional[float]] = {}
+    for r in rows.values():
+        if prices.get(r[0]) is None:
+            prices[r[0]] = r[4]
+    return _adaptive.observe(prices)
+
+
+def _select_rows_adaptive(rows: Dict[_Key, tuple], existing: positions_backends.Existing,
+                          thresholds: ThresholdTable, now: int, adaptive: Dict[int, Optional[float]]) -> List[tuple]:
+    """_select_rows() with volatility-scaled thresholds and max staleness (positions_adaptive.py)."""
+    resolve = thresholds.resolve
+    stale = _adaptive.stale
+    batch = []
+    refreshed = 0
+    for key, r in rows.items():
+        old_price, old_type, updated_at = existing.get(key, _MISSING)
+        thr = adaptive.get(r[0])
+        if thr is None:
+            # Uic still warming up
+            thr = resolve(r[0], r[2], r[6])
+        backfill = key in existing and old_type is None and r[6] is not None and r[4] is not None
+        if backfill or _should_update(old_price, r[4], thr):
+            batch.append(r[:6] + (now, r[6] if r[6] is not None else old_type, r[7]))
+        elif r[4] is not None and stale(r[0], updated_at, now):
+            batch.append(r[:6] + (now, r[6] if r[6] is not None else old_type, r[7]))
+            refreshed += 1
+    _adaptive.wrote(len(batch), refreshed)
+    return batch
+
+
+def _commit_rows(rows: Dict[_Key, tuple], mode: str) -> int:
+    """Threshold-filter and write `rows` in one backend commit; returns the number updated."""
+    with span("ingest_commit", mode=mode):
+        now = int(time.time())
+        thresholds = _get_thresholds()
+        adaptive = _observe_prices(rows) if THRESHOLD_MODE == "adaptive" else None
+        commits = _get_backend().commit(
+            rows, lambda part, existing: _select_rows(part, existing, thresholds, now, adaptive))
+        for c in commits:
+            _read_model.apply(c.part, c.version, c.batch)
+        if commits:
+            _notify_changes()
+    return sum(len(c.batch) for c in commits)
+
+
+class WriteBehindQueue:
+    """Pending ingest rows, coalesced per (account_id, uic), drained by one writer thread.
+
+    enqueue() only merges parsed rows into a dict under a lock, so async /ingest never
+    waits on storage and concurrent producers no longer serialize on the write lock; a
+    newer snapshot of a pending position replaces the older one. The writer lets a
+    burst coalesce for `linger_s`, then commits up to `batch_max` rows per transaction
+    through the same path as synchronous ingest. Failed commits are re-queued unless a
+    newer snapshot arrived meanwhile.
+    """
+
+    def __init__(self, max_rows: int = INGEST_QUEUE_MAX, linger_s: float = INGEST_FLUSH_MS / 1000.0,
+                 batch_max: int = INGEST_BATCH_MAX):
+        self.max_rows = max_rows
+        self.linger_s = linger_s
+        self.batch_max = max(1, batch_max)
+        self._pending: Dict[_Key, tuple] = {}
+        self._oldest: Optional[float] = None
+        self._inflight = 0
+        self._cond = threading.Condition()
+        self._thread: Optional[threading.Thread] = None
+        self.enqueued = 0
+        self.coalesced = 0
+        self.flushed = 0
+        self.rejected = 0
+        self.errors = 0
+        self.last_flush_s = 0.0
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="ingest-writer", daemon=True)
+            self._thread.start()
+
+    def enqueue(self, rows: Dict[_Key, tuple]) -> Optional[int]:
+        """Merge `rows` into the pending set; returns the new depth, or None when full."""
+        with self._cond:
+            new_keys = sum(1 for k in rows if k not in self._pending)
+            if self._pending and len(self._pending) + new_keys > self.max_rows:
+                self.rejected += len(rows)
+                return None
+            self.coalesced += len(rows) - new_keys
+            self.enqueued += len(rows)
+            self._pending.update(rows)
+            if self._oldest is None:
+                self._oldest = time.monotonic()
+            self._cond.notify_all()
+            return len(self._pending)
+
+    def depth(self) -> int:
+        return len(self._pending)
+
+    def stats(self) -> dict:
+        with self._cond:
+            oldest = time.monotonic() - self._oldest if self._oldest is not None else 0.0
+            return {"depth": len(self._pending), "inflight": self._inflight, "oldest_s": round(oldest, 6),
+                    "last_flush_s": round(self.last_flush_s, 6), "enqueued": self.enqueued,
+                    "coalesced": self.coalesced, "flushed": self.flushed, "rejected": self.rejected,
+                    "errors": self.errors}
+
+    def flush(self, timeout: float = 30.0) -> bool:
+        """Block until everything enqueued so far is committed (shutdown, tests)."""
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            while self._pending or self._inflight:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                self._cond.wait(remaining)
+        return True
+
+    def _take(self) -> Dict[_Key, tuple]:
+        with self._cond:
+            while not self._pending:
+                self._cond.wait()
+        # let the rest of a burst arrive and coalesce before taking the write lock
+        time.sleep(self.linger_s)
+        with self._cond:
+            if len(self._pending) <= self.batch_max:
+                rows, self._pending = self._pending, {}
+                self._oldest = None
+            else:
+                rows = {k: self._pending.pop(k) for k in list(islice(self._pending, self.batch_max))}
+            self._inflight = len(rows)
+        return rows
+
+    def _run(self):
+        while True:
+            rows = self._take()
+            t0 = time.perf_counter()
             try:
-                uic = int(base.get("Uic")) if base.get("Uic") is not None else None
+                _commit_rows(rows, "async")
+                self.flushed += len(rows)
             except Exception:
-                uic = None
-            if not uic:
-                skipped += 1
-                continue
-            symbol = fmt.get("Symbol") or base.get("Symbol") or str(uic)
-            account_id = base.get("AccountId")
-            amount = base.get("Amount")
-            last_price_new = view.get("CurrentPrice")
-            pnl = view.get("ProfitLossOnTrade")
-
-            row = cur.execute("SELECT last_price FROM positions WHERE uic=?", (uic,)).fetchone()
-            last_price_old = row[0] if row else None
-
-            if _should_update(last_price_old, last_price_new, str(uic), thresholds):
-                cur.execute(
-                    """
-                    INSERT INTO positions (uic, symbol, account_id, amount, last_price, pnl, updated_at)
-                    VALUES(?,?,?,?,?,?,?)
-                    ON CONFLICT(uic) DO UPDATE SET
-                        symbol=excluded.symbol,
-                        account_id=excluded.account_id,
-                        amount=excluded.amount,
-                        last_price=excluded.last_price,
-                        pnl=excluded.pnl,
-                        updated_at=excluded.updated_at
-                    """,
-                    (uic, symbol, str(account_id) if account_id is not None else None, amount, last_price_new, pnl, now),
-                )
-                updated += 1
-            else:
-                skipped += 1
-        conn.commit()
-    return jsonify({"ok": True, "updated": updated, "skipped": skipped, "count": len(items)})
+                app.logger.exception("write-behind commit of %d positions failed", len(rows))
+                self.errors += 1
+                with self._cond:
+                    for k, r in rows.items():
+                        self._pending.setdefault(k, r)
+                    if self._oldest is None:
+                        self._oldest = time.monotonic()
+                time.sleep(1.0)
+            finally:
+                self.last_flush_s = time.perf_counter() - t0
+                with self._cond:
+                    self._inflight = 0
+                    self._cond.notify_all()
+
+
+_ingest_queue = WriteBehindQueue()
+
+
+def _request_payload() -> Tuple[dict, Optional[bytes], str]:
+    """Decode the /ingest body per Content-Encoding and Content-Type.
+
+    Returns (payload, decoded body, media type); malformed bodies give {} and, when
+    the content coding could not be undone, no body.
+    """
+    media = wire_format.normalize_media(request.content_type)
+    if media not in wire_format.media_types():
+        raise wire_format.UnsupportedEncoding(f"unsupported media type {media}")
+    try:
+        data = wire_format.decompress(request.get_data(cache=False), request.headers.get("Content-Encoding"),
+                                      INGEST_MAX_BYTES)
+    except (wire_format.UnsupportedEncoding, wire_format.BodyTooLarge):
+        raise
+    except Exception:
+        return {}, None, media
+    try:
+        payload = wire_format.loads(data, media)
+    except Exception:
+        return {}, data, media
+    return (payload if isinstance(payload, dict) else {}), data, media
+
+
+@app.route("/ingest", methods=["POST"])
+def ingest():
+    t0 = time.perf_counter()
+    try:
+        payload, body, media = _request_payload()
+    except wire_format.UnsupportedEncoding as e:
+        return jsonify({"ok": False, "error": str(e), "accept": wire_format.media_types(),
+                        "accept_encoding": wire_format.encodings()}), 415
+    except wire_format.BodyTooLarge as e:
+        return jsonify({"ok": False, "error": str(e)}), 413
+    items = saxo_positions.items(payload)
+    rows, skipped = _parse_rows(items)
+    if _audit is not None and body is not None:
+        # only a buffer append here; compression and disk writes happen on the audit thread
+        _audit.append(body, media, rows)
+    mode = request.args.get("mode", INGEST_MODE).lower()
+    if mode == "async":
+        _ingest_queue.start()
+        depth = _ingest_queue.enqueue(rows) if rows else _ingest_queue.depth()
+        if depth is None:
+            return jsonify({"ok": False, "error": "ingest queue full", "depth": _ingest_queue.depth()}), 503, \
+                {"Retry-After": "1"}
+        return jsonify({"ok": True, "queued": len(rows), "skipped": skipped, "count": len(items),
+                        "depth": depth}), 202
+    updated = _commit_rows(rows, "sync") if rows else 0
+    skipped += len(rows) - updated
+    elapsed_ms = (time.perf_counter() - t0) * 1000.0
+    if elapsed_ms > INGEST_BUDGET_MS:
+        app.logger.warning("ingest of %d positions took %.0f ms (budget %d ms)", len(items), elapsed_ms, INGEST_BUDGET_MS)
+    return jsonify({"ok": True, "updated": updated, "skipped": skipped, "count": len(items),
+                    "elapsed_ms": round(elapsed_ms, 1)})
+
+
+@app.route("/admin/thresholds", methods=["GET"])
+def get_thresholds():
+    out = {**_get_thresholds().describe(), "mode": THRESHOLD_MODE}
+    if THRESHOLD_MODE == "adaptive":
+        out["adaptive"] = _adaptive.describe()
+    return jsonify(out)
+
+
+@app.route("/admin/thresholds/reload", methods=["POST"])
+def reload_thresholds():
+    table = _get_thresholds()
+    reloaded = table.maybe_reload(force=True)
+    status = 200 if table.error is None else 500
+    return jsonify({"ok": table.error is None, "reloaded": reloaded, **table.describe()}), status
+
+
+def _audit_args():
+    start = request.args.get("from", type=float)
+    end = request.args.get("to", type=float)
+    uic = request.args.get("uic", type=int)
+    return start, end, uic
+
+
+@app.route("/admin/audit", methods=["GET"])
+def audit_blocks():
+    """Audit log state plus the blocks matching from/to/uic; reads the index only."""
+    if _audit is None:
+        return jsonify({"error": "the audit log is off (AUDIT_ENABLED=0)"}), 501
+    _audit.flush()
+    found = positions_audit.blocks(_audit.audit_dir, *_audit_args())
+    for entry in found:
+        entry["segment"] = os.path.basename(entry["segment"])
+    return jsonify({**_audit.describe(), "count": len(found), "data": found})
+
+
+@app.route("/admin/audit/payloads", methods=["GET"])
+def audit_payloads():
+    """Raw /ingest payloads received in [from, to); with uic only that Uic's items of each."""
+    if _audit is None:
+        return jsonify({"error": "the audit log is off (AUDIT_ENABLED=0)"}), 501
+    limit = min(request.args.get("limit", default=100, type=int), 10000)
+    _audit.flush()
+    data = positions_audit.payloads(_audit.audit_dir, *_audit_args(), limit=limit)
+    return jsonify({"count": len(data), "data": data})
+
+
+@app.route("/admin/backup", methods=["POST"])
+def take_backup():
+    backend = _get_backend()
+    if positions_backends.BACKUP not in backend.features:
+        return _unsupported(backend, "backup")
+    try:
+        stats = [positions_backup.backup(part.path, _backup_dir(backend, part)) for part in backend.partitions()]
+    except positions_backup.BackupInProgress as e:
+        return jsonify({"ok": False, "error": str(e)}), 409
+    if len(stats) == 1:
+        return jsonify({"ok": True, **stats[0]})
+    return jsonify({"ok": True, "shards": stats})
+
+
+def _backup_dir(backend, part) -> str:
+    # every shard rotates its own backups, in a directory named after its database file
+    if part is backend:
+        return positions_backup.BACKUP_DIR
+    return os.path.join(positions_backup.BACKUP_DIR, os.path.splitext(os.path.basename(part.path))[0])
+
+
+def start_background():
+    """Start the per-process threads: async ingest writer, audit writer, history retention and backups."""
+    if INGEST_MODE == "async":
+        _ingest_queue.start()
+    if _audit is not None:
+        _audit.start()
+    backend = _get_backend()
+    for part in backend.partitions():
+        if positions_history.HISTORY_ENABLED and positions_backends.HISTORY in part.features:
+            positions_history.RetentionJob(part.connect).start()
+        if positions_backup.BACKUP_INTERVAL_S > 0 and positions_backends.BACKUP in part.features:
+            positions_backup.BackupJob(part.path, _backup_dir(backend, part)).start()
+
+
+def shutdown(timeout: float = 30.0):
+    """Drain the per-process writers before the process exits (gunicorn worker_exit, atexit).
+
+    Async /ingest has already answered 202 for every queued row, so they are committed
+    here rather than dropped with the daemon writer thread; buffered audit records are
+    written out too. Open SSE streams are ended first.
+    """
+    stop_streams()
+    if not _ingest_queue.flush(timeout):
+        app.logger.error("shutdown: %d queued positions were not committed within %.0f s",
+                         _ingest_queue.depth(), timeout)
+    if _audit is not None:
+        _audit.stop(timeout)
 
 
 def main():
+    """Flask development server; production runs gunicorn -c gunicorn.conf.py positions_store:app."""
     _init_db()
+    start_background()
+    atexit.register(shutdown)
     app.run(host=HOST, port=PORT, debug=False)
 
 
@@ -0,0 +1,146 @@
+#!/usr/bin/env python3
+"""Saxo position model shared by the trader, live_read_status and the positions store.
+
+Saxo's /port/v1/positions returns each position as nested field groups
+(PositionBase, PositionView, DisplayAndFormat; the last two only when asked for
+through FieldGroups, see FIELD_GROUPS). parse() walks them once into a Position, a
+flat __slots__ record, so consumers read attributes instead of re-walking dicts and
+all of them map the fields the same way:
+
+- position_id <- PositionId
+- uic, account_id, asset_type, amount, open_price, status, can_be_closed <- PositionBase
+- price (CurrentPrice), market_value, pnl (ProfitLossOnTrade) <- PositionView
+- symbol <- DisplayAndFormat.Symbol, else PositionBase.Symbol, else str(uic)
+
+Numbers come out as float (None when missing or malformed) and a missing AccountId
+as ''. Items without a Uic cannot be stored and are skipped.
+
+Producers send the store Saxo's own shape, {"Data": [...]}: a raw gateway response
+can be forwarded as is, and Position.to_saxo() rebuilds one item from a model. The
+readers also accept what older producers posted: items with the fields at the top
+level instead of in groups, and the {"Data": {"Positions": [...]}} envelope.
+"""
+from typing import Any, List, Optional, Tuple
+
+FIELD_GROUPS = "PositionBase,PositionView,DisplayAndFormat"
+
+_EMPTY: dict = {}
+
+
+def _num(v) -> Optional[float]:
+    # the store keeps REALs; normalize here so in-memory rows match what SQLite returns
+    if v is None or type(v) is float:
+        return v
+    try:
+        return float(v)
+    except (TypeError, ValueError):
+        return None
+
+
+class Position:
+    """One Saxo position, flattened."""
+
+    __slots__ = ("position_id", "uic", "account_id", "symbol", "asset_type", "amount", "open_price", "price",
+                 "market_value", "pnl", "status", "can_be_closed")
+
+    def __init__(self, uic: int, account_id: str = "", symbol: Optional[str] = None, asset_type: Optional[str] = None,
+                 amount: Optional[float] = None, price: Optional[float] = None, pnl: Optional[float] = None,
+                 market_value: Optional[float] = None, open_price: Optional[float] = None,
+                 position_id: Optional[str] = None, status: Optional[str] = None,
+                 can_be_closed: Optional[bool] = None):
+        self.position_id = position_id
+        self.uic = uic
+        self.account_id = account_id
+        self.symbol = symbol or str(uic)
+        self.asset_type = asset_type
+        self.amount = amount
+        self.open_price = open_price
+        self.price = price
+        self.market_value = market_value
+        self.pnl = pnl
+        self.status = status
+        self.can_be_closed = can_be_closed
+
+    @property
+    def key(self) -> Tuple[str, int]:
+        """(account_id, uic), the store's primary key."""
+        return self.account_id, self.uic
+
+    def to_dict(self) -> dict:
+        return {name: getattr(self, name) for name in self.__slots__}
+
+    def to_saxo(self) -> dict:
+        """The position as a Saxo /port/v1/positions item (groups with only the known fields)."""
+        base = {"Uic": self.uic, "AccountId": self.account_id, "AssetType": self.asset_type, "Amount": self.amount,
+                "OpenPrice": self.open_price, "Status": self.status, "CanBeClosed": self.can_be_closed}
+        view = {"CurrentPrice": self.price, "MarketValue": self.market_value, "ProfitLossOnTrade": self.pnl}
+        item = {"PositionBase": {k: v for k, v in base.items() if v is not None},
+                "PositionView": {k: v for k, v in view.items() if v is not None},
+                "DisplayAndFormat": {"Symbol": self.symbol}}
+        if self.position_id is not None:
+            item["PositionId"] = self.position_id
+        return item
+
+    def __repr__(self):
+        return (f"Position(uic={self.uic}, account_id={self.account_id!r}, symbol={self.symbol!r}, "
+                f"asset_type={self.asset_type!r}, amount={self.amount}, price={self.price}, pnl={self.pnl})")
+
+
+def parse(item: Any) -> Optional[Position]:
+    """One Saxo position item as a Position; None when it has no usable Uic."""
+    if not isinstance(item, dict):
+        return None
+    # flattened items carry the group fields at the top level
+    base = item.get("PositionBase") or item
+    view = item.get("PositionView") or item
+    fmt = item.get("DisplayAndFormat") or _EMPTY
+    uic = base.get("Uic")
+    try:
+        uic = int(uic) if uic is not None else None
+    except (TypeError, ValueError):
+        uic = None
+    if not uic:
+        return None
+    account_id = base.get("AccountId")
+    return Position(
+        uic,
+        str(account_id) if account_id is not None else "",
+        fmt.get("Symbol") or base.get("Symbol"),
+        base.get("AssetType"),
+        _num(base.get("Amount")),
+        _num(view.get("CurrentPrice")),
+        _num(view.get("ProfitLossOnTrade")),
+        _num(view.get("MarketValue")),
+        _num(base.get("OpenPrice")),
+        item.get("PositionId"),
+        base.get("Status"),
+        base.get("CanBeClosed"),
+    )
+
+
+def items(payload: Any) -> list:
+    """The position items of a response or store payload: {"Data": [...]}, {"Positions": [...]},
+    {"Data": {"Positions": [...]}} or a bare list."""
+    if isinstance(payload, list):
+        return payload
+    if not isinstance(payload, dict):
+        return []
+    data = payload.get("Data")
+    if isinstance(data, dict):
+        data = data.get("Positions")
+    if not data:
+        data = payload.get("Positions")
+    return data if isinstance(data, list) else []
+
+
+def parse_all(payload: Any) -> Tuple[List[Position], int]:
+    """Every position in `payload` (see items()); returns (positions, items skipped)."""
+    out = []
+    skipped = 0
+    for item in items(payload):
+        p = parse(item)
+        if p is None:
+            skipped += 1
+        else:
+            out.append(p)
+    return out, skipped
@@ -0,0 +1,210 @@
+#!/usr/bin/env python3
+"""Low-overhead span instrumentation with Prometheus histograms and a trace file.
+
+    from stage_metrics import span, start_metrics_server
+
+    with span("gateway", endpoint="/port/v1/positions/me"):
+        ...
+
+Every span records its duration into a fixed-bucket histogram keyed by stage name and
+labels (one lock + one bisect per span, no allocation beyond the label tuple). The
+histograms are served in Prometheus text format on `/metrics`. If TRACE_FILE is set,
+spans are also appended to a Chrome trace-event JSON file that opens directly in
+chrome://tracing or https://ui.perfetto.dev.
+
+Config via env:
+- METRICS_PORT (default 0 = disabled) port for the /metrics endpoint
+- METRICS_HOST (default 0.0.0.0)
+- TRACE_FILE (default unset) path of the trace-event file
+"""
+import os
+import json
+import time
+import atexit
+import bisect
+import functools
+import threading
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Optional, Tuple
+
+
+METRICS_PORT = int(os.getenv("METRICS_PORT", "0"))
+METRICS_HOST = os.getenv("METRICS_HOST", "0.0.0.0")
+TRACE_FILE = os.getenv("TRACE_FILE")
+
+METRIC_NAME = "saxo_stage_duration_seconds"
+ERRORS_NAME = "saxo_stage_errors_total"
+# seconds; covers in-process work (sub-ms) up to slow gateway calls
+BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+_LabelKey = Tuple[str, Tuple[Tuple[str, str], ...]]
+
+
+class _Histogram:
+    __slots__ = ("counts", "total", "count", "errors")
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.total = 0.0
+        self.count = 0
+        self.errors = 0
+
+
+class Registry:
+    """Thread-safe histogram registry."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._hists: Dict[_LabelKey, _Histogram] = {}
+
+    def observe(self, stage: str, labels: Tuple[Tuple[str, str], ...], seconds: float, error: bool = False):
+        key = (stage, labels)
+        idx = bisect.bisect_left(BUCKETS, seconds)
+        with self._lock:
+            h = self._hists.get(key)
+            if h is None:
+                h = self._hists[key] = _Histogram()
+            h.counts[idx] += 1
+            h.total += seconds
+            h.count += 1
+            if error:
+                h.errors += 1
+
+    def snapshot(self) -> Dict[_LabelKey, dict]:
+        with self._lock:
+            return {k: {"counts": list(h.counts), "sum": h.total, "count": h.count, "errors": h.errors}
+                    for k, h in self._hists.items()}
+
+    def render_prometheus(self) -> str:
+        lines = [
+            f"# HELP {METRIC_NAME} Duration of trading-cycle stages.",
+            f"# TYPE {METRIC_NAME} histogram",
+        ]
+        err_lines = [
+            f"# HELP {ERRORS_NAME} Stages that raised an exception.",
+            f"# TYPE {ERRORS_NAME} counter",
+        ]
+        for (stage, labels), h in sorted(self.snapshot().items()):
+            base = ",".join([f'stage="{_esc(stage)}"'] + [f'{k}="{_esc(v)}"' for k, v in labels])
+            cumulative = 0
+            for bound, c in zip(BUCKETS, h["counts"]):
+                cumulative += c
+                lines.append(f'{METRIC_NAME}_bucket{{{base},le="{bound}"}} {cumulative}')
+            lines.append(f'{METRIC_NAME}_bucket{{{base},le="+Inf"}} {h["count"]}')
+            lines.append(f"{METRIC_NAME}_sum{{{base}}} {h['sum']:.6f}")
+            lines.append(f"{METRIC_NAME}_count{{{base}}} {h['count']}")
+            err_lines.append(f"{ERRORS_NAME}{{{base}}} {h['errors']}")
+        return "\n".join(lines + err_lines) + "\n"
+
+
+def _esc(v: str) -> str:
+    return str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+class TraceWriter:
+    """Appends Chrome trace events ("ph": "X") to a JSON array file.
+
+    The closing bracket is optional in this format, so the file stays valid while
+    the process is running and after a crash.
+    """
+
+    def __init__(self, path: str):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        new = not os.path.exists(path) or os.path.getsize(path) == 0
+        self._f = open(path, "a", encoding="utf-8", buffering=64 * 1024)
+        if new:
+            self._f.write("[\n")
+        self._lock = threading.Lock()
+        self._pid = os.getpid()
+        atexit.register(self.flush)
+
+    def write(self, name: str, start: float, seconds: float, args: dict):
+        event = {
+            "name": name,
+            "ph": "X",
+            "ts": int(start * 1e6),
+            "dur": int(seconds * 1e6),
+            "pid": self._pid,
+            "tid": threading.get_ident(),
+            "args": args,
+        }
+        line = json.dumps(event, separators=(",", ":"), default=str)
+        with self._lock:
+            self._f.write(line + ",\n")
+
+    def flush(self):
+        with self._lock:
+            self._f.flush()
+
+
+REGISTRY = Registry()
+_trace: Optional[TraceWriter] = TraceWriter(TRACE_FILE) if TRACE_FILE else None
+
+
+def enable_trace(path: str):
+    global _trace
+    _trace = TraceWriter(path)
+
+
+@contextmanager
+def span(stage: str, **labels):
+    """Time the enclosed block as `stage`; keyword labels become Prometheus labels."""
+    t0 = time.perf_counter()
+    wall = time.time() if _trace else 0.0
+    error = False
+    try:
+        yield
+    except BaseException:
+        error = True
+        raise
+    finally:
+        elapsed = time.perf_counter() - t0
+        key = tuple(sorted((k, str(v)) for k, v in labels.items())) if labels else ()
+        REGISTRY.observe(stage, key, elapsed, error)
+        if _trace is not None:
+            args = dict(labels)
+            if error:
+                args["error"] = True
+            _trace.write(stage, wall, elapsed, args)
+
+
+def traced(stage: str, **labels):
+    """Decorator form of span()."""
+    def deco(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with span(stage, **labels):
+                return fn(*args, **kwargs)
+        return wrapper
+    return deco
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?", 1)[0] != "/metrics":
+            self.send_response(404)
+            self.end_headers()
+            self.wfile.write(b"Not Found")
+            return
+        if _trace is not None:
+            _trace.flush()
+        body = REGISTRY.render_prometheus().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args, **kwargs):
+        return
+
+
+def start_metrics_server(port: int = METRICS_PORT, host: str = METRICS_HOST) -> Optional[ThreadingHTTPServer]:
+    """Serve /metrics from a daemon thread; no-op when port is 0."""
+    if not port:
+        return None
+    server = ThreadingHTTPServer((host, port), _MetricsHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="metrics", daemon=True).start()
+    return server
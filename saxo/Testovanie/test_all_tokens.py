@@ -1,7 +1,7 @@
 #!/usr/bin/env python3
 """Test všetkých dostupných tokenov"""
 import json
-import requests
+from http_transport import get_session
 import time
 import os
 
@@ -39,7 +39,7 @@ def refresh_token(env_name, file_path, token_url):
         }
         
         headers = {'Content-Type': 'application/x-www-form-urlencoded'}
-        r = requests.post(token_url, data=data, headers=headers, timeout=15)
+        r = get_session().post(token_url, data=data, headers=headers, timeout=15)
         
         if r.status_code == 200:
             new_tokens = r.json()
@@ -82,7 +82,7 @@ def test_api_access(env_name, file_path):
         print(f"🧪 {env_name}: testujem API prístup...")
         
         # Test user info
-        r = requests.get(f"{base_url}/ref/v1/users/me", headers=headers, timeout=10)
+        r = get_session().get(f"{base_url}/ref/v1/users/me", headers=headers, timeout=10)
         
         if r.status_code == 200:
             user_info = r.json()
@@ -14,7 +14,7 @@ import argparse
 from http.server import BaseHTTPRequestHandler, HTTPServer
 from urllib.parse import urlencode, urlparse, parse_qs
 
-import requests
+from http_transport import get_session
 
 # --- Configure ---
 # Prefer environment variables for secrets - safer than editing the file.
@@ -104,7 +104,7 @@ def try_refresh(tokens: dict):
     if CLIENT_SECRET:
         data["client_secret"] = CLIENT_SECRET
     headers = {"Content-Type": "application/x-www-form-urlencoded", "Accept": "application/json"}
-    r = requests.post(TOKEN_URL, data=data, headers=headers, timeout=30)
+    r = get_session().post(TOKEN_URL, data=data, headers=headers, timeout=30)
     if r.status_code != 200:
         print(f"Refresh failed: {r.status_code} {r.text}")
         return None
@@ -301,7 +301,7 @@ def main():
         data["code_verifier"] = verifier
 
     headers = {"Content-Type": "application/x-www-form-urlencoded", "Accept": "application/json"}
-    r = requests.post(TOKEN_URL, data=data, headers=headers, timeout=30)
+    r = get_session().post(TOKEN_URL, data=data, headers=headers, timeout=30)
     print("Token resp status:", r.status_code)
     print("Token resp headers:", dict(r.headers))
     print("Token resp body:", r.text)
@@ -0,0 +1,196 @@
+#!/usr/bin/env python3
+"""Body encodings shared by the positions store and its producers.
+
+Media types: application/json (always) and application/msgpack (needs `msgpack`).
+Content codings: gzip (always) and zstd (needs `zstandard`). The store accepts any
+combination on /ingest (Content-Type + Content-Encoding) and negotiates responses
+from Accept / Accept-Encoding; producers pick theirs from env and fall back to plain
+JSON if the store answers 415 (it lacks msgpack or zstandard). Stores older than this
+module ignore Content-Encoding, so upgrade the store before its producers.
+
+    from wire_format import post
+    post(get_session(), f"{STORE_URL}/ingest", payload)
+
+Config via env (producers):
+- STORE_WIRE_FORMAT (default json) json | msgpack
+- STORE_WIRE_ENCODING (default gzip) gzip | zstd | identity
+- STORE_WIRE_MIN_BYTES (default 1024) bodies below this are sent uncompressed
+"""
+import io
+import os
+import gzip
+import json
+import zlib
+from typing import Dict, Optional, Tuple
+
+try:
+    import msgpack
+except ImportError:  # optional
+    msgpack = None
+
+try:
+    import zstandard
+except ImportError:  # optional
+    zstandard = None
+
+JSON = "application/json"
+MSGPACK = "application/msgpack"
+# older clients send the unregistered x- form
+_MEDIA_ALIASES = {"application/x-msgpack": MSGPACK}
+
+STORE_WIRE_FORMAT = os.getenv("STORE_WIRE_FORMAT", "json").lower()
+STORE_WIRE_ENCODING = os.getenv("STORE_WIRE_ENCODING", "gzip").lower()
+MIN_BYTES = int(os.getenv("STORE_WIRE_MIN_BYTES", "1024"))
+
+# level 1/3 keep compression well under the time saved on the wire for position sets
+_GZIP_LEVEL = 1
+_ZSTD_LEVEL = 3
+
+
+class UnsupportedEncoding(ValueError):
+    """Media type or content coding this process cannot handle (HTTP 415)."""
+
+
+class BodyTooLarge(ValueError):
+    """Decoded body over the caller's limit (HTTP 413)."""
+
+
+def media_types():
+    return [JSON, MSGPACK] if msgpack is not None else [JSON]
+
+
+def encodings():
+    return ["zstd", "gzip"] if zstandard is not None else ["gzip"]
+
+
+def normalize_media(content_type: Optional[str]) -> str:
+    media = (content_type or JSON).split(";", 1)[0].strip().lower()
+    return _MEDIA_ALIASES.get(media, media)
+
+
+def dumps(obj, media: str = JSON) -> bytes:
+    if media == MSGPACK:
+        if msgpack is None:
+            raise UnsupportedEncoding("msgpack is not installed")
+        return msgpack.packb(obj, use_bin_type=True)
+    if media != JSON:
+        raise UnsupportedEncoding(f"unsupported media type {media}")
+    return json.dumps(obj, separators=(",", ":")).encode("utf-8")
+
+
+def loads(data: bytes, media: str = JSON):
+    media = normalize_media(media)
+    if media == MSGPACK:
+        if msgpack is None:
+            raise UnsupportedEncoding("msgpack is not installed")
+        return msgpack.unpackb(data, raw=False)
+    if media != JSON:
+        raise UnsupportedEncoding(f"unsupported media type {media}")
+    return json.loads(data)
+
+
+def compress(data: bytes, encoding: Optional[str]) -> bytes:
+    if not encoding or encoding == "identity":
+        return data
+    if encoding == "gzip":
+        # mtime=0: equal bodies compress to equal bytes, which http_replay matches by sha1
+        return gzip.compress(data, compresslevel=_GZIP_LEVEL, mtime=0)
+    if encoding == "zstd":
+        if zstandard is None:
+            raise UnsupportedEncoding("zstandard is not installed")
+        return zstandard.ZstdCompressor(level=_ZSTD_LEVEL).compress(data)
+    raise UnsupportedEncoding(f"unsupported content coding {encoding}")
+
+
+def decompress(data: bytes, encoding: Optional[str], max_size: int) -> bytes:
+    """Undo `encoding`; refuses output larger than `max_size` (decompression bombs)."""
+    encoding = (encoding or "identity").strip().lower()
+    if encoding == "identity":
+        out = data
+    elif encoding in ("gzip", "x-gzip"):
+        out = zlib.decompressobj(16 + zlib.MAX_WBITS).decompress(data, max_size + 1)
+    elif encoding == "zstd":
+        if zstandard is None:
+            raise UnsupportedEncoding("zstandard is not installed")
+        # stream with a cap: the frame's declared size cannot be trusted
+        reader = zstandard.ZstdDecompressor().stream_reader(io.BytesIO(data))
+        parts, size = [], 0
+        while size <= max_size:
+            chunk = reader.read(1 << 20)
+            if not chunk:
+                break
+            parts.append(chunk)
+            size += len(chunk)
+        out = b"".join(parts)
+    else:
+        raise UnsupportedEncoding(f"unsupported content coding {encoding}")
+    if len(out) > max_size:
+        raise BodyTooLarge(f"decoded body exceeds {max_size} bytes")
+    return out
+
+
+def _accepted(header: Optional[str]) -> Dict[str, float]:
+    """{token: q} from an Accept / Accept-Encoding header."""
+    out: Dict[str, float] = {}
+    for part in (header or "").split(","):
+        token, _, params = part.strip().partition(";")
+        if not token:
+            continue
+        q = 1.0
+        for p in params.split(";"):
+            k, _, v = p.strip().partition("=")
+            if k == "q":
+                try:
+                    q = float(v)
+                except ValueError:
+                    q = 0.0
+        out[token.strip().lower()] = q
+    return out
+
+
+def pick_media(accept: Optional[str]) -> str:
+    """msgpack only when the client asks for it by name; JSON otherwise."""
+    prefs = _accepted(accept)
+    if msgpack is not None and prefs.get(MSGPACK, prefs.get("application/x-msgpack", 0.0)) > prefs.get(JSON, 0.0):
+        return MSGPACK
+    return JSON
+
+
+def pick_encoding(accept_encoding: Optional[str]) -> Optional[str]:
+    """Best supported coding the client accepts (zstd before gzip), or None."""
+    prefs = _accepted(accept_encoding)
+    best, best_q = None, 0.0
+    for enc in encodings():
+        q = prefs.get(enc, prefs.get("*", 0.0))
+        if q > best_q:
+            best, best_q = enc, q
+    return best
+
+
+def encode_request(obj, media: str = STORE_WIRE_FORMAT, encoding: str = STORE_WIRE_ENCODING) -> Tuple[bytes, dict]:
+    """Body and headers for a producer POST; degrades to what is installed locally."""
+    media = MSGPACK if media in ("msgpack", MSGPACK) and msgpack is not None else JSON
+    body = dumps(obj, media)
+    headers = {"Content-Type": media, "Accept": media}
+    if encoding == "zstd" and zstandard is None:
+        encoding = "gzip"
+    if encoding in ("gzip", "zstd") and len(body) >= MIN_BYTES:
+        body = compress(body, encoding)
+        headers["Content-Encoding"] = encoding
+    return body, headers
+
+
+def post(session, url: str, obj, headers: Optional[dict] = None, timeout: float = 15, **kwargs):
+    """POST `obj` in the configured wire format; retries as plain JSON on 415."""
+    body, wire_headers = encode_request(obj)
+    r = session.post(url, data=body, headers={**(headers or {}), **wire_headers}, timeout=timeout, **kwargs)
+    if r.status_code == 415 and (wire_headers.get("Content-Encoding") or wire_headers["Content-Type"] != JSON):
+        plain = {**(headers or {}), "Content-Type": JSON}
+        r = session.post(url, data=dumps(obj), headers=plain, timeout=timeout, **kwargs)
+    return r
+
+
+def response_body(r):
+    """Decode a store response in whatever media type it was sent (codings are undone by requests,
+    zstd included when urllib3 has zstandard support)."""
+    return loads(r.content, r.headers.get("Content-Type", JSON))
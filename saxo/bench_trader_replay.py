@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+"""Offline benchmark of full trading cycles on recorded gateway traffic.
+
+1. Record a session against the demo gateway:
+       SAXO_RECORD=data/cycle.jsonl.gz python3 saxo_demo_trader.py
+2. Replay it as often as needed, without network and without the 30 s sleep:
+       python3 bench_trader_replay.py data/cycle.jsonl.gz --cycles 200
+       python3 bench_trader_replay.py data/cycle.jsonl.gz --speed 1      # recorded latency
+       python3 bench_trader_replay.py data/cycle.jsonl.gz --profile out.prof
+
+Prints per-cycle timing percentiles so code changes can be compared on identical inputs.
+"""
+import os
+import sys
+import time
+import logging
+import argparse
+import cProfile
+import statistics
+
+import saxo_demo_trader as sdt
+from http_replay import start_replay
+
+
+def _pct(values, p):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    idx = min(len(ordered) - 1, int(round(p / 100.0 * (len(ordered) - 1))))
+    return ordered[idx]
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Replay recorded Saxo traffic through the trading cycle")
+    ap.add_argument("log", help="Recorded traffic log (.jsonl.gz) from SAXO_RECORD")
+    ap.add_argument("--cycles", type=int, default=50, help="Number of trading cycles to run (default 50)")
+    ap.add_argument("--speed", type=float, default=0.0,
+                    help="Replay speed factor; 0 = no simulated latency (default), 1 = recorded latency")
+    ap.add_argument("--profile", default=None, help="Write cProfile stats of the cycles to this file")
+    ap.add_argument("--verbose", action="store_true", help="Keep trader INFO logging")
+    args = ap.parse_args()
+
+    if not os.path.exists(args.log):
+        raise SystemExit(f"Log not found: {args.log}")
+    if not args.verbose:
+        logging.getLogger(sdt.__name__).setLevel(logging.WARNING)
+
+    trader = sdt.SaxoDemoTrader()
+    strategy = sdt.HedgingStrategy(trader)
+    replay = start_replay(trader.session, args.log, speed=args.speed)
+
+    trader.get_client_info()
+    trader.get_accounts()
+
+    profiler = cProfile.Profile() if args.profile else None
+    timings = []
+    for _ in range(args.cycles):
+        t0 = time.perf_counter()
+        if profiler:
+            profiler.enable()
+        sdt.run_trading_cycle(trader, strategy)
+        if profiler:
+            profiler.disable()
+        timings.append((time.perf_counter() - t0) * 1000.0)
+
+    if profiler:
+        profiler.dump_stats(args.profile)
+        print(f"Profile written to {args.profile}")
+
+    print(f"Cycles: {len(timings)}  replay hits={replay.hits} misses={replay.misses}")
+    print(f"Cycle ms: mean={statistics.mean(timings):.2f} p50={_pct(timings, 50):.2f} "
+          f"p95={_pct(timings, 95):.2f} p99={_pct(timings, 99):.2f} max={max(timings):.2f}")
+    return 0 if replay.misses == 0 else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,180 @@
+#!/usr/bin/env python3
+"""Vectorized backtest of the hedging strategy over historical price series.
+
+Replays an underlying price series and the price of the hedge PUT (one rolled
+instrument) from a local CSV or Parquet file through the same decision helpers the
+live `HedgingStrategy` uses (`hedge_needed`, `hedge_contracts`), for a whole grid of
+(risk_threshold, hedge_ratio) combinations at once.
+
+Time-only quantities (equity value, drawdown, contract value) are computed once as
+arrays; the hedge book is a recurrence, so the time loop remains but every step
+updates all grid combinations in a single numpy operation.
+
+Model per combination:
+- hold `--shares` of the underlying for the whole period
+- each step: option exposure = contracts * put price * 100; if hedge_needed() and the
+  underlying drawdown from its running peak is >= risk_threshold, buy
+  hedge_contracts() puts at the current put price (as execute_hedge does)
+- PnL = stock PnL + mark-to-market of the puts - premium paid
+
+The live strategy does not consult risk_threshold yet; threshold 0 reproduces its
+behaviour exactly.
+
+Usage:
+    python3 hedge_backtest.py prices.csv --shares 100 \
+        --thresholds 0:0.1:41 --ratios 0.1:1.0:91 --top 10 --out results.csv
+
+Input columns (override with --time-col/--price-col/--option-col): timestamp, underlying, put.
+Parquet input needs pandas + pyarrow.
+"""
+import os
+import sys
+import csv
+import time
+import argparse
+from typing import Dict
+
+import numpy as np
+
+from saxo_demo_trader import hedge_needed, hedge_contracts
+
+CONTRACT_SIZE = 100
+
+
+def load_prices(path: str, time_col: str = "timestamp", price_col: str = "underlying",
+                option_col: str = "put") -> Dict[str, np.ndarray]:
+    """Load the price series as float arrays (time column kept as given)."""
+    ext = os.path.splitext(path)[1].lower()
+    if ext in (".parquet", ".pq"):
+        try:
+            import pandas as pd
+        except ImportError:
+            raise SystemExit("Parquet input needs pandas + pyarrow (pip install pandas pyarrow)")
+        df = pd.read_parquet(path, columns=[time_col, price_col, option_col])
+        return {
+            "time": df[time_col].to_numpy(),
+            "underlying": df[price_col].to_numpy(dtype=np.float64),
+            "put": df[option_col].to_numpy(dtype=np.float64),
+        }
+    times, under, puts = [], [], []
+    with open(path, "r", encoding="utf-8", newline="") as f:
+        for row in csv.DictReader(f):
+            times.append(row.get(time_col))
+            under.append(float(row[price_col]))
+            puts.append(float(row[option_col]))
+    return {
+        "time": np.array(times, dtype=object),
+        "underlying": np.array(under, dtype=np.float64),
+        "put": np.array(puts, dtype=np.float64),
+    }
+
+
+def parse_grid(spec: str) -> np.ndarray:
+    """'a,b,c' -> list of values; 'start:stop:num' -> linspace(start, stop, num)."""
+    if ":" in spec:
+        start, stop, num = spec.split(":")
+        return np.linspace(float(start), float(stop), int(num))
+    return np.array([float(v) for v in spec.split(",") if v.strip()], dtype=np.float64)
+
+
+def run_backtest(underlying: np.ndarray, put: np.ndarray, shares: float,
+                 thresholds: np.ndarray, ratios: np.ndarray) -> Dict[str, np.ndarray]:
+    """Simulate every (threshold, ratio) combination; returns per-combination arrays."""
+    th, hr = np.meshgrid(thresholds, ratios, indexing="ij")
+    th = th.ravel()
+    hr = hr.ravel()
+    n = th.size
+
+    # time-only series, computed once for the whole grid
+    equity = shares * underlying
+    drawdown = 1.0 - underlying / np.maximum.accumulate(underlying)
+    contract_value = put * CONTRACT_SIZE
+    stock_pnl = equity - equity[0]
+
+    contracts = np.zeros(n)
+    premium = np.zeros(n)
+    trades = np.zeros(n, dtype=np.int64)
+    peak_pnl = np.zeros(n)
+    max_dd = np.zeros(n)
+    pnl = np.zeros(n)
+
+    for t in range(underlying.size):
+        option_exposure = contracts * contract_value[t]
+        need = hedge_needed(equity[t], option_exposure, hr) & (drawdown[t] >= th)
+        buy = np.where(need, hedge_contracts(equity[t], hr), 0.0)
+        contracts += buy
+        premium += buy * contract_value[t]
+        trades += buy > 0
+
+        pnl = stock_pnl[t] + contracts * contract_value[t] - premium
+        np.maximum(peak_pnl, pnl, out=peak_pnl)
+        np.maximum(max_dd, peak_pnl - pnl, out=max_dd)
+
+    return {
+        "risk_threshold": th,
+        "hedge_ratio": hr,
+        "final_pnl": pnl,
+        "max_drawdown": max_dd,
+        "premium_paid": premium,
+        "contracts": contracts,
+        "trades": trades,
+    }
+
+
+def rank(results: Dict[str, np.ndarray], by: str = "final_pnl") -> np.ndarray:
+    if by == "calmar":
+        score = results["final_pnl"] / np.maximum(results["max_drawdown"], 1e-9)
+    else:
+        score = results[by]
+    return np.argsort(-score, kind="stable")
+
+
+def write_results(path: str, results: Dict[str, np.ndarray], order: np.ndarray):
+    cols = list(results.keys())
+    with open(path, "w", encoding="utf-8", newline="") as f:
+        w = csv.writer(f)
+        w.writerow(cols)
+        for i in order:
+            w.writerow([results[c][i] for c in cols])
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Vectorized (risk_threshold, hedge_ratio) backtest")
+    ap.add_argument("prices", help="CSV or Parquet file with underlying and put price columns")
+    ap.add_argument("--time-col", default="timestamp")
+    ap.add_argument("--price-col", default="underlying")
+    ap.add_argument("--option-col", default="put")
+    ap.add_argument("--shares", type=float, default=100.0, help="Underlying position size (default 100)")
+    ap.add_argument("--thresholds", default="0:0.1:21", help="Grid for risk_threshold (default 0:0.1:21)")
+    ap.add_argument("--ratios", default="0.1:1.0:10", help="Grid for hedge_ratio (default 0.1:1.0:10)")
+    ap.add_argument("--rank-by", default="final_pnl", choices=["final_pnl", "calmar", "max_drawdown"])
+    ap.add_argument("--top", type=int, default=10, help="Print N best combinations (default 10)")
+    ap.add_argument("--out", default=None, help="Optional CSV with all combinations, ranked")
+    args = ap.parse_args()
+
+    data = load_prices(args.prices, args.time_col, args.price_col, args.option_col)
+    thresholds = parse_grid(args.thresholds)
+    ratios = parse_grid(args.ratios)
+
+    t0 = time.perf_counter()
+    results = run_backtest(data["underlying"], data["put"], args.shares, thresholds, ratios)
+    elapsed = time.perf_counter() - t0
+    order = rank(results, args.rank_by)
+    if args.rank_by == "max_drawdown":
+        order = order[::-1]
+
+    n = results["final_pnl"].size
+    print(f"Steps: {data['underlying'].size}  combinations: {n}  elapsed: {elapsed:.3f}s")
+    print(f"{'threshold':>10} {'ratio':>7} {'final_pnl':>12} {'max_dd':>12} {'premium':>12} {'trades':>7}")
+    for i in order[:args.top]:
+        print(f"{results['risk_threshold'][i]:>10.4f} {results['hedge_ratio'][i]:>7.3f} "
+              f"{results['final_pnl'][i]:>12.2f} {results['max_drawdown'][i]:>12.2f} "
+              f"{results['premium_paid'][i]:>12.2f} {results['trades'][i]:>7d}")
+    if args.out:
+        write_results(args.out, results, order)
+        print(f"Results written to {args.out}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
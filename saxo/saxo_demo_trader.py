@@ -4,17 +4,32 @@ Saxo Demo Trader - Automatizovaný trading s reálnym Saxo API
 Používa token-proxy pre získanie tokenov a implementuje hedging stratégiu.
 """
 import os
+import sys
 import time
 import json
 import requests
 import logging
+import tempfile
+import threading
 from datetime import datetime, timedelta
 from typing import Dict, List, Optional, Any
 
+# Zdieľaný HTTP transport (connection pool, keep-alive, retry) žije v Testovanie/
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "Testovanie"))
+from http_transport import get_session  # noqa: E402
+from http_replay import install_from_env  # noqa: E402
+from stage_metrics import span, traced, start_metrics_server  # noqa: E402
+from wire_format import post as post_wire  # noqa: E402
+import saxo_positions  # noqa: E402
+from saxo_positions import Position  # noqa: E402
+
 # Konfigurácia
 TOKEN_PROXY_URL = os.getenv("TOKEN_PROXY_URL", "http://91.98.81.44:8080/token")
 SAXO_API_BASE = "https://gateway.saxobank.com/sim/openapi"  # Demo endpoint
 POSITIONS_STORE_URL = os.getenv("POSITIONS_STORE_URL", "http://91.98.81.44:8090")
+BOOTSTRAP_CACHE_FILE = os.getenv("BOOTSTRAP_CACHE_FILE", "data/trader_bootstrap.json")
+BOOTSTRAP_CACHE_TTL = int(os.getenv("BOOTSTRAP_CACHE_TTL", "86400"))  # ClientKey/AccountKey sa nemenia
+SNAPSHOT_MAX_AGE = int(os.getenv("SNAPSHOT_MAX_AGE", "120"))  # max. vek pozícií z cache pri výpadku API
 
 # Logging setup
 logging.basicConfig(
@@ -28,10 +43,18 @@ class SaxoDemoTrader:
     """Saxo Demo Trading Client s automatickým token managementom"""
     
     def __init__(self):
-        self.session = requests.Session()
+        self.session = get_session()
         self.client_key = None
         self.account_key = None
+        self.client_info: Dict = {}
+        self.accounts: List[Dict] = []
+        # surové položky zo Saxo (bootstrap cache ich ukladá tak, ako prišli)
+        self.positions_snapshot: List[Dict] = []
+        self.positions_snapshot_at = 0
+        # True, keď get_positions vrátil pozície z cache namiesto živej odpovede (iba na zobrazenie)
+        self.positions_stale = False
         
+    @traced("token_fetch")
     def get_access_token(self) -> str:
         """Získa aktuálny access token z token-proxy"""
         try:
@@ -54,16 +77,8 @@ class SaxoDemoTrader:
         url = f"{SAXO_API_BASE}{endpoint}"
         
         try:
-            if method.upper() == "GET":
-                response = self.session.get(url, headers=headers, timeout=30)
-            elif method.upper() == "POST":
-                response = self.session.post(url, headers=headers, json=data, timeout=30)
-            elif method.upper() == "PUT":
-                response = self.session.put(url, headers=headers, json=data, timeout=30)
-            elif method.upper() == "DELETE":
-                response = self.session.delete(url, headers=headers, timeout=30)
-            else:
-                raise ValueError(f"Nepodporovaná HTTP metóda: {method}")
+            with span("gateway", method=method.upper(), endpoint=endpoint.split("?", 1)[0]):
+                response = self._send(method, url, headers, data)
             
             response.raise_for_status()
             return response.json() if response.content else {}
@@ -75,11 +90,25 @@ class SaxoDemoTrader:
             logger.error(f"API request chyba: {e}")
             raise
     
+    def _send(self, method: str, url: str, headers: Dict, data: Dict = None) -> requests.Response:
+        """Odošle HTTP request zvolenou metódou"""
+        if method.upper() == "GET":
+            return self.session.get(url, headers=headers, timeout=30)
+        elif method.upper() == "POST":
+            return self.session.post(url, headers=headers, json=data, timeout=30)
+        elif method.upper() == "PUT":
+            return self.session.put(url, headers=headers, json=data, timeout=30)
+        elif method.upper() == "DELETE":
+            return self.session.delete(url, headers=headers, timeout=30)
+        else:
+            raise ValueError(f"Nepodporovaná HTTP metóda: {method}")
+    
     def get_client_info(self) -> Dict:
         """Získa informácie o klientovi a nastaví client_key"""
         try:
             client_info = self.make_api_request("GET", "/port/v1/clients/me")
             self.client_key = client_info.get("ClientKey")
+            self.client_info = client_info
             logger.info(f"Client Key: {self.client_key}")
             return client_info
         except Exception as e:
@@ -94,21 +123,54 @@ class SaxoDemoTrader:
                 # Použij prvý účet
                 self.account_key = accounts["Data"][0].get("AccountKey")
                 logger.info(f"Account Key: {self.account_key}")
-            return accounts.get("Data", [])
+            self.accounts = accounts.get("Data", [])
+            return self.accounts
         except Exception as e:
             logger.error(f"Chyba pri získaní účtov: {e}")
             raise
     
-    def get_positions(self) -> List[Dict]:
-        """Získa aktuálne pozície"""
+    def get_positions(self) -> List[Position]:
+        """Získa aktuálne pozície (PositionView kvôli cene a MarketValue, DisplayAndFormat kvôli symbolu)"""
         try:
-            endpoint = f"/port/v1/positions/me?ClientKey={self.client_key}"
+            endpoint = (f"/port/v1/positions/me?ClientKey={self.client_key}"
+                        f"&FieldGroups={saxo_positions.FIELD_GROUPS}")
             positions = self.make_api_request("GET", endpoint)
-            return positions.get("Data", [])
+            self.positions_snapshot = saxo_positions.items(positions)
+            self.positions_snapshot_at = int(time.time())
+            self.positions_stale = False
+            return saxo_positions.parse_all(self.positions_snapshot)[0]
         except Exception as e:
             logger.error(f"Chyba pri získaní pozícií: {e}")
+            self.positions_stale = True
+            age = int(time.time()) - self.positions_snapshot_at
+            if self.positions_snapshot and age <= SNAPSHOT_MAX_AGE:
+                # len na zobrazenie: snapshot môže byť spred hedge, run_trading_cycle s ním neobchoduje
+                logger.warning(f"Používam posledné známe pozície (vek {age}s), hedging sa preskočí")
+                return saxo_positions.parse_all(self.positions_snapshot)[0]
             return []
     
+    def apply_bootstrap(self, cache: Dict):
+        """Nastaví client/account kľúče a posledný snapshot pozícií z cache"""
+        self.client_info = cache.get("client_info") or {}
+        self.accounts = cache.get("accounts") or []
+        self.client_key = cache.get("client_key")
+        self.account_key = cache.get("account_key")
+        self.positions_snapshot = cache.get("positions") or []
+        self.positions_snapshot_at = int(cache.get("positions_at") or 0)
+    
+    def revalidate_bootstrap(self):
+        """Znova overí client/account kľúče cez API (beží na pozadí po štarte z cache)"""
+        old = (self.client_key, self.account_key)
+        try:
+            self.get_client_info()
+            self.get_accounts()
+        except Exception as e:
+            logger.warning(f"Revalidácia bootstrap cache zlyhala: {e}")
+            return
+        if (self.client_key, self.account_key) != old:
+            logger.warning(f"Bootstrap cache bola neaktuálna: {old} -> {(self.client_key, self.account_key)}")
+        save_bootstrap_cache(self)
+    
     def get_balance_and_margin(self) -> Dict:
         """Získa balance a margin informácie"""
         try:
@@ -142,6 +204,7 @@ class SaxoDemoTrader:
             logger.error(f"Chyba pri vyhľadávaní inštrumentov: {e}")
             return []
     
+    @traced("order_placement")
     def place_order(self, order_data: Dict) -> Dict:
         """Zadá objednávku (BUY/SELL)"""
         try:
@@ -193,6 +256,75 @@ class SaxoDemoTrader:
             return {}
 
 
+def _bootstrap_fingerprint() -> str:
+    # cache platí iba pre rovnaké API prostredie a rovnaký token-proxy (= rovnaký účet)
+    return f"{SAXO_API_BASE}|{TOKEN_PROXY_URL}"
+
+
+def load_bootstrap_cache(path: str = None) -> Optional[Dict]:
+    """Načíta bootstrap cache, ak existuje a je platná (fingerprint, vek, kľúče)"""
+    path = path or BOOTSTRAP_CACHE_FILE
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            cache = json.load(f)
+    except Exception:
+        return None
+    if cache.get("fingerprint") != _bootstrap_fingerprint():
+        return None
+    if int(time.time()) - int(cache.get("saved_at") or 0) > BOOTSTRAP_CACHE_TTL:
+        return None
+    if not cache.get("client_key") or not cache.get("account_key"):
+        return None
+    return cache
+
+
+def save_bootstrap_cache(trader: "SaxoDemoTrader", path: str = None):
+    """Atomicky uloží client/account info a posledný snapshot pozícií"""
+    path = path or BOOTSTRAP_CACHE_FILE
+    if not trader.client_key or not trader.account_key:
+        return
+    cache = {
+        "fingerprint": _bootstrap_fingerprint(),
+        "saved_at": int(time.time()),
+        "client_key": trader.client_key,
+        "account_key": trader.account_key,
+        "client_info": trader.client_info,
+        "accounts": trader.accounts,
+        "positions": trader.positions_snapshot,
+        "positions_at": trader.positions_snapshot_at,
+    }
+    try:
+        dirpath = os.path.dirname(path) or "."
+        os.makedirs(dirpath, exist_ok=True)
+        # vlastný dočasný súbor pre každý zápis: volá sa z hlavného loopu aj z revalidácie na pozadí
+        fd, tmp_path = tempfile.mkstemp(dir=dirpath, prefix=f".{os.path.basename(path)}.", suffix=".tmp")
+        try:
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                json.dump(cache, f)
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+    except Exception as e:
+        logger.warning(f"Nepodarilo sa uložiť bootstrap cache: {e}")
+
+
+def hedge_needed(equity_exposure, option_exposure, hedge_ratio):
+    """Hedge je potrebný, ak opcie pokrývajú menej ako hedge_ratio equity expozície.
+    
+    Funguje pre skaláry aj numpy polia (používa ho aj hedge_backtest).
+    """
+    return (equity_exposure > 0) & (abs(option_exposure) < hedge_ratio * equity_exposure)
+
+
+def hedge_contracts(equity_value, hedge_ratio):
+    """Počet PUT kontraktov (po 100 kusov) na hedge danej equity hodnoty.
+    
+    Funguje pre skaláry aj numpy polia (používa ho aj hedge_backtest).
+    """
+    return (abs(equity_value) * hedge_ratio / 100) // 1
+
+
 class HedgingStrategy:
     """Implementácia hedging stratégie pre Saxo demo trading"""
     
@@ -201,15 +333,16 @@ class HedgingStrategy:
         self.risk_threshold = 0.02  # 2% risk threshold
         self.hedge_ratio = 0.8  # 80% hedge ratio
         
-    def analyze_portfolio_risk(self, positions: List[Dict]) -> Dict:
+    @traced("risk_analysis")
+    def analyze_portfolio_risk(self, positions: List[Position]) -> Dict:
         """Analyzuje riziko portfólia"""
         total_exposure = 0
         equity_exposure = 0
         option_exposure = 0
         
         for position in positions:
-            market_value = position.get("MarketValue", 0)
-            asset_type = position.get("PositionBase", {}).get("AssetType", "")
+            market_value = position.market_value or 0
+            asset_type = position.asset_type
             
             total_exposure += market_value
             
@@ -222,9 +355,10 @@ class HedgingStrategy:
             "total_exposure": total_exposure,
             "equity_exposure": equity_exposure,
             "option_exposure": option_exposure,
-            "hedge_needed": equity_exposure > 0 and abs(option_exposure / equity_exposure) < self.hedge_ratio
+            "hedge_needed": bool(hedge_needed(equity_exposure, option_exposure, self.hedge_ratio))
         }
     
+    @traced("hedge_search")
     def find_hedge_instruments(self, symbol: str) -> List[Dict]:
         """Nájde vhodné hedging inštrumenty (PUT opcie)"""
         try:
@@ -258,7 +392,7 @@ class HedgingStrategy:
         except:
             return False
     
-    def execute_hedge(self, equity_position: Dict, hedge_instruments: List[Dict]) -> Dict:
+    def execute_hedge(self, equity_position: Position, hedge_instruments: List[Dict]) -> Dict:
         """Vykoná hedging transakciu"""
         try:
             if not hedge_instruments:
@@ -268,8 +402,8 @@ class HedgingStrategy:
             best_put = hedge_instruments[0]  # Zjednodušené - v realite by sme vybrali najlepšiu
             
             # Vypočítaj množstvo na hedge
-            equity_value = equity_position.get("MarketValue", 0)
-            hedge_amount = int(abs(equity_value) * self.hedge_ratio / 100)  # PUT opcie sa obchodujú po 100
+            equity_value = equity_position.market_value or 0
+            hedge_amount = int(hedge_contracts(equity_value, self.hedge_ratio))  # PUT opcie sa obchodujú po 100
             
             if hedge_amount > 0:
                 order_result = self.trader.create_market_order(
@@ -293,36 +427,64 @@ class HedgingStrategy:
             return {"status": "failed", "reason": str(e)}
 
 
-def update_positions_store(positions: List[Dict]):
+@traced("store_push")
+def update_positions_store(positions: List[Position], raw_items: Optional[List[Dict]] = None):
     """Aktualizuje positions store s novými pozíciami"""
     try:
-        # Konvertuj Saxo pozície do formátu positions store
-        converted_positions = []
-        for pos in positions:
-            position_base = pos.get("PositionBase", {})
-            converted_pos = {
-                "Uic": position_base.get("Uic"),
-                "AssetType": position_base.get("AssetType"),
-                "Amount": position_base.get("Amount", 0),
-                "CanBeClosed": position_base.get("CanBeClosed", True),
-                "SourceOrderId": position_base.get("SourceOrderId", ""),
-                "ExecutionTimeOpen": position_base.get("ExecutionTimeOpen", ""),
-                "Status": position_base.get("Status", "Open"),
-                "MarketValue": pos.get("MarketValue", 0),
-                "ProfitLossOnTrade": pos.get("ProfitLossOnTrade", 0)
-            }
-            converted_positions.append(converted_pos)
-        
-        # Pošli do positions store
-        payload = {"Data": {"Positions": converted_positions}}
-        response = requests.post(f"{POSITIONS_STORE_URL}/ingest", json=payload, timeout=10)
+        # store číta Saxo tvar {"Data": [...]} (saxo_positions); surové položky z gateway idú bez zmeny,
+        # aby audit log v store (AUDIT_ENABLED) ukazoval presne to, čo Saxo vrátilo
+        items = raw_items if raw_items is not None else [p.to_saxo() for p in positions]
+        payload = {"Data": items}
+        # gzip/zstd + JSON/MessagePack podľa STORE_WIRE_*; pri 415 sa pošle čistý JSON
+        response = post_wire(get_session(), f"{POSITIONS_STORE_URL}/ingest", payload, timeout=10)
         response.raise_for_status()
-        logger.info(f"Updated positions store with {len(converted_positions)} positions")
+        logger.info(f"Updated positions store with {len(positions)} positions")
         
     except Exception as e:
         logger.error(f"Chyba pri aktualizácii positions store: {e}")
 
 
+@traced("cycle")
+def run_trading_cycle(trader: SaxoDemoTrader, strategy: HedgingStrategy) -> Dict:
+    """Jeden cyklus trading loopu: pozície, store, risk analýza a prípadný hedge"""
+    logger.info("📊 Získavam aktuálne pozície...")
+    positions = trader.get_positions()
+    balance = trader.get_balance_and_margin()
+    
+    logger.info(f"Pozície: {len(positions)}")
+    logger.info(f"Cash Balance: {balance.get('CashBalance', 'N/A')}")
+    
+    # Pozície z cache (výpadok API) nejdú do store ani do hedgingu: store by im dal čerstvý čas
+    # a hedge podľa snapshotu spred posledného obchodu by ho mohol zopakovať
+    stale = trader.positions_stale
+    if not stale:
+        # Aktualizuj positions store (surový snapshot, z ktorého boli pozície načítané)
+        update_positions_store(positions, trader.positions_snapshot if positions else None)
+    
+    # Analyzuj risk a vykonaj hedging ak treba
+    risk_analysis = strategy.analyze_portfolio_risk(positions)
+    logger.info(f"Risk Analysis: {risk_analysis}")
+    
+    if stale:
+        logger.warning("⚠️ Pozície nie sú živé, hedging preskakujem")
+        risk_analysis["stale"] = True
+    elif risk_analysis.get("hedge_needed"):
+        logger.info("🛡️ Hedging potrebný...")
+        
+        # Nájdi equity pozície ktoré potrebujú hedge
+        for position in positions:
+            if position.asset_type == "Stock":
+                symbol = position.symbol
+                logger.info(f"Hľadám hedge pre {symbol}...")
+                
+                hedge_instruments = strategy.find_hedge_instruments(symbol)
+                if hedge_instruments:
+                    hedge_result = strategy.execute_hedge(position, hedge_instruments)
+                    logger.info(f"Hedge result: {hedge_result}")
+    
+    return risk_analysis
+
+
 def main():
     """Hlavná funkcia - demo trading loop"""
     logger.info("🚀 Spúšťam Saxo Demo Trader...")
@@ -332,9 +494,22 @@ def main():
         trader = SaxoDemoTrader()
         strategy = HedgingStrategy(trader)
         
-        # Získaj základné info
-        client_info = trader.get_client_info()
-        accounts = trader.get_accounts()
+        # SAXO_RECORD / SAXO_REPLAY: nahrávanie alebo prehrávanie HTTP komunikácie
+        install_from_env(trader.session)
+        
+        # METRICS_PORT: Prometheus /metrics, TRACE_FILE: lokálny trace súbor
+        start_metrics_server()
+        
+        # Získaj základné info - z cache (revalidácia na pozadí) alebo z API
+        cache = load_bootstrap_cache()
+        if cache:
+            trader.apply_bootstrap(cache)
+            client_info, accounts = trader.client_info, trader.accounts
+            logger.info("⚡ Bootstrap z cache, revalidujem na pozadí...")
+            threading.Thread(target=trader.revalidate_bootstrap, name="bootstrap-revalidate", daemon=True).start()
+        else:
+            client_info = trader.get_client_info()
+            accounts = trader.get_accounts()
         
         logger.info(f"Pripojený ako: {client_info.get('Name')}")
         logger.info(f"Počet účtov: {len(accounts)}")
@@ -342,34 +517,8 @@ def main():
         # Hlavný trading loop
         while True:
             try:
-                logger.info("📊 Získavam aktuálne pozície...")
-                positions = trader.get_positions()
-                balance = trader.get_balance_and_margin()
-                
-                logger.info(f"Pozície: {len(positions)}")
-                logger.info(f"Cash Balance: {balance.get('CashBalance', 'N/A')}")
-                
-                # Aktualizuj positions store
-                update_positions_store(positions)
-                
-                # Analyzuj risk a vykonaj hedging ak treba
-                risk_analysis = strategy.analyze_portfolio_risk(positions)
-                logger.info(f"Risk Analysis: {risk_analysis}")
-                
-                if risk_analysis.get("hedge_needed"):
-                    logger.info("🛡️ Hedging potrebný...")
-                    
-                    # Nájdi equity pozície ktoré potrebujú hedge
-                    for position in positions:
-                        position_base = position.get("PositionBase", {})
-                        if position_base.get("AssetType") == "Stock":
-                            symbol = position_base.get("Symbol", "")
-                            logger.info(f"Hľadám hedge pre {symbol}...")
-                            
-                            hedge_instruments = strategy.find_hedge_instruments(symbol)
-                            if hedge_instruments:
-                                hedge_result = strategy.execute_hedge(position, hedge_instruments)
-                                logger.info(f"Hedge result: {hedge_result}")
+                run_trading_cycle(trader, strategy)
+                save_bootstrap_cache(trader)
                 
                 # Demo: každých 30 sekúnd
                 logger.info("⏳ Čakám 30 sekúnd...")